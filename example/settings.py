@@ -55,6 +55,8 @@ TEMPLATE_LOADERS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    'lebay.apps.lebay.profiling.RequestProfilingMiddleware',
+    'lebay.apps.lebay.replication.ReplicationMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -84,3 +86,57 @@ INSTALLED_APPS = (
     'lebay.apps.lebay',
     'uni_form',
 )
+
+# Set to a file path to accept bids in memory and write them to the
+# database in batches. Only safe with a single process serving bids. The
+# auction closer then waits two flush intervals past an auction's end so
+# the last bids are written before it settles.
+LEBAY_ORDER_BOOK_JOURNAL = None
+
+# The home page dashboards are cached here and invalidated by the auction
+# closer and archive_auctions from their own processes, so the backend has
+# to be shared between processes: file:// on one box, memcached:// across
+# several. With locmem:// a dashboard stays stale for up to an hour.
+CACHE_BACKEND = 'file://%s/cache' % DB_ROOT
+
+# Rendered auction detail and bid history fragments. The default keeps a
+# per-process LRU; 'file:///var/tmp/lebay_fragments' shares one store
+# between the processes of a single box.
+LEBAY_FRAGMENT_CACHE_BACKEND = 'lebay.apps.lebay.lrucache://?max_entries=1000'
+LEBAY_FRAGMENT_CACHE_TIMEOUT = 60 * 60
+
+# Seconds between checks for auction changes made by other processes
+# while someone is watching the auction live.
+LEBAY_LIVE_POLL_INTERVAL = 1.0
+
+# Hold live auction requests open until something changes. Each watcher
+# then ties up a request thread for up to 25 seconds, so only turn this
+# on behind a threaded server; the single threaded runserver would stall
+# every other page. Off, pages ask again every few seconds.
+LEBAY_LIVE_LONG_POLL = False
+
+# A bid this many seconds or less before the end pushes the end out to
+# that many seconds after the bid. 0 turns soft close off.
+LEBAY_SOFT_CLOSE_SECONDS = 120
+
+# Read only listing, search, category and profile views read
+# from one of these databases, each given as the DATABASE_* settings that
+# differ from the primary. To try it locally with SQLite, use
+# [{'DATABASE_NAME': '%s/replica.db' % DB_ROOT}] and refresh the copy with
+# sync_sqlite_replicas.
+LEBAY_READ_REPLICAS = []
+# Seconds a client keeps reading from the primary after it wrote.
+LEBAY_REPLICA_PIN_SECONDS = 10
+
+# archive_auctions moves auctions closed more than this many days ago, with
+# their bids and sales, into one SQLite file per month in this directory.
+# Ended auction, bid history and payment pages read from both.
+LEBAY_ARCHIVE_ROOT = '%s/archive' % DB_ROOT
+LEBAY_ARCHIVE_AFTER_DAYS = 180
+
+# Requests kept by the profiling middleware for the staff stats page,
+# and the fraction of requests run under cProfile. Only the slowest
+# profiled requests are kept.
+LEBAY_PROFILING_BUFFER_SIZE = 1000
+LEBAY_PROFILING_SAMPLE_RATE = 0
+LEBAY_PROFILING_SLOWEST_KEPT = 10
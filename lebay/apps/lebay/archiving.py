@@ -0,0 +1,368 @@
+import datetime
+import os
+
+from django.conf import settings
+from django.core import signals
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.backends.sqlite3.base import DatabaseWrapper as SQLiteDatabaseWrapper
+from django.db.models import DateTimeField, sql
+from django.db.models.query import QuerySet
+
+from lebay.apps.lebay.models import AuctionEvent, ArchivedAuctionEvent, Bid, Item, ProxyBid, Sales, User
+from lebay.apps.lebay.signals import auctions_archived
+from lebay.apps.lebay.constants import SALES_PAYMENT_STATUS_PROCESSING, SALES_PAYMENT_STATUS_DISPUTED, AUCTION_EVENT_ARCHIVE_CHUNK_SIZE, AUCTION_EVENT_ARCHIVE_FILENAME
+
+ARCHIVE_ROOT = getattr(settings, 'LEBAY_ARCHIVE_ROOT', None)
+ARCHIVE_AFTER_DAYS = getattr(settings, 'LEBAY_ARCHIVE_AFTER_DAYS', 180)
+ARCHIVED_MODELS = (AuctionEvent, Bid, Sales)
+
+_archive_connections = {}
+
+def get_month(closed_at):
+    return closed_at.strftime('%Y-%m')
+
+def get_archive_path(month):
+    return os.path.join(ARCHIVE_ROOT, AUCTION_EVENT_ARCHIVE_FILENAME % month)
+
+def get_archive_connection(month):
+    # Archives are SQLite files whatever the primary database is. The
+    # wrappers are thread local, like the primary and the replicas.
+    if month not in _archive_connections:
+        _archive_connections[month] = SQLiteDatabaseWrapper({
+            'DATABASE_NAME': get_archive_path(month),
+            'DATABASE_OPTIONS': {},
+            'TIME_ZONE': settings.TIME_ZONE,
+        })
+    return _archive_connections[month]
+
+def has_archive(month):
+    return bool(ARCHIVE_ROOT) and os.path.exists(get_archive_path(month))
+
+def get_archive_query_set(model, month):
+    return QuerySet(model, sql.Query(model, get_archive_connection(month)))
+
+def create_archive_tables(archive_connection):
+    cursor = archive_connection.cursor()
+    existing_tables = archive_connection.introspection.table_names()
+    style = no_style()
+    for model in ARCHIVED_MODELS:
+        if model._meta.db_table in existing_tables:
+            continue
+        statements, pending_references = archive_connection.creation.sql_create_model(model, style, set(ARCHIVED_MODELS))
+        statements.extend(archive_connection.creation.sql_indexes_for_model(model, style))
+        for statement in statements:
+            cursor.execute(statement)
+    archive_connection._commit()
+
+def get_columns(model):
+    return [field.column for field in model._meta.local_fields]
+
+def get_copied_columns(model):
+    # Django's SQLite converter reads microseconds through a float and can
+    # come back one short, so datetimes are copied as the text stored.
+    qn = connection.ops.quote_name
+    columns = []
+    for field in model._meta.local_fields:
+        if settings.DATABASE_ENGINE == 'sqlite3' and isinstance(field, DateTimeField):
+            columns.append('CAST(%s AS TEXT)' % qn(field.column))
+        else:
+            columns.append(qn(field.column))
+    return columns
+
+def copy_rows(archive_connection, model, filter_column, ids):
+    qn = connection.ops.quote_name
+    columns = get_columns(model)
+    cursor = connection.cursor()
+    cursor.execute('SELECT %s FROM %s WHERE %s IN (%s)' % (
+        ', '.join(get_copied_columns(model)), qn(model._meta.db_table),
+        qn(filter_column), ', '.join(['%s'] * len(ids))), ids)
+    rows = cursor.fetchall()
+    if rows:
+        # Replacing keeps a rerun idempotent when the live rows outlived a
+        # crash after the archive was committed.
+        aqn = archive_connection.ops.quote_name
+        archive_connection.cursor().executemany('INSERT OR REPLACE INTO %s (%s) VALUES (%s)' % (
+            aqn(model._meta.db_table), ', '.join([aqn(column) for column in columns]),
+            ', '.join(['%s'] * len(columns))), rows)
+    return len(rows)
+
+def get_archivable_ids(cutoff):
+    # Only auctions nothing can change any more: closed long enough ago and
+    # with no payment still being processed or disputed.
+    open_sales = Sales.objects.filter(payment_status__in=[SALES_PAYMENT_STATUS_PROCESSING, SALES_PAYMENT_STATUS_DISPUTED]).values('auction_event')
+    return list(AuctionEvent.objects.filter(closed_at__lt=cutoff).exclude(pk__in=open_sales).order_by('pk').values_list('pk', flat=True))
+
+def _archive_month(month, auction_event_ids):
+    archive_connection = get_archive_connection(month)
+    create_archive_tables(archive_connection)
+    try:
+        copy_rows(archive_connection, AuctionEvent, 'id', auction_event_ids)
+        bid_count = copy_rows(archive_connection, Bid, 'auction_event_id', auction_event_ids)
+        sale_count = copy_rows(archive_connection, Sales, 'auction_event_id', auction_event_ids)
+    except:
+        archive_connection._rollback()
+        raise
+    archive_connection._commit()
+    return bid_count, sale_count
+
+@transaction.commit_on_success
+def _archive_chunk(auction_event_ids):
+    rows = AuctionEvent.objects.filter(pk__in=auction_event_ids).values_list('pk', 'item', 'winning_bidder', 'closed_at')
+    months = {}
+    for pk, item_id, winning_bidder_id, closed_at in rows:
+        months.setdefault(get_month(closed_at), []).append(pk)
+
+    # Every archive file is committed before anything live is deleted.
+    bid_count = 0
+    sale_count = 0
+    for month, month_ids in months.items():
+        month_bid_count, month_sale_count = _archive_month(month, month_ids)
+        bid_count += month_bid_count
+        sale_count += month_sale_count
+
+    sale_counts = {}
+    for auction_event_id in Sales.objects.filter(auction_event__in=auction_event_ids).values_list('auction_event', flat=True):
+        sale_counts[auction_event_id] = sale_counts.get(auction_event_id, 0) + 1
+    current_time = datetime.datetime.now()
+    qn = connection.ops.quote_name
+    cursor = connection.cursor()
+    cursor.execute('DELETE FROM %s WHERE %s IN (%s)' % (qn(ArchivedAuctionEvent._meta.db_table), qn('auction_event_id'), ', '.join(['%s'] * len(auction_event_ids))), auction_event_ids)
+    cursor.executemany('INSERT INTO %s (%s, %s, %s, %s, %s, %s, %s) VALUES (%%s, %%s, %%s, %%s, %%s, %%s, %%s)' % (
+        qn(ArchivedAuctionEvent._meta.db_table), qn('auction_event_id'), qn('item_id'), qn('winning_bidder_id'),
+        qn('month'), qn('closed_at'), qn('sale_count'), qn('time_archived')),
+        [(pk, item_id, winning_bidder_id, get_month(closed_at), connection.ops.value_to_db_datetime(closed_at), sale_counts.get(pk, 0), connection.ops.value_to_db_datetime(current_time)) for pk, item_id, winning_bidder_id, closed_at in rows])
+
+    # Receivers still see the live rows.
+    auctions_archived.send(sender=AuctionEvent, auction_event_ids=auction_event_ids)
+
+    placeholders = ', '.join(['%s'] * len(auction_event_ids))
+    cursor.execute('UPDATE %s SET %s = NULL WHERE %s IN (%s)' % (qn(AuctionEvent._meta.db_table), qn('highest_bid_id'), qn('id'), placeholders), auction_event_ids)
+    for model in (Sales, ProxyBid, Bid):
+        cursor.execute('DELETE FROM %s WHERE %s IN (%s)' % (qn(model._meta.db_table), qn('auction_event_id'), placeholders), auction_event_ids)
+    cursor.execute('DELETE FROM %s WHERE %s IN (%s)' % (qn(AuctionEvent._meta.db_table), qn('id'), placeholders), auction_event_ids)
+    return bid_count, sale_count
+
+def archive_auctions(cutoff=None):
+    if not ARCHIVE_ROOT:
+        raise ValueError('LEBAY_ARCHIVE_ROOT is not set.')
+    if cutoff is None:
+        cutoff = datetime.datetime.now() - datetime.timedelta(days=ARCHIVE_AFTER_DAYS)
+    if not os.path.isdir(ARCHIVE_ROOT):
+        os.makedirs(ARCHIVE_ROOT)
+    auction_event_ids = get_archivable_ids(cutoff)
+    archived = 0
+    bid_count = 0
+    sale_count = 0
+    for i in range(0, len(auction_event_ids), AUCTION_EVENT_ARCHIVE_CHUNK_SIZE):
+        chunk = auction_event_ids[i:i + AUCTION_EVENT_ARCHIVE_CHUNK_SIZE]
+        chunk_bid_count, chunk_sale_count = _archive_chunk(chunk)
+        archived += len(chunk)
+        bid_count += chunk_bid_count
+        sale_count += chunk_sale_count
+    return archived, bid_count, sale_count
+
+def _mark_archived(instances):
+    for instance in instances:
+        instance.archived = True
+    return instances
+
+def get_archived_auction_event(auction_event_id):
+    # Raises AuctionEvent.DoesNotExist like a live lookup would.
+    try:
+        entry = ArchivedAuctionEvent.objects.get(pk=auction_event_id)
+    except (ArchivedAuctionEvent.DoesNotExist, ValueError):
+        raise AuctionEvent.DoesNotExist
+    if not has_archive(entry.month):
+        raise AuctionEvent.DoesNotExist
+    auction_event = get_archive_query_set(AuctionEvent, entry.month).get(pk=entry.pk)
+    return _mark_archived([auction_event])[0]
+
+def find_auction_event(auction_event_id):
+    try:
+        return AuctionEvent.objects.get(pk=auction_event_id)
+    except AuctionEvent.DoesNotExist:
+        return get_archived_auction_event(auction_event_id)
+
+def find_last_modified(auction_event_id):
+    # A closed auction no longer changes, but its item can still be edited
+    # by the seller.
+    times = AuctionEvent.objects.filter(pk=auction_event_id).values_list('closed_at', 'item__time_modified')
+    if not times:
+        times = ArchivedAuctionEvent.objects.filter(pk=auction_event_id).values_list('closed_at', 'item__time_modified')
+    if times and times[0][0] is not None:
+        return max(times[0])
+    return None
+
+def get_bid_history(auction_event):
+    if not getattr(auction_event, 'archived', False):
+        return auction_event.bids.select_related('bidder')
+    # Bidders stay live, so they are looked up in one query instead of a join.
+    bids = list(get_archive_query_set(Bid, get_month(auction_event.closed_at)).filter(auction_event=auction_event.pk).order_by('pk'))
+    bidders = User.objects.in_bulk(list(set([bid.bidder_id for bid in bids])))
+    for bid in bids:
+        bid._auction_event_cache = auction_event
+        if bid.bidder_id in bidders:
+            bid._bidder_cache = bidders[bid.bidder_id]
+    return _mark_archived(bids)
+
+def get_archived_sales(entries):
+    # entries are (auction_event_id, month) pairs; sales come back in
+    # their order, newest first within an auction.
+    months = {}
+    for auction_event_id, month in entries:
+        months.setdefault(month, []).append(auction_event_id)
+    auction_events = {}
+    sales = {}
+    for month, auction_event_ids in months.items():
+        if not has_archive(month):
+            continue
+        for auction_event in get_archive_query_set(AuctionEvent, month).filter(pk__in=auction_event_ids):
+            auction_events[auction_event.pk] = auction_event
+        for sale in get_archive_query_set(Sales, month).filter(auction_event__in=auction_event_ids).order_by('-time_created', '-id'):
+            sales.setdefault(sale.auction_event_id, []).append(sale)
+    items = Item.objects.in_bulk(list(set([auction_event.item_id for auction_event in auction_events.values()])))
+    result = []
+    for auction_event_id, month in entries:
+        auction_event = auction_events.get(auction_event_id)
+        if auction_event is None:
+            continue
+        if auction_event.item_id in items:
+            auction_event._item_cache = items[auction_event.item_id]
+        auction_event.archived = True
+        for sale in sales.get(auction_event_id, []):
+            sale._auction_event_cache = auction_event
+            result.append(sale)
+    return _mark_archived(result)
+
+def get_archived_auction_events(entries):
+    # entries are (auction_event_id, month) pairs; auction events come back
+    # in their order with their latest payment status read from the archive.
+    months = {}
+    for auction_event_id, month in entries:
+        months.setdefault(month, []).append(auction_event_id)
+    auction_events = {}
+    for month, auction_event_ids in months.items():
+        if not has_archive(month):
+            continue
+        for auction_event in get_archive_query_set(AuctionEvent, month).filter(pk__in=auction_event_ids):
+            auction_event.latest_payment_status = None
+            auction_events[auction_event.pk] = auction_event
+        for auction_event_id, payment_status in get_archive_query_set(Sales, month).filter(auction_event__in=auction_event_ids).order_by('time_created', 'id').values_list('auction_event', 'payment_status'):
+            auction_events[auction_event_id].latest_payment_status = payment_status
+    items = Item.objects.in_bulk(list(set([auction_event.item_id for auction_event in auction_events.values()])))
+    result = []
+    for auction_event_id, month in entries:
+        auction_event = auction_events.get(auction_event_id)
+        if auction_event is None:
+            continue
+        if auction_event.item_id in items:
+            auction_event._item_cache = items[auction_event.item_id]
+        result.append(auction_event)
+    return _mark_archived(result)
+
+def _get_archived_chunk(model, month, auction_event_ids, filters):
+    if model is AuctionEvent:
+        objects = list(get_archive_query_set(AuctionEvent, month).filter(pk__in=auction_event_ids, **filters).order_by('pk'))
+        auction_events = objects
+    else:
+        objects = list(get_archive_query_set(model, month).filter(auction_event__in=auction_event_ids, **filters).order_by('pk'))
+        auction_events = get_archive_query_set(AuctionEvent, month).in_bulk(list(set([obj.auction_event_id for obj in objects]))).values()
+    items = Item.objects.select_related('category').in_bulk(list(set([auction_event.item_id for auction_event in auction_events])))
+    user_ids = set([auction_event.winning_bidder_id for auction_event in auction_events if auction_event.winning_bidder_id])
+    if model is Bid:
+        user_ids.update([bid.bidder_id for bid in objects])
+    users = User.objects.in_bulk(list(user_ids))
+    by_pk = {}
+    for auction_event in _mark_archived(auction_events):
+        if auction_event.item_id in items:
+            auction_event._item_cache = items[auction_event.item_id]
+        auction_event._winning_bidder_cache = users.get(auction_event.winning_bidder_id)
+        by_pk[auction_event.pk] = auction_event
+    for obj in objects:
+        if model is not AuctionEvent:
+            obj._auction_event_cache = by_pk[obj.auction_event_id]
+        if model is Bid and obj.bidder_id in users:
+            obj._bidder_cache = users[obj.bidder_id]
+    return _mark_archived(objects)
+
+def iterate_archived(model, seller, filters=None, chunk_size=AUCTION_EVENT_ARCHIVE_CHUNK_SIZE):
+    # Archived auction events, bids or sales of a seller's auctions, month
+    # by month. Items and users stay live, so they are looked up per chunk.
+    filters = filters or {}
+    months = {}
+    for pk, month in ArchivedAuctionEvent.objects.filter(item__seller=seller).order_by('pk').values_list('pk', 'month'):
+        months.setdefault(month, []).append(pk)
+    for month in sorted(months):
+        if not has_archive(month):
+            continue
+        auction_event_ids = months[month]
+        for i in range(0, len(auction_event_ids), chunk_size):
+            for obj in _get_archived_chunk(model, month, auction_event_ids[i:i + chunk_size], filters):
+                yield obj
+
+class ArchivedHistory(object):
+    # Live rows followed by archived ones, as a single list for Paginator.
+    # entries are (auction_event_id, month, row count) for the archived
+    # auctions, in the order their rows are listed.
+    def __init__(self, live, entries):
+        self.live = live
+        self.entries = entries
+        self._live_count = None
+
+    def get_live_count(self):
+        if self._live_count is None:
+            self._live_count = self.live.count()
+        return self._live_count
+
+    def count(self):
+        return self.get_live_count() + sum([sale_count for pk, month, sale_count in self.entries])
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        live_count = self.get_live_count()
+        start, stop = index.start or 0, index.stop
+        result = []
+        if start < live_count:
+            result.extend(self.live[start:min(stop, live_count)])
+        if stop > live_count:
+            result.extend(self.get_archived(max(start - live_count, 0), stop - live_count))
+        return result
+
+    def get_archived(self, start, stop):
+        # Only the auctions whose rows overlap the slice are read.
+        entries = []
+        offset = 0
+        skipped = None
+        for pk, month, sale_count in self.entries:
+            if offset + sale_count > start and offset < stop:
+                if skipped is None:
+                    skipped = offset
+                entries.append((pk, month))
+            offset += sale_count
+        if not entries:
+            return []
+        return self.get_archived_rows(entries)[start - skipped:stop - skipped]
+
+class SalesHistory(ArchivedHistory):
+    def __init__(self, sales, seller):
+        ArchivedHistory.__init__(self, sales, list(ArchivedAuctionEvent.objects.filter(item__seller=seller, sale_count__gt=0).order_by('-closed_at', '-pk').values_list('pk', 'month', 'sale_count')))
+
+    def get_archived_rows(self, entries):
+        return get_archived_sales(entries)
+
+class WonHistory(ArchivedHistory):
+    # Only sold auctions keep their winning bidder when they close.
+    def __init__(self, auction_events, winner):
+        ArchivedHistory.__init__(self, auction_events, [(pk, month, 1) for pk, month in ArchivedAuctionEvent.objects.filter(winning_bidder=winner).order_by('-closed_at', '-pk').values_list('pk', 'month')])
+
+    def get_archived_rows(self, entries):
+        return get_archived_auction_events(entries)
+
+def close_archive_connections(**kwargs):
+    for archive_connection in _archive_connections.values():
+        archive_connection.close()
+
+signals.request_finished.connect(close_archive_connections)
@@ -0,0 +1,67 @@
+import datetime
+
+from django.conf import settings
+
+from lebay.apps.lebay.models import AuctionEvent
+from lebay.apps.lebay.constants import BID_RESULT_CHOICES, BID_RESULT_ACCEPTED, BID_RESULT_TOO_LOW, BID_RESULT_NOT_RUNNING
+
+SOFT_CLOSE_SECONDS = getattr(settings, 'LEBAY_SOFT_CLOSE_SECONDS', 0)
+SOFT_CLOSE_CHUNK_SIZE = 500
+
+class BidResult(object):
+    def __init__(self, status, auction_event, amount, bid=None):
+        self.status = status
+        self.auction_event = auction_event
+        self.amount = amount
+        self.bid = bid
+
+    def __unicode__(self):
+        return u'%s' % self.get_message()
+
+    @property
+    def accepted(self):
+        return self.status == BID_RESULT_ACCEPTED
+
+    def get_message(self):
+        return dict(BID_RESULT_CHOICES).get(self.status, 'N/A')
+
+def _get_rejection_status(auction_event, amount, current_time):
+    try:
+        auction_event = AuctionEvent.objects.get(pk=auction_event.pk)
+    except AuctionEvent.DoesNotExist:
+        return BID_RESULT_NOT_RUNNING
+    if auction_event.start_time > current_time or auction_event.end_time <= current_time:
+        return BID_RESULT_NOT_RUNNING
+    return BID_RESULT_TOO_LOW
+
+def get_soft_close_end_time(end_time, bid_time):
+    # A bid in the last SOFT_CLOSE_SECONDS pushes the end out to that many
+    # seconds after the bid. Returns None when the end does not move.
+    if SOFT_CLOSE_SECONDS:
+        extended_end_time = bid_time + datetime.timedelta(seconds=SOFT_CLOSE_SECONDS)
+        if end_time < extended_end_time:
+            return extended_end_time
+    return None
+
+def extend_end_times(end_times):
+    # end_times maps auction event ids to the end time their latest bid
+    # asks for. Only rows that still end earlier are updated; callers send
+    # bids_recorded in the same transaction, which bumps the cached
+    # fragments, dashboards and live state that show the end time.
+    extended_ids = []
+    auction_event_ids = sorted(end_times.keys())
+    for i in range(0, len(auction_event_ids), SOFT_CLOSE_CHUNK_SIZE):
+        current_end_times = AuctionEvent.objects.filter(pk__in=auction_event_ids[i:i + SOFT_CLOSE_CHUNK_SIZE], closed_at__isnull=True).values_list('pk', 'end_time')
+        for auction_event_id, end_time in current_end_times:
+            if end_time < end_times[auction_event_id]:
+                if AuctionEvent.objects.filter(pk=auction_event_id, end_time__lt=end_times[auction_event_id]).update(end_time=end_times[auction_event_id]):
+                    extended_ids.append(auction_event_id)
+    return extended_ids
+
+def extend_for_bid(auction_event, bid_time):
+    # The instance's end time can only be stale on the early side, so an
+    # end time already past the window needs no query at all.
+    end_time = get_soft_close_end_time(auction_event.end_time, bid_time)
+    if end_time is not None:
+        AuctionEvent.objects.filter(pk=auction_event.pk, end_time__lt=end_time).update(end_time=end_time)
+        auction_event.end_time = end_time
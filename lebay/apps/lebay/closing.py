@@ -0,0 +1,244 @@
+import bisect
+import datetime
+import heapq
+import time
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+
+from lebay.apps.lebay.models import AuctionEvent, Item
+from lebay.apps.lebay.signals import auctions_closed
+from lebay.apps.lebay.constants import AUCTION_ITEM_STATUS_RUNNING, AUCTION_ITEM_STATUS_SOLD, AUCTION_ITEM_STATUS_EXPIRED, AUCTION_EVENT_SETTLEMENT_CHUNK_SIZE, SALES_FINAL_VALUE_FEE_BOUNDS, SALES_FINAL_VALUE_FEE_RATES
+
+# With the order book on, bids accepted just before the end stay in
+# memory for up to a flush interval. Auctions are closed only once two
+# intervals have passed, so those bids and their soft close extensions
+# reach the row first.
+if getattr(settings, 'LEBAY_ORDER_BOOK_JOURNAL', None):
+    CLOSE_DELAY = datetime.timedelta(seconds=2 * getattr(settings, 'LEBAY_ORDER_BOOK_FLUSH_INTERVAL', 0.5))
+else:
+    CLOSE_DELAY = datetime.timedelta(0)
+
+def _total_seconds(delta):
+    return delta.days * 86400 + delta.seconds + delta.microseconds / 1000000.0
+
+def _get_fee_schedule():
+    # The fee owed at the bottom of each tier, so a price's fee is its
+    # tier's base plus that tier's rate on the remainder.
+    lower_bounds = (Decimal('0.00'),) + SALES_FINAL_VALUE_FEE_BOUNDS
+    base_fees = [Decimal('0.00')]
+    for i in range(1, len(lower_bounds)):
+        base_fees.append(base_fees[-1] + (lower_bounds[i] - lower_bounds[i - 1]) * SALES_FINAL_VALUE_FEE_RATES[i - 1])
+    return lower_bounds, base_fees
+
+FEE_LOWER_BOUNDS, FEE_BASES = _get_fee_schedule()
+CENT = Decimal('0.01')
+
+def get_final_value_fee(price):
+    tier = bisect.bisect_right(SALES_FINAL_VALUE_FEE_BOUNDS, price)
+    return (FEE_BASES[tier] + (price - FEE_LOWER_BOUNDS[tier]) * SALES_FINAL_VALUE_FEE_RATES[tier]).quantize(CENT, ROUND_HALF_UP)
+
+def settle(rows):
+    # rows are (auction_event_id, item_id, bid_count, current_price,
+    # reserve_price, proxy_maximum). An auction sells if the leader's
+    # maximum reaches the reserve; the price then rises to the reserve if
+    # bidding stopped short of it. Returns the sold rows as (auction_event_id,
+    # item_id, final_price, final_value_fee), and the unmet and expired
+    # rows as (auction_event_id, item_id).
+    sold = []
+    unmet = []
+    expired = []
+    for auction_event_id, item_id, bid_count, current_price, reserve_price, proxy_maximum in rows:
+        if not bid_count:
+            expired.append((auction_event_id, item_id))
+        elif reserve_price and (proxy_maximum or current_price) < reserve_price:
+            unmet.append((auction_event_id, item_id))
+        else:
+            final_price = max(current_price, reserve_price or current_price)
+            sold.append((auction_event_id, item_id, final_price, get_final_value_fee(final_price)))
+    return sold, unmet, expired
+
+def _close_chunk(auction_event_ids, current_time):
+    ended_before = current_time - CLOSE_DELAY
+    closing_ids = list(AuctionEvent.objects.filter(pk__in=auction_event_ids, end_time__lte=ended_before, closed_at__isnull=True, item__status=AUCTION_ITEM_STATUS_RUNNING).values_list('pk', flat=True))
+    if not closing_ids:
+        return [], 0, 0
+
+    # The end time is checked again as the rows are stamped: a last second
+    # bid may have extended the auction since it was selected, and bids are
+    # only claimed on rows that are not closed yet.
+    AuctionEvent.objects.filter(pk__in=closing_ids, end_time__lte=ended_before, closed_at__isnull=True).update(closed_at=current_time, time_modified=current_time)
+    rows = list(AuctionEvent.objects.filter(pk__in=closing_ids, closed_at=current_time).values_list('pk', 'item', 'bid_count', 'current_price', 'reserve_price', 'proxy_maximum'))
+    sold, unmet, expired = settle(rows)
+
+    qn = connection.ops.quote_name
+    if sold:
+        sql = 'UPDATE %s SET %s = %%s, %s = %%s WHERE %s = %%s' % (qn(AuctionEvent._meta.db_table),
+            qn(AuctionEvent._meta.get_field('final_price').column), qn(AuctionEvent._meta.get_field('final_value_fee').column), qn(AuctionEvent._meta.pk.column))
+        connection.cursor().executemany(sql, [(connection.ops.value_to_db_decimal(final_price, 5, 2), connection.ops.value_to_db_decimal(fee, 5, 2), auction_event_id)
+            for auction_event_id, item_id, final_price, fee in sold])
+        Item.objects.filter(pk__in=[row[1] for row in sold], status=AUCTION_ITEM_STATUS_RUNNING).update(status=AUCTION_ITEM_STATUS_SOLD, time_modified=current_time)
+    if unmet:
+        AuctionEvent.objects.filter(pk__in=[row[0] for row in unmet]).update(winning_bidder=None)
+    if unmet or expired:
+        Item.objects.filter(pk__in=[row[1] for row in unmet + expired], status=AUCTION_ITEM_STATUS_RUNNING).update(status=AUCTION_ITEM_STATUS_EXPIRED, time_modified=current_time)
+    return [row[0] for row in rows], len(sold), len(unmet) + len(expired)
+
+@transaction.commit_on_success
+def close_auctions(auction_event_ids, current_time=None):
+    if not auction_event_ids:
+        return 0, 0
+    if current_time is None:
+        current_time = datetime.datetime.now()
+
+    # Chunks keep the IN lists of the settlement and of the closed signal's
+    # receivers bounded; it all still commits as one transaction.
+    auction_event_ids = list(auction_event_ids)
+    sold = 0
+    expired = 0
+    for i in range(0, len(auction_event_ids), AUCTION_EVENT_SETTLEMENT_CHUNK_SIZE):
+        closed_ids, chunk_sold, chunk_expired = _close_chunk(auction_event_ids[i:i + AUCTION_EVENT_SETTLEMENT_CHUNK_SIZE], current_time)
+        if closed_ids:
+            auctions_closed.send(sender=AuctionEvent, auction_event_ids=closed_ids)
+        sold += chunk_sold
+        expired += chunk_expired
+    return sold, expired
+
+class AuctionCloser(object):
+    def __init__(self, horizon=300, batch_size=500, poll_interval=30):
+        self.horizon = datetime.timedelta(seconds=horizon)
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.queue = []
+        self.scheduled = {}
+        self.sold_count = 0
+        self.expired_count = 0
+        self.last_batch_lag = 0.0
+
+    def get_upcoming_auctions(self, current_time):
+        return AuctionEvent.objects.filter(item__status=AUCTION_ITEM_STATUS_RUNNING, closed_at__isnull=True, end_time__lte=current_time + self.horizon)
+
+    def refresh(self, current_time=None):
+        if current_time is None:
+            current_time = datetime.datetime.now()
+        upcoming = self.get_upcoming_auctions(current_time).values_list('pk', 'end_time')
+        added = 0
+        for auction_event_id, end_time in upcoming:
+            if self.scheduled.get(auction_event_id) != end_time:
+                # Newly due, or moved by a soft close; a moved auction's
+                # old heap entry stays behind and is skipped when it is due.
+                heapq.heappush(self.queue, (end_time, auction_event_id))
+                self.scheduled[auction_event_id] = end_time
+                added += 1
+        return added
+
+    def reschedule(self, auction_event_ids, current_time):
+        # Due auctions that did not close had their end moved by a late
+        # bid; only those rows are read again.
+        current_end_times = AuctionEvent.objects.filter(pk__in=auction_event_ids, item__status=AUCTION_ITEM_STATUS_RUNNING, closed_at__isnull=True, end_time__gt=current_time - CLOSE_DELAY).values_list('pk', 'end_time')
+        for auction_event_id, end_time in current_end_times:
+            heapq.heappush(self.queue, (end_time, auction_event_id))
+            self.scheduled[auction_event_id] = end_time
+        return len(current_end_times)
+
+    def get_next_end_time(self):
+        while self.queue and self.scheduled.get(self.queue[0][1]) != self.queue[0][0]:
+            heapq.heappop(self.queue)
+        if self.queue:
+            return self.queue[0][0]
+        return None
+
+    def pop_due(self, current_time):
+        due = []
+        while self.queue and self.queue[0][0] + CLOSE_DELAY <= current_time and len(due) < self.batch_size:
+            end_time, auction_event_id = heapq.heappop(self.queue)
+            if self.scheduled.get(auction_event_id) != end_time:
+                continue
+            del self.scheduled[auction_event_id]
+            due.append((end_time, auction_event_id))
+        return due
+
+    def close_batch(self, due, current_time=None):
+        if current_time is None:
+            current_time = datetime.datetime.now()
+        auction_event_ids = [auction_event_id for end_time, auction_event_id in due]
+        sold, expired = close_auctions(auction_event_ids, current_time)
+        self.sold_count += sold
+        self.expired_count += expired
+        if due:
+            self.last_batch_lag = _total_seconds(current_time - due[0][0])
+        if sold + expired < len(due):
+            self.reschedule(auction_event_ids, current_time)
+        return sold, expired
+
+    def catch_up(self):
+        # Auctions ended before closed_at was recorded only need the stamp,
+        # and a final price if they sold.
+        current_time = datetime.datetime.now()
+        settled = AuctionEvent.objects.filter(closed_at__isnull=True, end_time__lte=current_time).exclude(item__status=AUCTION_ITEM_STATUS_RUNNING)
+        settled.filter(item__status=AUCTION_ITEM_STATUS_SOLD).update(closed_at=current_time, final_price=F('current_price'))
+        settled.update(closed_at=current_time)
+
+        closed = 0
+        while True:
+            current_time = datetime.datetime.now()
+            due = list(AuctionEvent.objects.filter(item__status=AUCTION_ITEM_STATUS_RUNNING, closed_at__isnull=True, end_time__lte=current_time - CLOSE_DELAY).order_by('end_time').values_list('end_time', 'pk')[:self.batch_size])
+            if not due:
+                return closed
+            sold, expired = self.close_batch(due, current_time)
+            if not sold + expired:
+                return closed
+            closed += sold + expired
+
+    def get_backlog(self, current_time=None):
+        if current_time is None:
+            current_time = datetime.datetime.now()
+        return len([end_time for end_time in self.scheduled.values() if end_time <= current_time])
+
+    def get_lag(self, current_time=None):
+        if current_time is None:
+            current_time = datetime.datetime.now()
+        next_end_time = self.get_next_end_time()
+        if next_end_time is not None and next_end_time <= current_time:
+            return _total_seconds(current_time - next_end_time)
+        return 0.0
+
+    def get_stats(self):
+        current_time = datetime.datetime.now()
+        return {
+            'scheduled': len(self.scheduled),
+            'backlog': self.get_backlog(current_time),
+            'lag': self.get_lag(current_time),
+            'last_batch_lag': self.last_batch_lag,
+            'sold': self.sold_count,
+            'expired': self.expired_count,
+        }
+
+    def get_sleep_time(self, current_time):
+        sleep_time = self.poll_interval
+        next_end_time = self.get_next_end_time()
+        if next_end_time is not None:
+            sleep_time = min(sleep_time, _total_seconds(next_end_time + CLOSE_DELAY - current_time))
+        return max(sleep_time, 0)
+
+    def run_once(self):
+        current_time = datetime.datetime.now()
+        self.refresh(current_time)
+        closed = 0
+        due = self.pop_due(current_time)
+        while due:
+            sold, expired = self.close_batch(due, current_time)
+            closed += sold + expired
+            due = self.pop_due(current_time)
+        return closed
+
+    def run(self, callback=None):
+        self.catch_up()
+        while True:
+            closed = self.run_once()
+            if callback:
+                callback(self, closed)
+            connection.close()
+            time.sleep(self.get_sleep_time(datetime.datetime.now()))
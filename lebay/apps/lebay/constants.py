@@ -1,3 +1,5 @@
+from decimal import Decimal
+
 AUCTION_ITEM_CATEGORY_GENERAL = 1
 AUCTION_ITEM_CATEGORY_ELECTRONICS = 2
 AUCTION_ITEM_CATEGORY_MEDIA = 3
@@ -69,8 +71,108 @@ AUCTION_EVENT_SORTING_END_TIME_DESC = 'end_time_desc'
 AUCTION_EVENT_SORTING_CHOICES = (
     (AUCTION_EVENT_SORTING_TITLE, 'item__title'),
     (AUCTION_EVENT_SORTING_CONDITION, 'item__condition'),
-    (AUCTION_EVENT_SORTING_PRICE_ASC, 'starting_price'),
-    (AUCTION_EVENT_SORTING_PRICE_DESC, '-starting_price'),
+    (AUCTION_EVENT_SORTING_PRICE_ASC, 'current_price'),
+    (AUCTION_EVENT_SORTING_PRICE_DESC, '-current_price'),
     (AUCTION_EVENT_SORTING_END_TIME_ASC, 'end_time'),
     (AUCTION_EVENT_SORTING_END_TIME_DESC, '-end_time'),
-)
\ No newline at end of file
+)
+
+AUCTION_EVENT_PRICE_BUCKET_BOUNDS = (Decimal('10.00'), Decimal('25.00'), Decimal('50.00'), Decimal('100.00'), Decimal('250.00'))
+
+AUCTION_EVENT_PRICE_BUCKET_CHOICES = (
+    (0, 'Under $10'),
+    (1, '$10 to $25'),
+    (2, '$25 to $50'),
+    (3, '$50 to $100'),
+    (4, '$100 to $250'),
+    (5, '$250 and up'),
+)
+
+AUCTION_EVENT_ENDING_SOON_HOURS = 24
+
+AUCTION_EVENT_CLOSED_CACHE_SECONDS = 365 * 24 * 60 * 60
+
+AUCTION_EVENT_LIVE_TIMEOUT = 25
+AUCTION_EVENT_LIVE_POLL_SECONDS = 3
+
+BID_RESULT_ACCEPTED = 'accepted'
+BID_RESULT_TOO_LOW = 'too_low'
+BID_RESULT_NOT_RUNNING = 'not_running'
+BID_RESULT_OWN_ITEM = 'own_item'
+BID_RESULT_OUTBID = 'outbid'
+BID_RESULT_UNAVAILABLE = 'unavailable'
+BID_RESULT_BUSY = 'busy'
+
+BID_RESULT_CHOICES = (
+    (BID_RESULT_ACCEPTED, 'Your bid has been placed.'),
+    (BID_RESULT_TOO_LOW, 'Your bid has to be higher than the current price.'),
+    (BID_RESULT_NOT_RUNNING, 'This auction event is not accepting bids.'),
+    (BID_RESULT_OWN_ITEM, 'You can not bid on your own item.'),
+    (BID_RESULT_OUTBID, 'Your bid was placed, but another bidder\'s maximum bid is higher.'),
+    (BID_RESULT_UNAVAILABLE, 'Maximum bids are not available right now. Please bid directly.'),
+    (BID_RESULT_BUSY, 'Other bids kept arriving at the same moment, so your bid was not placed. Please try again.'),
+)
+
+# Proxy bids raise the price by the increment for the price it is at:
+# below $1.00 by 5 cents, below $5.00 by 25 cents and so on.
+BID_INCREMENT_BOUNDS = (Decimal('1.00'), Decimal('5.00'), Decimal('25.00'), Decimal('100.00'), Decimal('250.00'))
+BID_INCREMENTS = (Decimal('0.05'), Decimal('0.25'), Decimal('0.50'), Decimal('1.00'), Decimal('2.50'), Decimal('5.00'))
+
+DASHBOARD_CACHE_KEY = 'lebay_dashboard_%s'
+DASHBOARD_CACHE_SECONDS = 60 * 60
+DASHBOARD_RECENT_ITEMS = 5
+DASHBOARD_PAGE_SIZE = 25
+
+LISTING_IMPORT_FORMAT_CSV = 'csv'
+LISTING_IMPORT_FORMAT_JSONL = 'jsonl'
+
+LISTING_IMPORT_FORMAT_CHOICES = (
+    (LISTING_IMPORT_FORMAT_CSV, 'CSV with a header row'),
+    (LISTING_IMPORT_FORMAT_JSONL, 'One JSON object per line'),
+)
+
+LISTING_IMPORT_CHUNK_SIZE = 500
+LISTING_IMPORT_MAX_REPORTED_ERRORS = 1000
+
+HISTORY_EXPORT_FORMAT_CSV = 'csv'
+HISTORY_EXPORT_FORMAT_JSONL = 'jsonl'
+
+HISTORY_EXPORT_FORMAT_CHOICES = (
+    (HISTORY_EXPORT_FORMAT_CSV, 'CSV'),
+    (HISTORY_EXPORT_FORMAT_JSONL, 'JSON lines'),
+)
+
+HISTORY_EXPORT_MIMETYPES = {
+    HISTORY_EXPORT_FORMAT_CSV: 'text/csv',
+    HISTORY_EXPORT_FORMAT_JSONL: 'application/x-ndjson',
+}
+
+HISTORY_EXPORT_CHUNK_SIZE = 1000
+
+PAYMENT_UPDATE_APPLIED = 'applied'
+PAYMENT_UPDATE_UNKNOWN_INVOICE = 'unknown_invoice'
+PAYMENT_UPDATE_INVALID_STATUS = 'invalid_status'
+PAYMENT_UPDATE_DUPLICATE = 'duplicate'
+PAYMENT_UPDATE_STALE = 'stale'
+
+PAYMENT_UPDATE_CHOICES = (
+    (PAYMENT_UPDATE_APPLIED, 'The payment status has been updated.'),
+    (PAYMENT_UPDATE_UNKNOWN_INVOICE, 'There is no such invoice among your sales.'),
+    (PAYMENT_UPDATE_INVALID_STATUS, 'That is not a valid payment status.'),
+    (PAYMENT_UPDATE_DUPLICATE, 'The invoice was listed more than once.'),
+    (PAYMENT_UPDATE_STALE, 'The sale was changed by someone else since you loaded it.'),
+)
+
+PAYMENT_UPDATE_CHUNK_SIZE = 200
+
+SALES_INVOICE_NUMBER_FORMAT = 'LB%010d'
+
+# Final value fee charged to the seller on a sale, by tier of the final
+# price: the first $25.00 at 5.25%, up to $1000.00 at 3% and above at 1.5%.
+SALES_FINAL_VALUE_FEE_BOUNDS = (Decimal('25.00'), Decimal('1000.00'))
+SALES_FINAL_VALUE_FEE_RATES = (Decimal('0.0525'), Decimal('0.0300'), Decimal('0.0150'))
+
+AUCTION_EVENT_SETTLEMENT_CHUNK_SIZE = 500
+
+AUCTION_EVENT_ARCHIVE_CHUNK_SIZE = 500
+AUCTION_EVENT_ARCHIVE_FILENAME = 'auctions-%s.db'
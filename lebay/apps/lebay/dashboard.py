@@ -0,0 +1,71 @@
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Sum
+
+from lebay.apps.lebay.models import AuctionEvent, Item
+from lebay.apps.lebay.archiving import WonHistory
+from lebay.apps.lebay.constants import AUCTION_ITEM_STATUS_IDLE, AUCTION_ITEM_STATUS_RUNNING, AUCTION_ITEM_STATUS_SOLD, SALES_PAYMENT_STATUS_CLEARED, DASHBOARD_CACHE_KEY, DASHBOARD_CACHE_SECONDS, DASHBOARD_RECENT_ITEMS
+
+def get_selling_auctions(user):
+    return AuctionEvent.objects.get_listing().filter(item__seller=user, item__status=AUCTION_ITEM_STATUS_RUNNING).order_by('-time_created')
+
+def get_won_auctions(user):
+    return AuctionEvent.objects.get_listing().filter(winning_bidder=user, item__status=AUCTION_ITEM_STATUS_SOLD).order_by('-end_time')
+
+def get_won_history(user):
+    return WonHistory(get_won_auctions(user), user)
+
+def get_inventory_items(user):
+    return Item.objects.filter(seller=user, status=AUCTION_ITEM_STATUS_IDLE).select_related('category').order_by('-time_modified')
+
+def get_bidding_auctions(user):
+    return AuctionEvent.objects.get_current_auctions().filter(bids__bidder=user).distinct()
+
+def get_total(auction_events):
+    # Only sold auctions are totalled, and their price is what settlement
+    # charged, which can be above the last bid when the reserve was met.
+    totals = auction_events.aggregate(price=Sum('final_price'), shipping=Sum('shipping_fee'))
+    return (totals['price'] or Decimal('0.00')) + (totals['shipping'] or Decimal('0.00'))
+
+def get_owed_auctions(user):
+    return AuctionEvent.objects.filter(winning_bidder=user, item__status=AUCTION_ITEM_STATUS_SOLD, sales__isnull=True)
+
+def get_received_auctions(user):
+    return AuctionEvent.objects.filter(item__seller=user, sales__payment_status=SALES_PAYMENT_STATUS_CLEARED)
+
+DASHBOARD_SECTIONS = {
+    'selling': get_selling_auctions,
+    'won': get_won_history,
+    'inventory': get_inventory_items,
+}
+
+def build_dashboard(user):
+    selling_auctions = get_selling_auctions(user)
+    won_auctions = get_won_history(user)
+    inventory_items = get_inventory_items(user)
+    return {
+        'selling_count': selling_auctions.count(),
+        'won_count': won_auctions.count(),
+        'inventory_count': inventory_items.count(),
+        'bidding_count': get_bidding_auctions(user).count(),
+        'owed_total': get_total(get_owed_auctions(user)),
+        'received_total': get_total(get_received_auctions(user)),
+        'recent_selling_auctions': list(selling_auctions[:DASHBOARD_RECENT_ITEMS]),
+        'recent_won_auctions': list(won_auctions[:DASHBOARD_RECENT_ITEMS]),
+        'recent_inventory_items': list(inventory_items[:DASHBOARD_RECENT_ITEMS]),
+    }
+
+def is_dashboard_cache_shared():
+    # The closer and the archiver invalidate dashboards from their own
+    # processes, which a process local cache never sees.
+    return settings.CACHE_BACKEND.split(':', 1)[0] not in ('locmem', 'dummy', 'lebay.apps.lebay.lrucache')
+
+def get_dashboard(user):
+    cache_key = DASHBOARD_CACHE_KEY % user.pk
+    dashboard = cache.get(cache_key)
+    if dashboard is None:
+        dashboard = build_dashboard(user)
+        cache.set(cache_key, dashboard, DASHBOARD_CACHE_SECONDS)
+    return dashboard
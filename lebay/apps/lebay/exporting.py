@@ -0,0 +1,139 @@
+import csv
+import datetime
+from decimal import Decimal
+
+from django.utils import simplejson
+
+from lebay.apps.lebay.models import AuctionEvent, Bid, Sales
+from lebay.apps.lebay.archiving import iterate_archived
+from lebay.apps.lebay.constants import HISTORY_EXPORT_FORMAT_CSV, HISTORY_EXPORT_FORMAT_JSONL, HISTORY_EXPORT_CHUNK_SIZE
+
+def iterate_in_chunks(queryset, chunk_size=HISTORY_EXPORT_CHUNK_SIZE):
+    # Seeks on the primary key instead of relying on the cursor, since
+    # some database drivers buffer the whole result set client side.
+    queryset = queryset.order_by('pk')
+    last_pk = None
+    while True:
+        chunk = queryset
+        if last_pk is not None:
+            chunk = chunk.filter(pk__gt=last_pk)
+        chunk = list(chunk[:chunk_size])
+        for obj in chunk:
+            yield obj
+        if len(chunk) < chunk_size:
+            return
+        last_pk = chunk[-1].pk
+
+def get_username(user):
+    if user is None:
+        return ''
+    return user.username
+
+SALES_EXPORT_COLUMNS = (
+    ('invoice_number', lambda sale: sale.invoice_number),
+    ('auction_event', lambda sale: sale.auction_event_id),
+    ('item', lambda sale: sale.auction_event.item.title),
+    ('buyer', lambda sale: get_username(sale.auction_event.winning_bidder)),
+    ('price', lambda sale: sale.auction_event.get_final_price()),
+    ('shipping_fee', lambda sale: sale.auction_event.shipping_fee),
+    ('payment_status', lambda sale: sale.get_payment_status_display()),
+    ('time_created', lambda sale: sale.time_created),
+)
+
+BID_EXPORT_COLUMNS = (
+    ('bid', lambda bid: bid.pk),
+    ('auction_event', lambda bid: bid.auction_event_id),
+    ('item', lambda bid: bid.auction_event.item.title),
+    ('bidder', lambda bid: bid.bidder.username),
+    ('amount', lambda bid: bid.amount),
+    ('time_created', lambda bid: bid.time_created),
+)
+
+AUCTION_EVENT_EXPORT_COLUMNS = (
+    ('auction_event', lambda auction_event: auction_event.pk),
+    ('item', lambda auction_event: auction_event.item.title),
+    ('category', lambda auction_event: unicode(auction_event.item.category)),
+    ('start_time', lambda auction_event: auction_event.start_time),
+    ('end_time', lambda auction_event: auction_event.end_time),
+    ('starting_price', lambda auction_event: auction_event.starting_price),
+    ('reserve_price', lambda auction_event: auction_event.reserve_price),
+    ('current_price', lambda auction_event: auction_event.current_price),
+    ('bid_count', lambda auction_event: auction_event.bid_count),
+    ('winning_bidder', lambda auction_event: get_username(auction_event.winning_bidder)),
+    ('final_price', lambda auction_event: auction_event.final_price),
+    ('final_value_fee', lambda auction_event: auction_event.final_value_fee),
+)
+
+def get_sales(seller):
+    return Sales.objects.filter(auction_event__item__seller=seller).select_related('auction_event__item', 'auction_event__winning_bidder')
+
+def get_bids(seller):
+    return Bid.objects.filter(auction_event__item__seller=seller).select_related('auction_event__item', 'bidder')
+
+def get_auction_events(seller):
+    return AuctionEvent.objects.filter(item__seller=seller).select_related('item__category', 'winning_bidder')
+
+# Name: (queryset for a seller, field the date range applies to, columns)
+HISTORY_EXPORTS = {
+    'sales': (get_sales, 'time_created', SALES_EXPORT_COLUMNS),
+    'bids': (get_bids, 'time_created', BID_EXPORT_COLUMNS),
+    'auctions': (get_auction_events, 'end_time', AUCTION_EVENT_EXPORT_COLUMNS),
+}
+
+def get_export_rows(name, seller, start_date=None, end_date=None):
+    get_queryset, date_field, columns = HISTORY_EXPORTS[name]
+    queryset = get_queryset(seller)
+    filters = {}
+    if start_date:
+        filters['%s__gte' % date_field] = start_date
+    if end_date:
+        filters['%s__lt' % date_field] = end_date + datetime.timedelta(days=1)
+    for obj in iterate_in_chunks(queryset.filter(**filters)):
+        yield [value(obj) for header, value in columns]
+    # Archived auctions follow the live ones, as on the sales history page.
+    for obj in iterate_archived(queryset.model, seller, filters):
+        yield [value(obj) for header, value in columns]
+
+def format_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime.datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, Decimal):
+        return '%.2f' % value
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+def format_json_value(value):
+    if isinstance(value, (datetime.datetime, Decimal)):
+        return format_value(value)
+    return value
+
+class LineBuffer(object):
+    # csv.writer only writes to files; this hands each line back instead.
+    def __init__(self):
+        self.line = ''
+
+    def write(self, line):
+        self.line = line
+
+def export_csv(headers, rows):
+    line_buffer = LineBuffer()
+    writer = csv.writer(line_buffer)
+    writer.writerow(headers)
+    yield line_buffer.line
+    for row in rows:
+        writer.writerow([format_value(value) for value in row])
+        yield line_buffer.line
+
+def export_jsonl(headers, rows):
+    for row in rows:
+        yield simplejson.dumps(dict(zip(headers, [format_json_value(value) for value in row]))) + '\n'
+
+def export_history(name, seller, format=HISTORY_EXPORT_FORMAT_CSV, start_date=None, end_date=None):
+    headers = [header for header, value in HISTORY_EXPORTS[name][2]]
+    rows = get_export_rows(name, seller, start_date, end_date)
+    if format == HISTORY_EXPORT_FORMAT_JSONL:
+        return export_jsonl(headers, rows)
+    return export_csv(headers, rows)
@@ -0,0 +1,101 @@
+import datetime
+
+from django.db.models import Count
+
+from lebay.apps.lebay.models import ItemCategory, AuctionEvent, AuctionFacetCount
+from lebay.apps.lebay.constants import AUCTION_ITEM_CONDITION_CHOICES, AUCTION_EVENT_PRICE_BUCKET_CHOICES, AUCTION_EVENT_ENDING_SOON_HOURS
+
+def get_ending_soon_window():
+    current_time = datetime.datetime.now()
+    return current_time, current_time + datetime.timedelta(hours=AUCTION_EVENT_ENDING_SOON_HOURS)
+
+class CategoryTree(object):
+    def __init__(self):
+        self.categories = {}
+        self.children = {}
+        for category in ItemCategory.objects.all():
+            self.categories[category.pk] = category
+            self.children.setdefault(category.parent_id, []).append(category.pk)
+
+    def get_children(self, category_id=None):
+        return [self.categories[child_id] for child_id in self.children.get(category_id, [])]
+
+    def get_descendant_ids(self, category_id):
+        descendant_ids = []
+        pending = [category_id]
+        while pending:
+            current_id = pending.pop()
+            descendant_ids.append(current_id)
+            pending.extend(self.children.get(current_id, []))
+        return descendant_ids
+
+class AuctionFacets(object):
+    def __init__(self, category=None, condition=None, price_bucket=None, ending_soon=False):
+        self.category = category
+        self.condition = condition
+        self.price_bucket = price_bucket
+        self.ending_soon = ending_soon
+        self.tree = CategoryTree()
+        if category:
+            self.category_ids = set(self.tree.get_descendant_ids(category.pk))
+        else:
+            self.category_ids = None
+        self.rows = self.get_rows()
+
+    def get_rows(self):
+        if self.ending_soon:
+            # Ending soon is a moving window, so these counts come from the
+            # small set of current auctions inside it, picked as the listing
+            # picks them, rather than the aggregate table.
+            window_start, window_end = get_ending_soon_window()
+            groups = AuctionEvent.objects.get_current_auctions().filter(end_time__lte=window_end).values('item__category', 'item__condition', 'price_bucket').annotate(auction_count=Count('id'))
+            return [(group['item__category'], group['item__condition'], group['price_bucket'], group['auction_count']) for group in groups]
+        return list(AuctionFacetCount.objects.filter(count__gt=0).values_list('category', 'condition', 'price_bucket', 'count'))
+
+    def filter_rows(self, exclude=None):
+        for category_id, condition, price_bucket, count in self.rows:
+            if exclude != 'category' and self.category_ids is not None and category_id not in self.category_ids:
+                continue
+            if exclude != 'condition' and self.condition is not None and condition != self.condition:
+                continue
+            if exclude != 'price_bucket' and self.price_bucket is not None and price_bucket != self.price_bucket:
+                continue
+            yield category_id, condition, price_bucket, count
+
+    def get_total(self):
+        return sum([count for category_id, condition, price_bucket, count in self.filter_rows()])
+
+    def get_category_counts(self):
+        counts = {}
+        for category_id, condition, price_bucket, count in self.filter_rows():
+            counts[category_id] = counts.get(category_id, 0) + count
+        category_counts = []
+        for category in self.tree.get_children(self.category and self.category.pk or None):
+            subtree_count = sum([counts.get(category_id, 0) for category_id in self.tree.get_descendant_ids(category.pk)])
+            if subtree_count:
+                category_counts.append((category, subtree_count))
+        return category_counts
+
+    def get_condition_counts(self):
+        counts = {}
+        for category_id, condition, price_bucket, count in self.filter_rows(exclude='condition'):
+            counts[condition] = counts.get(condition, 0) + count
+        return [(condition, label, counts[condition]) for condition, label in AUCTION_ITEM_CONDITION_CHOICES if counts.get(condition)]
+
+    def get_price_bucket_counts(self):
+        counts = {}
+        for category_id, condition, price_bucket, count in self.filter_rows(exclude='price_bucket'):
+            counts[price_bucket] = counts.get(price_bucket, 0) + count
+        return [(price_bucket, label, counts[price_bucket]) for price_bucket, label in AUCTION_EVENT_PRICE_BUCKET_CHOICES if counts.get(price_bucket)]
+
+    def filter_auctions(self, auction_events):
+        if self.category is not None:
+            auction_events = auction_events.filter(item__category__in=ItemCategory.objects.get_subtree(self.category).values('pk'))
+        if self.condition is not None:
+            auction_events = auction_events.filter(item__condition=self.condition)
+        if self.price_bucket is not None:
+            auction_events = auction_events.filter(price_bucket=self.price_bucket)
+        if self.ending_soon:
+            window_start, window_end = get_ending_soon_window()
+            auction_events = auction_events.filter(end_time__lte=window_end)
+        return auction_events
@@ -5,13 +5,20 @@ from django import forms
 from django.conf import settings
 from django.contrib.auth import authenticate
 from django.core.urlresolvers import reverse
-from django.db.models import Q
+from django.forms.forms import NON_FIELD_ERRORS
 from django.forms.util import ValidationError
 from django.contrib.admin import widgets as adminwidgets
 from django.contrib.localflavor.us.forms import USPhoneNumberField, USZipCodeField
 
-from lebay.apps.lebay.models import User, Seller, Item, AuctionEvent, Bid, Sales
-from lebay.apps.lebay.constants import AUCTION_ITEM_STATUS_RUNNING
+from lebay.apps.lebay.models import User, Seller, Item, ItemCategory, AuctionEvent, Bid, ProxyBid, Sales
+from lebay.apps.lebay.constants import AUCTION_ITEM_STATUS_RUNNING, AUCTION_ITEM_CONDITION_CHOICES, AUCTION_EVENT_PRICE_BUCKET_CHOICES, AUCTION_EVENT_SORTING_CHOICES, AUCTION_EVENT_SORTING_TITLE, LISTING_IMPORT_FORMAT_CHOICES, HISTORY_EXPORT_FORMAT_CHOICES, BID_RESULT_UNAVAILABLE
+from lebay.apps.lebay.facets import AuctionFacets
+from lebay.apps.lebay.bidding import BidResult
+from lebay.apps.lebay.proxybidding import submit_maximum
+from lebay.apps.lebay.orderbook import get_order_book
+from lebay.apps.lebay.search import search_items
+from lebay.apps.lebay.payments import format_time_modified, parse_time_modified
+from lebay.apps.lebay.signals import auctions_opened
 
 class UserLoginForm(forms.Form):
     username = forms.CharField(label=u'User Name')
@@ -43,12 +50,25 @@ class AuctionSearchForm(forms.Form):
     def search(self):
         cleaned_data = self.cleaned_data
         cleaned_query = cleaned_data.get('query', '') 
-        if cleaned_query:
-            matching_auctions = AuctionEvent.objects.get_current_auctions().filter(Q(item__title__icontains=cleaned_query) | Q(item__description__icontains=cleaned_query))
-        else:
-            matching_auctions = AuctionEvent.objects.get_current_auctions()
-            
-        return matching_auctions
+        return search_items(cleaned_query)
+
+class AuctionBrowseForm(forms.Form):
+    category = forms.ModelChoiceField(queryset=ItemCategory.objects.all(), required=False)
+    condition = forms.TypedChoiceField(choices=AUCTION_ITEM_CONDITION_CHOICES, coerce=int, required=False, empty_value=None)
+    price = forms.TypedChoiceField(choices=AUCTION_EVENT_PRICE_BUCKET_CHOICES, coerce=int, required=False, empty_value=None)
+    ending_soon = forms.BooleanField(required=False)
+    sort_by = forms.ChoiceField(choices=AUCTION_EVENT_SORTING_CHOICES, required=False)
+
+    def get_facets(self):
+        cleaned_data = self.cleaned_data
+        return AuctionFacets(category=cleaned_data.get('category'), condition=cleaned_data.get('condition'), price_bucket=cleaned_data.get('price'), ending_soon=cleaned_data.get('ending_soon'))
+
+    def browse(self, facets, user=None):
+        auction_events = facets.filter_auctions(AuctionEvent.objects.get_current_auctions().for_listing())
+        if user is not None:
+            auction_events = auction_events.exclude(item__seller=user)
+        sort_by = self.cleaned_data.get('sort_by') or AUCTION_EVENT_SORTING_TITLE
+        return auction_events.order_by(dict(AUCTION_EVENT_SORTING_CHOICES)[sort_by])
 
 class UserRegistrationForm(forms.ModelForm):
     password = forms.CharField(label=u'Password', widget=forms.PasswordInput(render_value=False))
@@ -154,7 +174,8 @@ class ItemForm(forms.ModelForm):
     def save(self, force_insert=False, force_update=False, commit=True):
         item = super(ItemForm, self).save(commit=False)
         item.seller = self.seller
-        item.save()
+        if commit:
+            item.save()
         return item
 
 class AuctionEventForm(forms.ModelForm):
@@ -198,8 +219,18 @@ class AuctionEventForm(forms.ModelForm):
         item.save()
         auction_event.item = item
         auction_event.save()
+        auctions_opened.send(sender=AuctionEvent, auction_event_ids=[auction_event.pk])
         return auction_event
 
+class ListingImportForm(forms.Form):
+    file = forms.FileField(label=u'Listings file')
+    format = forms.ChoiceField(choices=LISTING_IMPORT_FORMAT_CHOICES)
+
+class HistoryExportForm(forms.Form):
+    format = forms.ChoiceField(choices=HISTORY_EXPORT_FORMAT_CHOICES, required=False)
+    start_date = forms.DateField(required=False)
+    end_date = forms.DateField(required=False)
+
 class BidForm(forms.ModelForm):
     class Meta:
         model = Bid
@@ -213,9 +244,11 @@ class BidForm(forms.ModelForm):
     def clean_amount(self):
         cleaned_data = self.cleaned_data
         cleaned_amount = cleaned_data.get('amount', Decimal('0.00'))
-        if self.auction_event.bids.count():
-            if cleaned_amount < self.auction_event.bids.order_by('-amount')[0].amount:
+        if self.auction_event.bid_count:
+            if cleaned_amount <= self.auction_event.get_current_price():
                 raise ValidationError('Your bid has to be higher than the current price.')
+        elif cleaned_amount < self.auction_event.starting_price:
+            raise ValidationError('Your bid has to be at least the starting price.')
         return cleaned_amount
 
     def clean(self):
@@ -226,18 +259,64 @@ class BidForm(forms.ModelForm):
         return cleaned_data
     
     def save(self, force_insert=False, force_update=False, commit=True):
-        bid = super(BidForm, self).save(commit=False)
-        bid.auction_event = self.auction_event
-        bid.bidder = self.bidder
-        bid.save()
-        self.auction_event.winning_bidder = bid.bidder
-        self.auction_event.save()
-        return bid
+        order_book = get_order_book()
+        if order_book:
+            result = order_book.submit(self.auction_event, self.bidder, self.cleaned_data['amount'])
+        else:
+            result = submit_maximum(self.auction_event, self.bidder, self.cleaned_data['amount'], exact=True)
+        if not result.accepted:
+            self._errors[NON_FIELD_ERRORS] = self.error_class([result.get_message()])
+        return result
+
+class ProxyBidForm(forms.ModelForm):
+    class Meta:
+        model = ProxyBid
+        fields = ['maximum']
+
+    def __init__(self, data=None, auction_event=None, bidder=None, *args, **kwargs):
+        self.auction_event = auction_event
+        self.bidder = bidder
+        super(ProxyBidForm, self).__init__(data, *args, **kwargs)
+
+    def clean_maximum(self):
+        cleaned_maximum = self.cleaned_data.get('maximum', Decimal('0.00'))
+        if self.auction_event.bid_count:
+            if cleaned_maximum <= self.auction_event.get_current_price():
+                raise ValidationError('Your maximum bid has to be higher than the current price.')
+        elif cleaned_maximum < self.auction_event.starting_price:
+            raise ValidationError('Your maximum bid has to be at least the starting price.')
+        return cleaned_maximum
+
+    def save(self, force_insert=False, force_update=False, commit=True):
+        # The order book keeps prices in memory and knows nothing of maximums.
+        if get_order_book():
+            result = BidResult(BID_RESULT_UNAVAILABLE, self.auction_event, self.cleaned_data['maximum'])
+        else:
+            result = submit_maximum(self.auction_event, self.bidder, self.cleaned_data['maximum'])
+        if not result.accepted:
+            self._errors[NON_FIELD_ERRORS] = self.error_class([result.get_message()])
+        return result
 
 class PaymentForm(forms.Form):
     paypal_email = forms.EmailField(label='Enter your PayPal email.')
 
 class SalesForm(forms.ModelForm):
+    time_modified = forms.CharField(widget=forms.HiddenInput, required=False)
+
     class Meta:
         model = Sales
         fields = ['payment_status']
+
+    def __init__(self, *args, **kwargs):
+        super(SalesForm, self).__init__(*args, **kwargs)
+        if self.instance.pk:
+            self.initial['time_modified'] = format_time_modified(self.instance.time_modified)
+
+    def clean_time_modified(self):
+        time_modified = self.cleaned_data.get('time_modified')
+        if not time_modified:
+            return None
+        try:
+            return parse_time_modified(time_modified)
+        except ValueError:
+            raise ValidationError('Reload the page and try again.')
@@ -0,0 +1,85 @@
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import get_cache
+from django.utils.hashcompat import md5_constructor
+
+from lebay.apps.lebay.replication import is_reading_replica
+
+AUCTION_VERSION_KEY = 'lebay_auction_version_%s'
+AUCTION_FRAGMENT_KEY = 'lebay_auction_fragment_%s_%s_%s_%s'
+
+class FragmentCache(object):
+    # Rendered fragments are keyed on the auction's current version, so a
+    # bump makes every old fragment unreachable without deleting anything.
+    def __init__(self, backend_uri, timeout):
+        self.cache = get_cache(backend_uri)
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.hits = {}
+        self.misses = {}
+
+    def new_version(self):
+        return '%x%04x' % (int(time.time() * 1000000), random.getrandbits(16))
+
+    def get_version(self, auction_event_id):
+        version_key = AUCTION_VERSION_KEY % auction_event_id
+        version = self.cache.get(version_key)
+        if version is None:
+            version = self.new_version()
+            self.cache.set(version_key, version, self.timeout)
+        return version
+
+    def bump(self, auction_event_ids):
+        for auction_event_id in set(auction_event_ids):
+            self.cache.set(AUCTION_VERSION_KEY % auction_event_id, self.new_version(), self.timeout)
+
+    def get_key(self, auction_event_id, name, vary_on):
+        vary_hash = md5_constructor(u':'.join([unicode(value) for value in vary_on]).encode('utf-8')).hexdigest()
+        return AUCTION_FRAGMENT_KEY % (auction_event_id, self.get_version(auction_event_id), name, vary_hash)
+
+    def count(self, counts, name):
+        self.lock.acquire()
+        try:
+            counts[name] = counts.get(name, 0) + 1
+        finally:
+            self.lock.release()
+
+    def render(self, auction_event_id, name, vary_on, render_fragment):
+        key = self.get_key(auction_event_id, name, vary_on)
+        content = self.cache.get(key)
+        if content is None:
+            self.count(self.misses, name)
+            content = render_fragment()
+            # A replica may not have the change that bumped the version yet,
+            # and its fragment would then be served until the next bump.
+            if not is_reading_replica():
+                self.cache.set(key, content, self.timeout)
+        else:
+            self.count(self.hits, name)
+        return content
+
+    def get_stats(self):
+        stats = {}
+        for name in set(self.hits.keys() + self.misses.keys()):
+            hits = self.hits.get(name, 0)
+            misses = self.misses.get(name, 0)
+            stats[name] = {'hits': hits, 'misses': misses, 'hit_ratio': float(hits) / (hits + misses)}
+        return stats
+
+    def reset_stats(self):
+        self.lock.acquire()
+        try:
+            self.hits = {}
+            self.misses = {}
+        finally:
+            self.lock.release()
+
+fragment_cache = FragmentCache(
+    getattr(settings, 'LEBAY_FRAGMENT_CACHE_BACKEND', 'lebay.apps.lebay.lrucache://?max_entries=1000'),
+    getattr(settings, 'LEBAY_FRAGMENT_CACHE_TIMEOUT', 60 * 60))
+
+def bump_auction_versions(auction_event_ids):
+    fragment_cache.bump(auction_event_ids)
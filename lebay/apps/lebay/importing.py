@@ -0,0 +1,187 @@
+import csv
+import datetime
+from decimal import Decimal
+
+from django import forms
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import connection, transaction, DatabaseError
+from django.utils import simplejson
+
+from lebay.apps.lebay.forms import ItemForm, AuctionEventForm
+from lebay.apps.lebay.models import Item, ItemCategory, AuctionEvent
+from lebay.apps.lebay.search import index_items
+from lebay.apps.lebay.signals import auctions_opened
+from lebay.apps.lebay.constants import AUCTION_ITEM_STATUS_RUNNING, LISTING_IMPORT_FORMAT_CSV, LISTING_IMPORT_FORMAT_JSONL, LISTING_IMPORT_CHUNK_SIZE, LISTING_IMPORT_MAX_REPORTED_ERRORS
+
+DECIMAL_EXPONENTS = dict([(places, Decimal('1e-%d' % places)) for places in range(10)])
+
+def read_csv_rows(lines):
+    reader = csv.DictReader(lines)
+    for row in reader:
+        yield reader.line_num, dict([(key, value.decode('utf-8')) for key, value in row.items() if key and value is not None])
+
+def read_jsonl_rows(lines):
+    line_number = 0
+    for line in lines:
+        line_number += 1
+        if not line.strip():
+            continue
+        try:
+            row = simplejson.loads(line)
+        except ValueError:
+            row = None
+        if not isinstance(row, dict):
+            yield line_number, None
+            continue
+        yield line_number, dict([(str(key), value) for key, value in row.items()])
+
+def read_listing_rows(lines, format):
+    if format == LISTING_IMPORT_FORMAT_JSONL:
+        return read_jsonl_rows(lines)
+    return read_csv_rows(lines)
+
+class PreloadedChoiceField(forms.Field):
+    # Stands in for a ModelChoiceField without a query per row.
+    def __init__(self, objects, *args, **kwargs):
+        super(PreloadedChoiceField, self).__init__(*args, **kwargs)
+        self.objects = objects
+
+    def clean(self, value):
+        value = super(PreloadedChoiceField, self).clean(value)
+        try:
+            return self.objects[int(value)]
+        except (KeyError, ValueError, TypeError):
+            raise forms.ValidationError(u'Select a valid choice. That choice is not one of the available choices.')
+
+class ListingImportResult(object):
+    def __init__(self):
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+
+    def add_error(self, line_number, errors):
+        self.failed += 1
+        if len(self.errors) < LISTING_IMPORT_MAX_REPORTED_ERRORS:
+            self.errors.append((line_number, errors))
+
+def rebind_form(form, data):
+    # Building a form deep copies every field, which costs more than
+    # cleaning the row, so one bound form is reused for the whole file.
+    form.data = data
+    form.is_bound = True
+    form._errors = None
+    return form
+
+def get_insert_sql(model):
+    qn = connection.ops.quote_name
+    fields = [field for field in model._meta.local_fields if not field.primary_key]
+    sql = 'INSERT INTO %s (%s) VALUES (%s)' % (qn(model._meta.db_table), ', '.join([qn(field.column) for field in fields]), ', '.join(['%s'] * len(fields)))
+    return sql, fields
+
+def get_insert_values(fields, instance):
+    values = []
+    for field in fields:
+        value = getattr(instance, field.attname)
+        if isinstance(value, Decimal):
+            # get_db_prep_save works out the quantize exponent again for
+            # every value, which dominated the cost of a bulk insert.
+            values.append(unicode(value.quantize(DECIMAL_EXPONENTS[field.decimal_places])))
+        else:
+            values.append(field.get_db_prep_save(value))
+    return values
+
+class ListingImporter(object):
+    # Rows are validated with ItemForm and AuctionEventForm, then written
+    # straight to the tables in chunks of one transaction each: items one
+    # insert at a time for their ids, auction events in a single
+    # executemany. Item post_save does not fire, so the search index and
+    # the auctions_opened receivers are fed once per chunk instead.
+    def __init__(self, seller, chunk_size=LISTING_IMPORT_CHUNK_SIZE):
+        self.seller = seller
+        self.chunk_size = chunk_size
+        self.categories = dict([(category.pk, category) for category in ItemCategory.objects.all()])
+        try:
+            seller_profile = seller.seller
+            self.defaults = {
+                'shipping_method': seller_profile.default_shipping_method,
+                'shipping_detail': seller_profile.default_shipping_detail or '',
+                'payment_detail': seller_profile.default_payment_detail or '',
+            }
+        except ObjectDoesNotExist:
+            self.defaults = {}
+        self.item_form = ItemForm()
+        self.item_form.fields['category'] = PreloadedChoiceField(self.categories)
+        self.auction_form = AuctionEventForm()
+        self.item_sql, self.item_fields = get_insert_sql(Item)
+        self.auction_event_sql, self.auction_event_fields = get_insert_sql(AuctionEvent)
+
+    def validate(self, row):
+        for key, value in self.defaults.items():
+            if row.get(key) in (None, ''):
+                row[key] = value
+        item_form = rebind_form(self.item_form, row)
+        auction_form = rebind_form(self.auction_form, row)
+        item_valid = item_form.is_valid()
+        auction_valid = auction_form.is_valid()
+        if not (item_valid and auction_valid):
+            errors = {}
+            for form in (item_form, auction_form):
+                for field, messages in form.errors.items():
+                    errors[field] = [unicode(message) for message in messages]
+            return None, None, errors
+
+        current_time = datetime.datetime.now()
+        item = Item(seller_id=self.seller.pk, status=AUCTION_ITEM_STATUS_RUNNING, time_created=current_time, time_modified=current_time, **item_form.cleaned_data)
+        auction_data = dict([(str(key), value) for key, value in auction_form.cleaned_data.items() if value is not None])
+        auction_event = AuctionEvent(time_created=current_time, time_modified=current_time, **auction_data)
+        auction_event.update_current_price()
+        return item, auction_event, None
+
+    @transaction.commit_on_success
+    def write_chunk(self, listings):
+        cursor = connection.cursor()
+        # Each item's id is taken from its own insert; reading the ids back
+        # afterwards would also pick up items other requests add meanwhile.
+        for item, auction_event in listings:
+            cursor.execute(self.item_sql, get_insert_values(self.item_fields, item))
+            item.pk = connection.ops.last_insert_id(cursor, Item._meta.db_table, Item._meta.pk.column)
+            auction_event.item_id = item.pk
+        cursor.executemany(self.auction_event_sql, [get_insert_values(self.auction_event_fields, auction_event) for item, auction_event in listings])
+
+        items = [item for item, auction_event in listings]
+        index_items(items)
+        auction_event_ids = list(AuctionEvent.objects.filter(item__in=[item.pk for item in items]).values_list('pk', flat=True))
+        auctions_opened.send(sender=AuctionEvent, auction_event_ids=auction_event_ids)
+
+    def write(self, listings, result):
+        # A chunk that cannot be saved is rolled back and its rows reported
+        # as failed; the chunks before it stay imported.
+        try:
+            self.write_chunk([(item, auction_event) for line_number, item, auction_event in listings])
+        except DatabaseError, e:
+            for line_number, item, auction_event in listings:
+                result.add_error(line_number, {'__all__': [u'The listing could not be saved: %s' % e]})
+        else:
+            result.imported += len(listings)
+
+    def run(self, rows):
+        result = ListingImportResult()
+        listings = []
+        for line_number, row in rows:
+            if row is None:
+                result.add_error(line_number, {'__all__': [u'Row is not a JSON object.']})
+                continue
+            item, auction_event, errors = self.validate(row)
+            if errors:
+                result.add_error(line_number, errors)
+                continue
+            listings.append((line_number, item, auction_event))
+            if len(listings) >= self.chunk_size:
+                self.write(listings, result)
+                listings = []
+        if listings:
+            self.write(listings, result)
+        return result
+
+def import_listings(seller, lines, format=LISTING_IMPORT_FORMAT_CSV, chunk_size=LISTING_IMPORT_CHUNK_SIZE):
+    return ListingImporter(seller, chunk_size).run(read_listing_rows(lines, format))
@@ -0,0 +1,153 @@
+import datetime
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger('lebay.live')
+
+# A long poll holds a request worker per watcher for up to the live
+# timeout, so it is only used where the server handles requests in
+# threads. Otherwise watchers get the current state at once and ask again.
+LIVE_LONG_POLL = getattr(settings, 'LEBAY_LIVE_LONG_POLL', False)
+
+# SQLite binds at most 999 parameters, so watched auctions are read in
+# chunks.
+LIVE_LOAD_CHUNK_SIZE = 500
+
+def _total_seconds(delta):
+    return delta.days * 86400 + delta.seconds + delta.microseconds / 1000000.0
+
+def make_payload(current_price, starting_price, bid_count, end_time, closed_at):
+    if not bid_count:
+        current_price = starting_price
+    return {'price': current_price, 'bid_count': bid_count, 'end_time': end_time, 'closed': closed_at is not None}
+
+def get_live_data(sequence, payload, current_time=None):
+    if current_time is None:
+        current_time = datetime.datetime.now()
+    seconds_remaining = max(0, int(_total_seconds(payload['end_time'] - current_time)))
+    return {
+        'sequence': sequence,
+        'price': '%.2f' % payload['price'],
+        'bid_count': payload['bid_count'],
+        'seconds_remaining': seconds_remaining,
+        'closed': payload['closed'] or not seconds_remaining,
+    }
+
+class LivePublisher(object):
+    # Watchers block on one condition and are served from the in-memory
+    # state, so a change costs one read however many watchers there are.
+    # Signals publish changes made in this process; a poller picks up the
+    # ones made elsewhere with one read per tick for every watched auction.
+    def __init__(self, poll_interval=1.0, watch_expiry=60):
+        self.condition = threading.Condition()
+        self.states = {}
+        self.watched = {}
+        self.sequence = 0
+        self.reads = 0
+        self.poll_interval = poll_interval
+        self.watch_expiry = watch_expiry
+        self.poller = None
+
+    def load(self, auction_event_ids):
+        from lebay.apps.lebay.models import AuctionEvent
+
+        auction_event_ids = list(auction_event_ids)
+        payloads = {}
+        for i in range(0, len(auction_event_ids), LIVE_LOAD_CHUNK_SIZE):
+            self.reads += 1
+            auction_events = AuctionEvent.objects.filter(pk__in=auction_event_ids[i:i + LIVE_LOAD_CHUNK_SIZE]).values_list('pk', 'current_price', 'starting_price', 'bid_count', 'end_time', 'closed_at')
+            for row in auction_events:
+                payloads[row[0]] = make_payload(*row[1:])
+        return payloads
+
+    def update(self, payloads):
+        self.condition.acquire()
+        try:
+            changed = False
+            for auction_event_id, payload in payloads.items():
+                state = self.states.get(auction_event_id)
+                if state is None or state[1] != payload:
+                    self.sequence += 1
+                    self.states[auction_event_id] = (self.sequence, payload)
+                    changed = True
+            if changed:
+                self.condition.notifyAll()
+        finally:
+            self.condition.release()
+
+    def get_watched_ids(self, auction_event_ids=None):
+        if auction_event_ids is None:
+            return self.watched.keys()
+        return [auction_event_id for auction_event_id in set(auction_event_ids) if auction_event_id in self.watched]
+
+    def publish(self, auction_event_ids):
+        auction_event_ids = self.get_watched_ids(auction_event_ids)
+        if auction_event_ids:
+            self.update(self.load(auction_event_ids))
+
+    def publish_payload(self, auction_event_id, payload):
+        if auction_event_id in self.watched:
+            self.update({auction_event_id: payload})
+
+    def wait(self, auction_event_id, since=0, timeout=25):
+        if auction_event_id not in self.states:
+            self.update(self.load([auction_event_id]))
+        self.start_poller()
+        deadline = time.time() + timeout
+        self.condition.acquire()
+        try:
+            self.watched[auction_event_id] = time.time()
+            while True:
+                state = self.states.get(auction_event_id)
+                if state is None or state[0] > since:
+                    return state
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return state
+                self.condition.wait(remaining)
+        finally:
+            self.condition.release()
+
+    def expire_watches(self):
+        expired_before = time.time() - self.watch_expiry
+        self.condition.acquire()
+        try:
+            for auction_event_id, watched_at in self.watched.items():
+                if watched_at < expired_before:
+                    del self.watched[auction_event_id]
+                    self.states.pop(auction_event_id, None)
+        finally:
+            self.condition.release()
+
+    def poll(self):
+        while True:
+            time.sleep(self.poll_interval)
+            # A failed tick is logged and the next one tries again; the
+            # poller must outlive a locked or restarted database.
+            try:
+                self.expire_watches()
+                self.publish(self.get_watched_ids())
+            except Exception:
+                logger.exception('Polling watched auctions failed')
+            finally:
+                connection.close()
+
+    def start_poller(self):
+        if self.poller is None and self.poll_interval:
+            self.condition.acquire()
+            try:
+                if self.poller is None:
+                    self.poller = threading.Thread(target=self.poll)
+                    self.poller.setDaemon(True)
+                    self.poller.start()
+            finally:
+                self.condition.release()
+
+live_publisher = LivePublisher(getattr(settings, 'LEBAY_LIVE_POLL_INTERVAL', 1.0))
+
+def publish_auction_changes(auction_event_ids):
+    live_publisher.publish(auction_event_ids)
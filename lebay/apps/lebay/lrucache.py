@@ -0,0 +1,114 @@
+"Thread-safe in-memory cache backend that evicts the least recently used key."
+
+import threading
+import time
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from django.core.cache.backends.base import BaseCache
+
+PREVIOUS, NEXT, KEY, VALUE, EXPIRES = 0, 1, 2, 3, 4
+
+class CacheClass(BaseCache):
+    def __init__(self, _, params):
+        BaseCache.__init__(self, params)
+        max_entries = params.get('max_entries', 300)
+        try:
+            self._max_entries = int(max_entries)
+        except (ValueError, TypeError):
+            self._max_entries = 300
+
+        # Entries form a circular list around the root: root[NEXT] is the
+        # most recently used entry and root[PREVIOUS] the next to evict.
+        self._entries = {}
+        self._root = []
+        self._root[:] = [self._root, self._root, None, None, None]
+        self._lock = threading.Lock()
+
+    def _unlink(self, entry):
+        entry[PREVIOUS][NEXT] = entry[NEXT]
+        entry[NEXT][PREVIOUS] = entry[PREVIOUS]
+
+    def _link_first(self, entry):
+        entry[PREVIOUS] = self._root
+        entry[NEXT] = self._root[NEXT]
+        self._root[NEXT][PREVIOUS] = entry
+        self._root[NEXT] = entry
+
+    def _get_entry(self, key):
+        entry = self._entries.get(key)
+        if entry is not None and entry[EXPIRES] <= time.time():
+            self._unlink(entry)
+            del self._entries[key]
+            return None
+        return entry
+
+    def _set(self, key, value, timeout):
+        if timeout is None:
+            timeout = self.default_timeout
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = [None, None, key, value, time.time() + timeout]
+        else:
+            self._unlink(entry)
+            entry[VALUE] = value
+            entry[EXPIRES] = time.time() + timeout
+        self._link_first(entry)
+        while len(self._entries) > self._max_entries:
+            oldest = self._root[PREVIOUS]
+            self._unlink(oldest)
+            del self._entries[oldest[KEY]]
+
+    def add(self, key, value, timeout=None):
+        self._lock.acquire()
+        try:
+            if self._get_entry(key) is not None:
+                return False
+            self._set(key, pickle.dumps(value), timeout)
+            return True
+        finally:
+            self._lock.release()
+
+    def get(self, key, default=None):
+        self._lock.acquire()
+        try:
+            entry = self._get_entry(key)
+            if entry is None:
+                return default
+            self._unlink(entry)
+            self._link_first(entry)
+            value = entry[VALUE]
+        finally:
+            self._lock.release()
+        try:
+            return pickle.loads(value)
+        except pickle.PickleError:
+            return default
+
+    def set(self, key, value, timeout=None):
+        self._lock.acquire()
+        try:
+            self._set(key, pickle.dumps(value), timeout)
+        finally:
+            self._lock.release()
+
+    def delete(self, key):
+        self._lock.acquire()
+        try:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._unlink(entry)
+        finally:
+            self._lock.release()
+
+    def has_key(self, key):
+        self._lock.acquire()
+        try:
+            return self._get_entry(key) is not None
+        finally:
+            self._lock.release()
+
+    def __len__(self):
+        return len(self._entries)
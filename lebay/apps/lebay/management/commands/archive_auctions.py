@@ -0,0 +1,29 @@
+import datetime
+import sys
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand, CommandError
+
+from lebay.apps.lebay.archiving import ARCHIVE_AFTER_DAYS, archive_auctions
+from lebay.apps.lebay.dashboard import is_dashboard_cache_shared
+
+class Command(NoArgsCommand):
+    help = 'Moves auctions closed longer ago than LEBAY_ARCHIVE_AFTER_DAYS, with their bids and sales, out of the live tables into one SQLite file per month under LEBAY_ARCHIVE_ROOT. Auctions with a payment still processing or disputed stay live.'
+    option_list = NoArgsCommand.option_list + (
+        make_option('--days', dest='days', type='int', default=ARCHIVE_AFTER_DAYS,
+            help='Archive auctions closed more than this many days ago.'),
+    )
+
+    def handle_noargs(self, **options):
+        days = options.get('days', ARCHIVE_AFTER_DAYS)
+        if days < 0:
+            raise CommandError('--days cannot be negative.')
+        if not is_dashboard_cache_shared():
+            sys.stderr.write('Warning: CACHE_BACKEND is local to this process, so dashboards cached by the web server still show the archived auctions.\n')
+        cutoff = datetime.datetime.now() - datetime.timedelta(days=days)
+        try:
+            archived, bid_count, sale_count = archive_auctions(cutoff)
+        except ValueError, e:
+            raise CommandError(str(e))
+        if int(options.get('verbosity', 1)) > 0:
+            print 'Archived %s auction event(s) closed before %s, with %s bid(s) and %s sale(s).' % (archived, cutoff.strftime('%Y-%m-%d %H:%M'), bid_count, sale_count)
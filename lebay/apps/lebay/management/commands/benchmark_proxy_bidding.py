@@ -0,0 +1,64 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from lebay.apps.lebay.models import AuctionEvent, Bid
+from lebay.apps.lebay.proxybidding import ProxyState, resolve_maximum
+from lebay.apps.lebay.constants import BID_RESULT_TOO_LOW
+
+class Command(BaseCommand):
+    help = 'Replays the recorded bid history as if every bid had been a maximum, comparing proxy resolution against scanning earlier bids for the highest one. Read only.'
+    option_list = BaseCommand.option_list + (
+        make_option('--bids', dest='bids', type='int', default=200000,
+            help='Number of recorded bids to replay.'),
+        make_option('--queries', dest='queries', type='int', default=500,
+            help='Number of bids to also time against the database, one query per approach.'),
+    )
+
+    def handle(self, *args, **options):
+        history = list(Bid.objects.order_by('auction_event', 'time_created', 'pk').values_list('auction_event', 'bidder', 'amount')[:options['bids']])
+        if not history:
+            raise CommandError('There is no bid history to replay; try seed_marketplace first.')
+        starting_prices = dict(AuctionEvent.objects.filter(pk__in=set([bid[0] for bid in history])).values_list('pk', 'starting_price'))
+
+        # What a bid used to cost: finding the highest earlier bid.
+        started = time.time()
+        earlier = {}
+        for auction_event_id, bidder_id, amount in history:
+            amounts = earlier.setdefault(auction_event_id, [])
+            if amounts:
+                max(amounts)
+            amounts.append(amount)
+        scan_seconds = time.time() - started
+
+        started = time.time()
+        states = {}
+        recorded = 0
+        rejected = 0
+        for auction_event_id, bidder_id, amount in history:
+            state = states.get(auction_event_id)
+            if state is None:
+                state = states[auction_event_id] = ProxyState(starting_prices[auction_event_id], starting_prices[auction_event_id], 0, None, None)
+            status, bids = resolve_maximum(state, bidder_id, amount)
+            if status == BID_RESULT_TOO_LOW:
+                rejected += 1
+            recorded += len(bids)
+        proxy_seconds = time.time() - started
+
+        print '%s bids over %s auctions' % (len(history), len(states))
+        print 'scan of earlier bids  %10.0f bids/s' % (len(history) / max(scan_seconds, 1e-9))
+        print 'proxy resolution      %10.0f bids/s' % (len(history) / max(proxy_seconds, 1e-9))
+        print 'as maximums they record %s bids (%s rejected as too low), %.0f%% of the history' % (recorded, rejected, recorded * 100.0 / len(history))
+
+        sample = history[-options['queries']:]
+        if sample:
+            started = time.time()
+            for auction_event_id, bidder_id, amount in sample:
+                list(Bid.objects.filter(auction_event=auction_event_id).order_by('-amount').values_list('amount', flat=True)[:1])
+            scan_query_seconds = time.time() - started
+            started = time.time()
+            for auction_event_id, bidder_id, amount in sample:
+                list(AuctionEvent.objects.filter(pk=auction_event_id).values_list('starting_price', 'current_price', 'bid_count', 'winning_bidder', 'proxy_maximum'))
+            proxy_query_seconds = time.time() - started
+            print 'database, %s bids: highest bid query %.2fms, proxy state read %.2fms per bid' % (len(sample), scan_query_seconds * 1000 / len(sample), proxy_query_seconds * 1000 / len(sample))
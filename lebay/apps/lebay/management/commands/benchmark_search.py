@@ -0,0 +1,34 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from lebay.apps.lebay.models import Item, ItemSearchTerm
+from lebay.apps.lebay.search import search_items, get_auction_events
+
+class Command(BaseCommand):
+    help = 'Measures search latency for the given queries against the current database.'
+    args = '<query> [query ...]'
+    option_list = BaseCommand.option_list + (
+        make_option('--repeat', dest='repeat', type='int', default=20,
+            help='Number of times each query is run.'),
+        make_option('--per-page', dest='per_page', type='int', default=10,
+            help='Number of ranked results fetched per query.'),
+    )
+
+    def handle(self, *args, **options):
+        if not args:
+            raise CommandError('Usage: benchmark_search %s' % self.args)
+
+        print '%s items, %s index terms' % (Item.objects.count(), ItemSearchTerm.objects.count())
+        for query in args:
+            timings = []
+            for i in range(max(1, options['repeat'])):
+                started = time.time()
+                results = search_items(query)
+                total = results.count()
+                get_auction_events(results[:options['per_page']])
+                timings.append((time.time() - started) * 1000)
+            timings.sort()
+            print '%-30s %8s matches  p50 %8.2fms  p95 %8.2fms  max %8.2fms' % (
+                query[:30], total, timings[len(timings) / 2], timings[int(len(timings) * 0.95)], timings[-1])
@@ -0,0 +1,94 @@
+import datetime
+import random
+import time
+from decimal import Decimal
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from lebay.apps.lebay.closing import settle, _close_chunk
+from lebay.apps.lebay.models import AuctionEvent, Item
+from lebay.apps.lebay.signals import auctions_closed
+from lebay.apps.lebay.utils import rebuild_bid_aggregates
+from lebay.apps.lebay.constants import AUCTION_ITEM_STATUS_RUNNING, AUCTION_ITEM_STATUS_SOLD, AUCTION_ITEM_STATUS_EXPIRED, AUCTION_EVENT_SETTLEMENT_CHUNK_SIZE
+
+def get_chunks(values):
+    for i in range(0, len(values), AUCTION_EVENT_SETTLEMENT_CHUNK_SIZE):
+        yield values[i:i + AUCTION_EVENT_SETTLEMENT_CHUNK_SIZE]
+
+def make_rows(rng, count):
+    rows = []
+    for i in range(count):
+        bid_count = rng.choice([0, 0, 1, 3, 12])
+        current_price = Decimal('%.2f' % rng.uniform(1, 900))
+        reserve_price = Decimal('0.00')
+        if rng.random() < 0.2:
+            reserve_price = Decimal('%.2f' % min(float(current_price) * rng.uniform(0.5, 2), 999.99))
+        proxy_maximum = None
+        if bid_count and rng.random() < 0.3:
+            proxy_maximum = current_price + Decimal('%.2f' % rng.uniform(1, 50))
+        rows.append((i, i, bid_count, current_price, reserve_price, proxy_maximum))
+    return rows
+
+class Command(BaseCommand):
+    help = 'Times settling a close window of auctions: the in-memory settlement of synthetic rows, then the recently closed auctions in the database reopened and closed again in batches and one at a time. Database changes are rolled back.'
+    option_list = BaseCommand.option_list + (
+        make_option('--auctions', dest='auctions', type='int', default=100000,
+            help='Number of auctions in the close window.'),
+        make_option('--one-at-a-time', dest='one_at_a_time', type='int', default=200,
+            help='Number of auctions to also close one at a time, for comparison.'),
+    )
+
+    def handle(self, *args, **options):
+        rows = make_rows(random.Random(1), options['auctions'])
+        started = time.time()
+        sold, unmet, expired = settle(rows)
+        seconds = time.time() - started
+        print 'settle %s synthetic rows: %.2fs, %.0f rows/s (%s sold, %s below reserve, %s without bids)' % (len(rows), seconds, len(rows) / max(seconds, 1e-9), len(sold), len(unmet), len(expired))
+
+        auction_event_ids = list(AuctionEvent.objects.filter(closed_at__isnull=False, item__status__in=[AUCTION_ITEM_STATUS_SOLD, AUCTION_ITEM_STATUS_EXPIRED]).order_by('-pk').values_list('pk', flat=True)[:options['auctions']])
+        if not auction_event_ids:
+            raise CommandError('There are no closed auctions to settle again; try seed_marketplace first.')
+        self.benchmark_database(auction_event_ids, options['one_at_a_time'])
+
+    @transaction.commit_manually
+    def benchmark_database(self, auction_event_ids, one_at_a_time):
+        try:
+            self.reopen(auction_event_ids)
+            current_time = datetime.datetime.now()
+            closed = 0
+            sold = 0
+            expired = 0
+            settle_seconds = 0.0
+            signal_seconds = 0.0
+            for chunk in get_chunks(auction_event_ids):
+                started = time.time()
+                closed_ids, chunk_sold, chunk_expired = _close_chunk(chunk, current_time)
+                settle_seconds += time.time() - started
+                started = time.time()
+                auctions_closed.send(sender=AuctionEvent, auction_event_ids=closed_ids)
+                signal_seconds += time.time() - started
+                closed += len(closed_ids)
+                sold += chunk_sold
+                expired += chunk_expired
+            total_seconds = settle_seconds + signal_seconds
+            print 'batched, %s auctions: %.2fs settling, %.2fs in closed signal receivers, %.0f auctions/s (%s sold, %s expired)' % (closed, settle_seconds, signal_seconds, closed / max(total_seconds, 1e-9), sold, expired)
+
+            sample = auction_event_ids[:one_at_a_time]
+            if sample:
+                self.reopen(sample)
+                started = time.time()
+                for auction_event_id in sample:
+                    _close_chunk([auction_event_id], current_time)
+                    auctions_closed.send(sender=AuctionEvent, auction_event_ids=[auction_event_id])
+                seconds = time.time() - started
+                print 'one at a time, %s auctions: %.2fs, %.0f auctions/s, %.0fs projected for the batch' % (len(sample), seconds, len(sample) / max(seconds, 1e-9), seconds * len(auction_event_ids) / len(sample))
+        finally:
+            transaction.rollback()
+
+    def reopen(self, auction_event_ids):
+        for chunk in get_chunks(auction_event_ids):
+            AuctionEvent.objects.filter(pk__in=chunk).update(closed_at=None, final_price=None, final_value_fee=None)
+            rebuild_bid_aggregates(chunk)
+            Item.objects.filter(auction_events__pk__in=chunk).update(status=AUCTION_ITEM_STATUS_RUNNING)
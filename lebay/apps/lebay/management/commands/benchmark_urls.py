@@ -0,0 +1,125 @@
+import time
+from decimal import Decimal
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.client import Client
+
+from lebay.apps.lebay import urls as lebay_urls
+from lebay.apps.lebay.models import User, Item, ItemCategory, AuctionEvent
+from lebay.apps.lebay.constants import AUCTION_ITEM_STATUS_RUNNING
+
+SKIPPED_URLS = {
+    'lebay_logout': 'ends the benchmark session',
+    'lebay_update_payments': 'accepts POST only',
+}
+
+SEARCH_QUERIES = ['vintage', 'lamp', 'rare camera', 'signed leather watch']
+
+def get_percentile(timings, fraction):
+    return timings[min(int(len(timings) * fraction), len(timings) - 1)]
+
+class Command(BaseCommand):
+    help = 'Requests every lebay URL through the test client and reports p50/p95/p99 latency and queries per request. Bids are real, so run it against a copy of the database, ideally one filled by seed_marketplace.'
+    args = '<username> <password>'
+    option_list = BaseCommand.option_list + (
+        make_option('--requests', dest='requests', type='int', default=50,
+            help='Number of requests per URL.'),
+        make_option('--only', dest='only',
+            help='Comma separated URL names to benchmark instead of all of them.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 2:
+            raise CommandError('Usage: benchmark_urls %s' % self.args)
+        try:
+            user = User.objects.get(username=args[0])
+        except User.DoesNotExist:
+            raise CommandError('Unknown user %r.' % args[0])
+        client = Client()
+        if not client.login(username=args[0], password=args[1]):
+            raise CommandError('Could not log in as %r.' % args[0])
+
+        samples = self.get_samples(user)
+        only = options.get('only') and options['only'].split(',')
+        debug = settings.DEBUG
+        settings.DEBUG = True
+        try:
+            print '%-40s %6s %9s %9s %9s %8s' % ('url', 'status', 'p50 ms', 'p95 ms', 'p99 ms', 'queries')
+            for pattern in lebay_urls.urlpatterns:
+                name = pattern.name
+                if only and name not in only:
+                    continue
+                if name in SKIPPED_URLS:
+                    print '%-40s skipped, %s' % (name, SKIPPED_URLS[name])
+                    continue
+                kwargs = dict([(group, samples[group]) for group in pattern.regex.groupindex.keys() if group in samples])
+                if len(kwargs) != len(pattern.regex.groupindex):
+                    print '%-40s skipped, no sample data' % name
+                    continue
+                try:
+                    self.benchmark(client, name, reverse(name, kwargs=kwargs), options['requests'])
+                except Exception, e:
+                    # The test client re-raises view errors; report them and
+                    # carry on with the remaining URLs.
+                    print '%-40s failed, %s: %s' % (name, e.__class__.__name__, e)
+            if samples.get('bid_auction_event_id') and (not only or 'bid' in only):
+                self.benchmark_bids(client, samples['bid_auction_event_id'], options['requests'])
+        finally:
+            settings.DEBUG = debug
+
+    def get_samples(self, user):
+        samples = {'section': 'selling', 'name': 'sales', 'user_id': user.pk}
+        running = AuctionEvent.objects.get_current_auctions()
+        for key, queryset in (
+            ('auction_event_id', running.order_by('-bid_count')),
+            ('bid_auction_event_id', running.exclude(item__seller=user).order_by('-bid_count')),
+            ('category_id', ItemCategory.objects.filter(parent__isnull=True).order_by('-live_auction_count')),
+            ('item_id', Item.objects.filter(seller=user).exclude(status=AUCTION_ITEM_STATUS_RUNNING)),
+        ):
+            pks = list(queryset.values_list('pk', flat=True)[:1])
+            if pks:
+                samples[key] = pks[0]
+        return samples
+
+    def run(self, timings, queries, request):
+        connection.queries = []
+        started = time.time()
+        response = request()
+        # Streamed responses only do their work when read.
+        response.content
+        timings.append((time.time() - started) * 1000)
+        queries.append(len(connection.queries))
+        return response
+
+    def report(self, name, status, timings, queries):
+        timings.sort()
+        queries.sort()
+        print '%-40s %6s %9.2f %9.2f %9.2f %8s' % (name[:40], status, get_percentile(timings, 0.5), get_percentile(timings, 0.95), get_percentile(timings, 0.99), get_percentile(queries, 0.5))
+
+    def benchmark(self, client, name, url, count):
+        timings = []
+        queries = []
+        if name == 'lebay_search_auction_events':
+            requests = [lambda query=query: client.get(url, {'query': query}) for query in SEARCH_QUERIES]
+        else:
+            requests = [lambda: client.get(url)]
+        status = None
+        for i in range(max(1, count)):
+            response = self.run(timings, queries, requests[i % len(requests)])
+            status = response.status_code
+        self.report(name, status, timings, queries)
+
+    def benchmark_bids(self, client, auction_event_id, count):
+        url = reverse('lebay_view_auction_event', args=[auction_event_id])
+        timings = []
+        queries = []
+        status = None
+        for i in range(max(1, count)):
+            amount = AuctionEvent.objects.get(pk=auction_event_id).get_current_price() + Decimal('0.01')
+            response = self.run(timings, queries, lambda: client.post(url, {'amount': str(amount)}))
+            status = response.status_code
+        self.report('bid on lebay_view_auction_event', status, timings, queries)
@@ -0,0 +1,56 @@
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from lebay.apps.lebay.models import AuctionEvent, Bid, Sales
+
+def render_auction_event(auction_event):
+    # The per row calls made by the listing templates.
+    return [
+        unicode(auction_event), auction_event.is_running(), auction_event.get_current_price(),
+        auction_event.get_time_until_end(), auction_event.is_paid(), auction_event.get_payment_status(),
+        auction_event.item.get_condition(), auction_event.item.seller.username, unicode(auction_event.item.category),
+        auction_event.winning_bidder and auction_event.winning_bidder.username,
+    ]
+
+def render_bid(bid):
+    return [unicode(bid), bid.bidder.username, bid.amount]
+
+def render_sale(sale):
+    return [unicode(sale), sale.auction_event.item.title]
+
+class Command(BaseCommand):
+    help = 'Renders a page of each listing and fails if its query count grows with the number of rows.'
+    option_list = BaseCommand.option_list + (
+        make_option('--rows', dest='rows', type='int', default=50,
+            help='Number of rows on each page.'),
+    )
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        listings = [
+            ('all auctions', AuctionEvent.objects.get_listing(), render_auction_event),
+            ('current auctions', AuctionEvent.objects.get_current_auctions().for_listing(), render_auction_event),
+            ('bids', Bid.objects.select_related('auction_event__item', 'bidder'), render_bid),
+            ('sales', Sales.objects.select_related('auction_event__item'), render_sale),
+        ]
+
+        debug = settings.DEBUG
+        settings.DEBUG = True
+        failures = []
+        try:
+            for name, queryset, render in listings:
+                connection.queries = []
+                row_count = len([render(obj) for obj in queryset[:rows]])
+                query_count = len(connection.queries)
+                if query_count > 1:
+                    failures.append('%s: %s queries for %s rows' % (name, query_count, row_count))
+                if int(options.get('verbosity', 1)) > 0:
+                    print '%-20s %4s rows %4s queries' % (name, row_count, query_count)
+        finally:
+            settings.DEBUG = debug
+
+        if failures:
+            raise CommandError('Listing query count regression:\n%s' % '\n'.join(failures))
@@ -0,0 +1,22 @@
+from django.core.management.base import NoArgsCommand, CommandError
+
+from lebay.apps.lebay.queryplans import get_full_scan_finder, find_full_scans
+
+class Command(NoArgsCommand):
+    help = 'Explains the hot auction querysets and fails if any of them falls back to a full table scan.'
+
+    def handle_noargs(self, **options):
+        get_full_scans = get_full_scan_finder()
+        if get_full_scans is None:
+            raise CommandError('Query plans can only be checked on sqlite3 or postgresql.')
+
+        verbosity = int(options.get('verbosity', 1))
+        failures = []
+        for name, full_scans in find_full_scans(get_full_scans):
+            if full_scans:
+                failures.append('%s: full scan of %s' % (name, ', '.join(full_scans)))
+            if verbosity > 0:
+                print '%-30s %s' % (name, full_scans and 'FULL SCAN' or 'ok')
+
+        if failures:
+            raise CommandError('Query plan regression:\n%s' % '\n'.join(failures))
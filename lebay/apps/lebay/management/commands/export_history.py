@@ -0,0 +1,51 @@
+import datetime
+import sys
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from lebay.apps.lebay.constants import HISTORY_EXPORT_FORMAT_CSV, HISTORY_EXPORT_FORMAT_CHOICES
+from lebay.apps.lebay.exporting import HISTORY_EXPORTS, export_history
+from lebay.apps.lebay.models import User
+
+def parse_date(value):
+    if not value:
+        return None
+    try:
+        return datetime.date(*time.strptime(value, '%Y-%m-%d')[:3])
+    except ValueError:
+        raise CommandError('Dates must look like YYYY-MM-DD, not %r.' % value)
+
+class Command(BaseCommand):
+    help = "Streams a seller's sales, bids or auctions as CSV or JSON lines without loading them all into memory."
+    args = '<seller username> <%s>' % '|'.join(sorted(HISTORY_EXPORTS.keys()))
+    option_list = BaseCommand.option_list + (
+        make_option('--format', dest='format', default=HISTORY_EXPORT_FORMAT_CSV,
+            help='Output format: %s.' % ', '.join([format for format, label in HISTORY_EXPORT_FORMAT_CHOICES])),
+        make_option('--start', dest='start', help='First day to include, YYYY-MM-DD.'),
+        make_option('--end', dest='end', help='Last day to include, YYYY-MM-DD.'),
+        make_option('--output', dest='output', help='File to write to instead of standard output.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 2 or args[1] not in HISTORY_EXPORTS:
+            raise CommandError('Usage: export_history %s' % self.args)
+        if options['format'] not in dict(HISTORY_EXPORT_FORMAT_CHOICES):
+            raise CommandError('Unknown format %r.' % options['format'])
+        try:
+            seller = User.objects.get(username=args[0])
+        except User.DoesNotExist:
+            raise CommandError('Unknown seller %r.' % args[0])
+
+        lines = export_history(args[1], seller, options['format'], parse_date(options.get('start')), parse_date(options.get('end')))
+        if options.get('output'):
+            output = open(options['output'], 'wb')
+        else:
+            output = sys.stdout
+        try:
+            for line in lines:
+                output.write(line)
+        finally:
+            if options.get('output'):
+                output.close()
@@ -0,0 +1,43 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from lebay.apps.lebay.constants import LISTING_IMPORT_FORMAT_CSV, LISTING_IMPORT_FORMAT_CHOICES, LISTING_IMPORT_CHUNK_SIZE
+from lebay.apps.lebay.importing import import_listings
+from lebay.apps.lebay.models import User
+
+class Command(BaseCommand):
+    help = 'Lists every valid row of a CSV or JSON lines file as a running auction for the given seller and reports the rows that failed.'
+    args = '<seller username> <file>'
+    option_list = BaseCommand.option_list + (
+        make_option('--format', dest='format', default=LISTING_IMPORT_FORMAT_CSV,
+            help='File format: %s.' % ', '.join([format for format, label in LISTING_IMPORT_FORMAT_CHOICES])),
+        make_option('--chunk-size', dest='chunk_size', type='int', default=LISTING_IMPORT_CHUNK_SIZE,
+            help='Number of listings written per transaction.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 2:
+            raise CommandError('Usage: import_listings %s' % self.args)
+        if options['format'] not in dict(LISTING_IMPORT_FORMAT_CHOICES):
+            raise CommandError('Unknown format %r.' % options['format'])
+        try:
+            seller = User.objects.get(username=args[0])
+        except User.DoesNotExist:
+            raise CommandError('Unknown seller %r.' % args[0])
+        try:
+            lines = open(args[1], 'rb')
+        except IOError, e:
+            raise CommandError('Could not open %s: %s' % (args[1], e))
+
+        started = time.time()
+        try:
+            result = import_listings(seller, lines, options['format'], options['chunk_size'])
+        finally:
+            lines.close()
+
+        for line_number, errors in result.errors:
+            for field, messages in errors.items():
+                print 'line %s: %s: %s' % (line_number, field, ' '.join(messages))
+        print 'Imported %s listing(s), %s row(s) failed, in %.1fs.' % (result.imported, result.failed, time.time() - started)
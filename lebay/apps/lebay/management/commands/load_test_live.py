@@ -0,0 +1,89 @@
+import threading
+import time
+from decimal import Decimal
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from lebay.apps.lebay.live import live_publisher
+from lebay.apps.lebay.proxybidding import submit_maximum
+from lebay.apps.lebay.models import AuctionEvent, User
+
+class Watcher(threading.Thread):
+    def __init__(self, auction_event_id, stopping, timeout):
+        threading.Thread.__init__(self)
+        self.setDaemon(True)
+        self.auction_event_id = auction_event_id
+        self.stopping = stopping
+        self.timeout = timeout
+        self.received = []
+
+    def run(self):
+        since = 0
+        while not self.stopping.isSet():
+            state = live_publisher.wait(self.auction_event_id, since, self.timeout)
+            if state is None:
+                return
+            if state[0] > since:
+                self.received.append((state[0], time.time()))
+                since = state[0]
+
+class Command(BaseCommand):
+    help = 'Places bids on a running auction while thousands of in-process watchers wait on the live publisher, then reports delivery latency and database reads. Bids are real, so run it against a copy of the database.'
+    args = '<auction_event_id> <bidder username>'
+    option_list = BaseCommand.option_list + (
+        make_option('--watchers', dest='watchers', type='int', default=2000,
+            help='Number of simulated watchers.'),
+        make_option('--changes', dest='changes', type='int', default=20,
+            help='Number of bids placed while they watch.'),
+        make_option('--interval', dest='interval', type='float', default=0.25,
+            help='Seconds between bids.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 2:
+            raise CommandError('Usage: load_test_live %s' % self.args)
+        try:
+            auction_event = AuctionEvent.objects.select_related('item').get(pk=args[0])
+            bidder = User.objects.get(username=args[1])
+        except (AuctionEvent.DoesNotExist, User.DoesNotExist, ValueError):
+            raise CommandError('Unknown auction event or bidder.')
+        if not auction_event.is_running():
+            raise CommandError('Auction event %s is not running.' % auction_event.pk)
+
+        threading.stack_size(256 * 1024)
+        stopping = threading.Event()
+        watchers = [Watcher(auction_event.pk, stopping, 5) for i in range(options['watchers'])]
+        started = time.time()
+        for watcher in watchers:
+            watcher.start()
+        print '%s watchers started in %.2fs' % (len(watchers), time.time() - started)
+
+        time.sleep(1)
+        reads_before = live_publisher.reads
+        started = time.time()
+        published = {}
+        amount = auction_event.get_current_price()
+        for i in range(options['changes']):
+            amount += Decimal('0.01')
+            placed_at = time.time()
+            result = submit_maximum(auction_event, bidder, amount, exact=True)
+            if not result.accepted:
+                raise CommandError('Bid of %s was rejected: %s' % (amount, result.get_message()))
+            published[live_publisher.states[auction_event.pk][0]] = placed_at
+            time.sleep(options['interval'])
+        elapsed = time.time() - started
+        reads = live_publisher.reads - reads_before
+
+        stopping.set()
+        latencies = []
+        for watcher in watchers:
+            for sequence, received_at in watcher.received:
+                if sequence in published:
+                    latencies.append((received_at - published[sequence]) * 1000)
+        latencies.sort()
+
+        print '%s bids, %s deliveries of %s expected' % (len(published), len(latencies), len(published) * len(watchers))
+        if latencies:
+            print 'latency p50 %.2fms  p95 %.2fms  max %.2fms' % (latencies[len(latencies) / 2], latencies[int(len(latencies) * 0.95)], latencies[-1])
+        print '%s database reads in %.1fs (%s bids, about %d poll ticks)' % (reads, elapsed, len(published), elapsed / live_publisher.poll_interval)
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from lebay.apps.lebay.utils import rebuild_bid_aggregates
+
+class Command(BaseCommand):
+    help = 'Recomputes current_price, bid_count and highest_bid on auction events that are not closed yet from the recorded bids.'
+    args = '[auction_event_id ...]'
+
+    def handle(self, *args, **options):
+        auction_event_ids = None
+        if args:
+            try:
+                auction_event_ids = [int(arg) for arg in args]
+            except ValueError:
+                raise CommandError('Auction event ids must be integers.')
+
+        updated = rebuild_bid_aggregates(auction_event_ids)
+        if int(options.get('verbosity', 1)) > 0:
+            print 'Rebuilt bid aggregates for %s auction event(s).' % updated
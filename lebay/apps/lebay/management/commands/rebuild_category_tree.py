@@ -0,0 +1,14 @@
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+from lebay.apps.lebay.models import ItemCategory
+
+class Command(NoArgsCommand):
+    help = 'Recomputes category paths from their parents and the live auction count of every category subtree.'
+
+    @transaction.commit_on_success
+    def handle_noargs(self, **options):
+        path_count = ItemCategory.objects.rebuild_paths()
+        group_count = ItemCategory.objects.rebuild_live_counts()
+        if int(options.get('verbosity', 1)) > 0:
+            print 'Updated %s category path(s), counted auctions in %s categories.' % (path_count, group_count)
@@ -0,0 +1,13 @@
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+from lebay.apps.lebay.models import AuctionFacetCount
+
+class Command(NoArgsCommand):
+    help = 'Recomputes the category, condition and price facet counts of running auctions.'
+
+    @transaction.commit_on_success
+    def handle_noargs(self, **options):
+        group_count = AuctionFacetCount.objects.rebuild()
+        if int(options.get('verbosity', 1)) > 0:
+            print 'Rebuilt %s facet count(s).' % group_count
@@ -0,0 +1,34 @@
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+from lebay.apps.lebay.models import Item
+from lebay.apps.lebay.search import index_items
+
+class Command(NoArgsCommand):
+    help = 'Rebuilds the item search index from item titles and descriptions.'
+    option_list = NoArgsCommand.option_list + (
+        make_option('--chunk-size', dest='chunk_size', type='int', default=1000,
+            help='Number of items indexed per transaction.'),
+    )
+
+    def handle_noargs(self, **options):
+        chunk_size = options['chunk_size']
+        item_count = 0
+        term_count = 0
+        last_pk = 0
+        while True:
+            items = list(Item.objects.filter(pk__gt=last_pk).order_by('pk')[:chunk_size])
+            if not items:
+                break
+            term_count += self.index_chunk(items)
+            item_count += len(items)
+            last_pk = items[-1].pk
+
+        if int(options.get('verbosity', 1)) > 0:
+            print 'Indexed %s term(s) for %s item(s).' % (term_count, item_count)
+
+    @transaction.commit_on_success
+    def index_chunk(self, items):
+        return index_items(items)
@@ -0,0 +1,40 @@
+import sys
+from optparse import make_option
+
+from django.core.management.base import NoArgsCommand
+
+from lebay.apps.lebay.closing import AuctionCloser
+from lebay.apps.lebay.dashboard import is_dashboard_cache_shared
+
+class Command(NoArgsCommand):
+    help = 'Closes ended auction events as their end time passes.'
+    option_list = NoArgsCommand.option_list + (
+        make_option('--catch-up', action='store_true', dest='catch_up', default=False,
+            help='Close every auction that has already ended and exit.'),
+        make_option('--horizon', dest='horizon', type='int', default=300,
+            help='Seconds ahead of now to schedule upcoming auction ends.'),
+        make_option('--poll-interval', dest='poll_interval', type='int', default=30,
+            help='Maximum seconds to sleep before looking for newly listed auctions.'),
+        make_option('--batch-size', dest='batch_size', type='int', default=500,
+            help='Maximum number of auctions closed per batch.'),
+    )
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        if not is_dashboard_cache_shared():
+            sys.stderr.write('Warning: CACHE_BACKEND is local to this process, so dashboards cached by the web server are not invalidated as auctions close.\n')
+        closer = AuctionCloser(horizon=options['horizon'], batch_size=options['batch_size'], poll_interval=options['poll_interval'])
+
+        if options['catch_up']:
+            closed = closer.catch_up()
+            if verbosity > 0:
+                print 'Closed %s ended auction(s).' % closed
+            return
+
+        def report(closer, closed):
+            if verbosity > 1 or (verbosity > 0 and closed):
+                stats = closer.get_stats()
+                stats['closed'] = closed
+                print 'closed=%(closed)s scheduled=%(scheduled)s backlog=%(backlog)s lag=%(lag).1fs last_batch_lag=%(last_batch_lag).1fs sold=%(sold)s expired=%(expired)s' % stats
+
+        closer.run(callback=report)
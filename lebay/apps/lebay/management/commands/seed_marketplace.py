@@ -0,0 +1,220 @@
+import bisect
+import datetime
+import random
+import time
+from decimal import Decimal
+from optparse import make_option
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from lebay.apps.lebay.closing import close_auctions
+from lebay.apps.lebay.constants import AUCTION_ITEM_STATUS_RUNNING, AUCTION_ITEM_CONDITION_CHOICES, AUCTION_EVENT_SHIPPING_CHOICES, SALES_PAYMENT_STATUS_CHOICES
+from lebay.apps.lebay.importing import get_insert_sql, get_insert_values
+from lebay.apps.lebay.models import User, Seller, Item, ItemCategory, AuctionEvent, Bid, Sales
+from lebay.apps.lebay.payments import record_sale
+from lebay.apps.lebay.utils import rebuild_bid_aggregates
+
+ADJECTIVES = ['vintage', 'antique', 'rare', 'signed', 'handmade', 'classic', 'mint', 'boxed', 'retro', 'limited', 'original', 'restored', 'brass', 'leather', 'wooden', 'silver']
+NOUNS = ['lamp', 'camera', 'guitar', 'watch', 'record', 'poster', 'chair', 'clock', 'radio', 'bicycle', 'typewriter', 'jacket', 'teapot', 'book', 'comic', 'telescope', 'rug', 'mirror', 'vase', 'keyboard']
+CATEGORY_NAMES = ['Electronics', 'Music', 'Home', 'Garden', 'Books', 'Clothing', 'Toys', 'Sports', 'Art', 'Collectibles', 'Tools', 'Jewelry', 'Motors', 'Office', 'Outdoors', 'Kitchen']
+
+MAX_PRICE = Decimal('999.99')
+
+def make_weights(rng, count, alpha):
+    # Cumulative Pareto weights, so a few entries get most of the picks.
+    total = 0.0
+    cumulative = []
+    for i in range(count):
+        total += rng.paretovariate(alpha)
+        cumulative.append(total)
+    return cumulative
+
+def pick_weighted(rng, values, cumulative):
+    return values[bisect.bisect(cumulative, rng.random() * cumulative[-1])]
+
+def to_price(value):
+    return min(Decimal('%.2f' % max(value, 0.01)), MAX_PRICE)
+
+class Command(BaseCommand):
+    help = 'Fills the database with synthetic users, sellers, categories, items, auctions, bids and sales for load testing. Run it against a scratch database.'
+    option_list = BaseCommand.option_list + (
+        make_option('--users', dest='users', type='int', default=1000,
+            help='Number of users to create.'),
+        make_option('--sellers', dest='sellers', type='int', default=100,
+            help='Number of those users with a seller profile.'),
+        make_option('--categories', dest='categories', type='int', default=40,
+            help='Number of categories, arranged in a tree up to three levels deep.'),
+        make_option('--items', dest='items', type='int', default=10000,
+            help='Number of items, each listed in one auction.'),
+        make_option('--ended', dest='ended', type='float', default=0.4,
+            help='Fraction of auctions that have already ended and are closed.'),
+        make_option('--paid', dest='paid', type='float', default=0.7,
+            help='Fraction of sold auctions the winner has paid for.'),
+        make_option('--max-bids', dest='max_bids', type='int', default=300,
+            help='Upper bound on the heavy tailed number of bids per auction.'),
+        make_option('--prefix', dest='prefix', default='seed',
+            help='Prefix of the generated usernames.'),
+        make_option('--random-seed', dest='random_seed', type='int', default=1,
+            help='Seed for the random generator, for repeatable data sets.'),
+        make_option('--chunk-size', dest='chunk_size', type='int', default=500,
+            help='Number of auctions written per transaction.'),
+    )
+
+    def handle(self, *args, **options):
+        if options['sellers'] < 1 or options['users'] <= options['sellers']:
+            raise CommandError('At least one seller and more users than sellers are required.')
+        if User.objects.filter(username__startswith=options['prefix']).count():
+            raise CommandError('Users prefixed %r already exist; pick another --prefix.' % options['prefix'])
+
+        self.rng = random.Random(options['random_seed'])
+        self.options = options
+        self.current_time = datetime.datetime.now().replace(microsecond=0)
+        self.verbose = int(options.get('verbosity', 1)) > 0
+        started = time.time()
+
+        user_ids, seller_ids = self.create_users()
+        self.report('%s users, %s sellers' % (len(user_ids), len(seller_ids)), started)
+        categories = self.create_categories()
+        self.report('%s categories' % len(categories), started)
+
+        totals = {'auctions': 0, 'bids': 0, 'sold': 0, 'expired': 0, 'paid': 0}
+        seller_weights = make_weights(self.rng, len(seller_ids), 1.2)
+        bidder_weights = make_weights(self.rng, len(user_ids), 1.5)
+        remaining = options['items']
+        while remaining > 0:
+            count = min(remaining, options['chunk_size'])
+            self.create_auctions(count, user_ids, seller_ids, seller_weights, bidder_weights, categories, totals)
+            remaining -= count
+            self.report('%(auctions)s auctions, %(bids)s bids, %(sold)s sold, %(expired)s expired, %(paid)s paid' % totals, started)
+
+        verbosity = int(options.get('verbosity', 1))
+        call_command('rebuild_facet_counts', verbosity=verbosity)
+        call_command('rebuild_category_tree', verbosity=verbosity)
+        call_command('rebuild_search_index', verbosity=verbosity)
+        self.report('done', started)
+
+    def report(self, message, started):
+        if self.verbose:
+            print '[%6.1fs] %s' % (time.time() - started, message)
+
+    @transaction.commit_on_success
+    def create_users(self):
+        prefix = self.options['prefix']
+        # Hashing a password per user would dominate the run; they all
+        # share the password "password".
+        template = User(username=prefix)
+        template.set_password('password')
+        user_ids = []
+        seller_ids = []
+        for i in range(self.options['users']):
+            user = User(username='%s%06d' % (prefix, i), email='%s%06d@example.com' % (prefix, i), password=template.password,
+                first_name='User', last_name='%06d' % i, address_line_1='%d Main St' % i, city='Springfield', state='IL', zipcode='62701', phone='217-555-0100')
+            user.save()
+            user_ids.append(user.pk)
+            if i < self.options['sellers']:
+                Seller(user=user, paypal_email=user.email, default_shipping_method=self.rng.choice(AUCTION_EVENT_SHIPPING_CHOICES)[0]).save()
+                seller_ids.append(user.pk)
+        return user_ids, seller_ids
+
+    @transaction.commit_on_success
+    def create_categories(self):
+        categories = []
+        levels = {}
+        for i in range(self.options['categories']):
+            depth = 0
+            if categories:
+                depth = min(self.rng.choice([0, 1, 1, 2, 2, 2]), max(levels.keys()) + 1)
+            parent = None
+            if depth:
+                parent = self.rng.choice(levels[depth - 1])
+            category = ItemCategory(title='%s %s' % (self.rng.choice(CATEGORY_NAMES), i), parent=parent)
+            category.save()
+            categories.append(category)
+            levels.setdefault(depth, []).append(category)
+        return categories
+
+    @transaction.commit_on_success
+    def create_auctions(self, count, user_ids, seller_ids, seller_weights, bidder_weights, categories, totals):
+        rng = self.rng
+        options = self.options
+        cursor = connection.cursor()
+        item_sql, item_fields = get_insert_sql(Item)
+        auction_event_sql, auction_event_fields = get_insert_sql(AuctionEvent)
+        bid_sql, bid_fields = get_insert_sql(Bid)
+
+        listings = []
+        for i in range(count):
+            title = '%s %s %s' % (rng.choice(ADJECTIVES), rng.choice(ADJECTIVES), rng.choice(NOUNS))
+            ended = rng.random() < options['ended']
+            if ended:
+                end_time = self.current_time - datetime.timedelta(seconds=rng.randint(60, 30 * 86400))
+            else:
+                end_time = self.current_time + datetime.timedelta(seconds=rng.randint(60, 10 * 86400))
+            start_time = end_time - datetime.timedelta(days=rng.choice([1, 3, 5, 7, 10]))
+            item = Item(title=title.capitalize(), description='A %s in %s condition. %s' % (title, rng.choice(['good', 'great', 'fair']), title.capitalize()),
+                condition=rng.choice(AUCTION_ITEM_CONDITION_CHOICES)[0], seller_id=pick_weighted(rng, seller_ids, seller_weights), category_id=rng.choice(categories).pk,
+                status=AUCTION_ITEM_STATUS_RUNNING, time_created=start_time, time_modified=start_time)
+            cursor.execute(item_sql, get_insert_values(item_fields, item))
+            item.pk = connection.ops.last_insert_id(cursor, Item._meta.db_table, Item._meta.pk.column)
+
+            auction_event = AuctionEvent(item_id=item.pk, shipping_method=rng.choice(AUCTION_EVENT_SHIPPING_CHOICES)[0], start_time=start_time, end_time=end_time,
+                starting_price=to_price(rng.lognormvariate(2.5, 1.0)), shipping_fee=to_price(rng.choice([0, 0, 4.99, 9.99, 14.99])), time_created=start_time, time_modified=start_time)
+            if rng.random() < 0.2:
+                auction_event.reserve_price = to_price(float(auction_event.starting_price) * rng.uniform(1.5, 4))
+
+            # Bids per auction follow a Pareto tail: most auctions get
+            # none or a few, a handful get hundreds.
+            bids = []
+            bid_count = min(int(rng.paretovariate(1.1)) - 1, options['max_bids'])
+            bid_span = min(end_time, self.current_time) - start_time
+            bid_span = bid_span.days * 86400 + bid_span.seconds
+            if bid_span <= 0:
+                bid_count = 0
+            offsets = sorted([rng.randint(0, bid_span) for b in range(bid_count)])
+            amount = auction_event.starting_price
+            for offset in offsets:
+                bidder_id = pick_weighted(rng, user_ids, bidder_weights)
+                if bidder_id == item.seller_id:
+                    continue
+                if bids:
+                    amount = amount + to_price(max(float(amount) * rng.uniform(0.01, 0.1), 0.5))
+                if amount > MAX_PRICE:
+                    break
+                bid_time = start_time + datetime.timedelta(seconds=offset)
+                bids.append(Bid(bidder_id=bidder_id, amount=amount, time_created=bid_time, time_modified=bid_time))
+            auction_event.bid_count = len(bids)
+            if bids:
+                auction_event.current_price = bids[-1].amount
+                auction_event.winning_bidder_id = bids[-1].bidder_id
+            auction_event.update_current_price()
+            listings.append((item, auction_event, bids, ended))
+
+        cursor.executemany(auction_event_sql, [get_insert_values(auction_event_fields, listing[1]) for listing in listings])
+        auction_event_ids = dict(AuctionEvent.objects.filter(item__in=[listing[0].pk for listing in listings]).values_list('item', 'pk'))
+        bid_values = []
+        for item, auction_event, bids, ended in listings:
+            auction_event.pk = auction_event_ids[item.pk]
+            for bid in bids:
+                bid.auction_event_id = auction_event.pk
+                bid_values.append(get_insert_values(bid_fields, bid))
+        cursor.executemany(bid_sql, bid_values)
+        rebuild_bid_aggregates(auction_event_ids.values())
+
+        ended_ids = [listing[1].pk for listing in listings if listing[3]]
+        sold, expired = close_auctions(ended_ids, self.current_time)
+
+        paid_ids = []
+        for item, auction_event, bids, ended in listings:
+            if ended and bids and rng.random() < options['paid']:
+                if record_sale(auction_event.pk, User(pk=auction_event.winning_bidder_id)):
+                    paid_ids.append(auction_event.pk)
+        for payment_status, label in SALES_PAYMENT_STATUS_CHOICES[1:]:
+            Sales.objects.filter(auction_event__in=[pk for pk in paid_ids if rng.random() < 0.3]).update(payment_status=payment_status)
+
+        totals['auctions'] += len(listings)
+        totals['bids'] += len(bid_values)
+        totals['sold'] += sold
+        totals['expired'] += expired
+        totals['paid'] += len(paid_ids)
@@ -0,0 +1,90 @@
+import random
+import threading
+import time
+from decimal import Decimal
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from lebay.apps.lebay.proxybidding import submit_maximum
+from lebay.apps.lebay.models import AuctionEvent, Bid, User
+
+class Command(BaseCommand):
+    help = 'Fires concurrent bids at one running auction event and verifies the bid aggregates afterwards.'
+    args = '<auction_event_id>'
+    option_list = BaseCommand.option_list + (
+        make_option('--bids', dest='bids', type='int', default=2000,
+            help='Total number of bids to place.'),
+        make_option('--threads', dest='threads', type='int', default=50,
+            help='Number of concurrent bidding threads.'),
+        make_option('--bidders', dest='bidders', type='int', default=20,
+            help='Number of distinct users to bid as.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Usage: stress_bidding %s' % self.args)
+        try:
+            auction_event = AuctionEvent.objects.get(pk=int(args[0]))
+        except (ValueError, AuctionEvent.DoesNotExist):
+            raise CommandError('Auction event %s does not exist.' % args[0])
+
+        bidders = list(User.objects.exclude(pk=auction_event.item.seller_id)[:options['bidders']])
+        if not bidders:
+            raise CommandError('At least one user other than the seller is required.')
+
+        thread_count = max(1, options['threads'])
+        bids_per_thread = max(1, options['bids'] / thread_count)
+        initial_bid_count = Bid.objects.filter(auction_event=auction_event).count()
+        counters = {'accepted': 0, 'rejected': 0, 'errors': 0}
+        lock = threading.Lock()
+        start_signal = threading.Event()
+
+        def bid_loop():
+            start_signal.wait()
+            try:
+                for i in range(bids_per_thread):
+                    current = AuctionEvent.objects.get(pk=auction_event.pk)
+                    amount = current.get_current_price() + Decimal(random.randint(1, 5)) / 100
+                    try:
+                        result = submit_maximum(current, random.choice(bidders), amount, exact=True)
+                    except Exception:
+                        outcome = 'errors'
+                    else:
+                        outcome = result.accepted and 'accepted' or 'rejected'
+                    lock.acquire()
+                    counters[outcome] += 1
+                    lock.release()
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=bid_loop) for i in range(thread_count)]
+        for thread in threads:
+            thread.start()
+        started = time.time()
+        start_signal.set()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - started
+
+        auction_event = AuctionEvent.objects.get(pk=auction_event.pk)
+        recorded_bids = Bid.objects.filter(auction_event=auction_event)
+        top_bid = recorded_bids.order_by('-amount', '-id')[:1]
+        problems = []
+        if recorded_bids.count() - initial_bid_count != counters['accepted']:
+            problems.append('%s bids recorded but %s accepted' % (recorded_bids.count() - initial_bid_count, counters['accepted']))
+        if auction_event.bid_count != recorded_bids.count():
+            problems.append('bid_count is %s but %s bids exist' % (auction_event.bid_count, recorded_bids.count()))
+        if top_bid:
+            top_bid = top_bid[0]
+            if auction_event.highest_bid_id != top_bid.pk or auction_event.current_price != top_bid.amount:
+                problems.append('highest bid is %s but auction points at %s' % (top_bid.pk, auction_event.highest_bid_id))
+            if auction_event.winning_bidder_id != top_bid.bidder_id:
+                problems.append('winning bidder is %s but highest bidder is %s' % (auction_event.winning_bidder_id, top_bid.bidder_id))
+
+        print '%(accepted)s accepted, %(rejected)s rejected, %(errors)s errors' % counters
+        print '%s bids in %.2f seconds (%.1f bids/second)' % (thread_count * bids_per_thread, elapsed, thread_count * bids_per_thread / max(elapsed, 0.001))
+        if problems:
+            raise CommandError('Inconsistent auction state: %s.' % '; '.join(problems))
+        print 'Auction state is consistent: price $%s after %s bids.' % (auction_event.current_price, auction_event.bid_count)
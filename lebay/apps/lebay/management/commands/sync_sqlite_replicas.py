@@ -0,0 +1,27 @@
+import shutil
+
+from django.conf import settings
+from django.core.management.base import NoArgsCommand, CommandError
+from django.db import connection
+
+from lebay.apps.lebay.replication import replica_connections
+
+class Command(NoArgsCommand):
+    help = 'Copies the SQLite database over every configured read replica, standing in for replication when trying replica routing locally.'
+
+    def handle_noargs(self, **options):
+        if settings.DATABASE_ENGINE != 'sqlite3':
+            raise CommandError('Only SQLite replicas can be refreshed by copying the database file.')
+        if not replica_connections:
+            raise CommandError('No replicas are configured in LEBAY_READ_REPLICAS.')
+
+        # Nothing may be half written while the file is copied.
+        connection.close()
+        for replica_connection in replica_connections:
+            replica_name = replica_connection.settings_dict['DATABASE_NAME']
+            if replica_name == settings.DATABASE_NAME:
+                raise CommandError('A replica cannot be the primary database file.')
+            replica_connection.close()
+            shutil.copyfile(settings.DATABASE_NAME, replica_name)
+            if int(options.get('verbosity', 1)) > 0:
+                print 'Copied %s to %s.' % (settings.DATABASE_NAME, replica_name)
@@ -0,0 +1,83 @@
+from django.core.management import call_command
+from django.core.management.base import NoArgsCommand
+from django.core.management.color import no_style
+from django.core.management.sql import custom_sql_for_model
+from django.db import connection, transaction, DatabaseError
+from django.db.models import get_app, get_models
+
+from lebay.apps.lebay.models import AuctionEvent
+from lebay.apps.lebay.utils import rebuild_bid_aggregates
+from lebay.apps.lebay.constants import AUCTION_EVENT_PRICE_BUCKET_BOUNDS
+
+def get_default_sql(field):
+    value = field.get_db_prep_save(field.get_default())
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, basestring):
+        return "'%s'" % value.replace("'", "''")
+    return str(value)
+
+def get_column_sql(field):
+    qn = connection.ops.quote_name
+    # Columns added to existing rows need a default when they are NOT NULL.
+    if field.null:
+        return '%s %s NULL' % (qn(field.column), field.db_type())
+    return '%s %s NOT NULL DEFAULT %s' % (qn(field.column), field.db_type(), get_default_sql(field))
+
+class Command(NoArgsCommand):
+    help = 'Brings a database created by an older little-ebay, such as the example database, up to the current models: adds missing columns and indexes, creates missing tables, then rebuilds the denormalized prices, category paths, facet counts and search index from the existing rows.'
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        style = no_style()
+        cursor = connection.cursor()
+        existing_tables = connection.introspection.table_names()
+        for model in get_models(get_app('lebay')):
+            table = model._meta.db_table
+            if table not in existing_tables:
+                continue
+            columns = [row[0] for row in connection.introspection.get_table_description(cursor, table)]
+            for field in model._meta.local_fields:
+                if field.column in columns or field.db_type() is None:
+                    continue
+                cursor.execute('ALTER TABLE %s ADD COLUMN %s' % (connection.ops.quote_name(table), get_column_sql(field)))
+                for statement in connection.creation.sql_indexes_for_field(model, field, style):
+                    cursor.execute(statement)
+                if verbosity > 0:
+                    print 'Added %s.%s.' % (table, field.column)
+            transaction.commit_unless_managed()
+            self.create_custom_indexes(model, style, verbosity)
+
+        # New tables get their custom indexes from syncdb itself.
+        call_command('syncdb', interactive=False, verbosity=verbosity)
+
+        rebuild_bid_aggregates()
+        self.rebuild_price_buckets()
+        for command in ('rebuild_category_tree', 'rebuild_facet_counts', 'rebuild_search_index'):
+            call_command(command, verbosity=verbosity)
+        if verbosity > 0:
+            print 'Run run_auction_closer --catch-up to close auctions that ended before the upgrade.'
+
+    def create_custom_indexes(self, model, style, verbosity):
+        cursor = connection.cursor()
+        for statement in custom_sql_for_model(model, style):
+            try:
+                cursor.execute(statement)
+                transaction.commit_unless_managed()
+            except DatabaseError:
+                # Already created by an earlier syncdb or upgrade.
+                transaction.rollback_unless_managed()
+            else:
+                if verbosity > 0:
+                    print 'Created %s' % statement.strip().rstrip(';')
+
+    @transaction.commit_on_success
+    def rebuild_price_buckets(self):
+        bounds = [None] + list(AUCTION_EVENT_PRICE_BUCKET_BOUNDS) + [None]
+        for price_bucket in range(len(bounds) - 1):
+            auction_events = AuctionEvent.objects.all()
+            if bounds[price_bucket] is not None:
+                auction_events = auction_events.filter(current_price__gte=bounds[price_bucket])
+            if bounds[price_bucket + 1] is not None:
+                auction_events = auction_events.filter(current_price__lt=bounds[price_bucket + 1])
+            auction_events.update(price_bucket=price_bucket)
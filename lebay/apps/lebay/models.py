@@ -1,14 +1,28 @@
+import bisect
 import datetime
 from decimal import Decimal
 
 from django.contrib import admin
-from django.contrib.auth.models import User as DjangoUser
+from django.contrib.auth.models import User as DjangoUser, UserManager as DjangoUserManager
 from django.core.exceptions import ObjectDoesNotExist
-from django.db import models
+from django.db import connection, models, transaction, IntegrityError
+from django.db.models import Count, F, Q
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete
 from django.contrib.localflavor.us.models import USStateField, PhoneNumberField
 
 from lebay.apps.base.models import BaseModel
-from lebay.apps.lebay.constants import AUCTION_ITEM_CATEGORY_CHOICES, AUCTION_ITEM_STATUS_CHOICES, AUCTION_ITEM_CATEGORY_GENERAL, AUCTION_ITEM_STATUS_IDLE, AUCTION_ITEM_CONDITION_CHOICES, AUCTION_EVENT_SHIPPING_CHOICES, SALES_PAYMENT_STATUS_CHOICES, SALES_PAYMENT_STATUS_PROCESSING, AUCTION_ITEM_STATUS_RUNNING, AUCTION_EVENT_SHIPPING_USPS
+from lebay.apps.lebay.constants import AUCTION_ITEM_CATEGORY_CHOICES, AUCTION_ITEM_STATUS_CHOICES, AUCTION_ITEM_CATEGORY_GENERAL, AUCTION_ITEM_STATUS_IDLE, AUCTION_ITEM_CONDITION_CHOICES, AUCTION_EVENT_SHIPPING_CHOICES, SALES_PAYMENT_STATUS_CHOICES, SALES_PAYMENT_STATUS_PROCESSING, AUCTION_ITEM_STATUS_RUNNING, AUCTION_EVENT_SHIPPING_USPS, AUCTION_EVENT_PRICE_BUCKET_BOUNDS, AUCTION_EVENT_PRICE_BUCKET_CHOICES, DASHBOARD_CACHE_KEY
+from lebay.apps.lebay.signals import auctions_opened, auctions_closed, auctions_archived, bids_recorded, payments_updated
+from lebay.apps.lebay.fragments import bump_auction_versions
+from lebay.apps.lebay.live import publish_auction_changes
+from lebay.apps.lebay.replication import RoutedManager, RoutedQuerySet
+
+def get_price_bucket(price):
+    return bisect.bisect_right(AUCTION_EVENT_PRICE_BUCKET_BOUNDS, price)
+
+class UserManager(RoutedManager, DjangoUserManager):
+    pass
 
 class User(DjangoUser):
     address_line_1 = models.CharField(max_length=100)
@@ -18,6 +32,8 @@ class User(DjangoUser):
     zipcode = models.CharField(max_length=10)
     phone = PhoneNumberField()
 
+    objects = UserManager()
+
     def __unicode__(self):
         return u'%s %s' % (self.first_name, self.last_name)
     
@@ -28,14 +44,104 @@ class User(DjangoUser):
         except ObjectDoesNotExist, e:
             return False
 
+def make_category_path(category_ids):
+    return ''.join(['%08d/' % category_id for category_id in category_ids])
+
+def get_category_path_ids(path):
+    return [int(category_id) for category_id in path.split('/') if category_id]
+
+def get_subtree_filter(path, lookup='path'):
+    # A range instead of LIKE keeps the prefix match on the path index.
+    return Q(**{'%s__gte' % lookup: path, '%s__lt' % lookup: path + u'\uffff'})
+
+class ItemCategoryManager(RoutedManager):
+    def get_subtree(self, category):
+        return self.filter(get_subtree_filter(category.path))
+
+    def apply_live_count_deltas(self, category_deltas):
+        category_ids_by_delta = {}
+        for category_id, delta in category_deltas.items():
+            if delta:
+                category_ids_by_delta.setdefault(delta, []).append(category_id)
+        for delta, category_ids in category_ids_by_delta.items():
+            self.filter(pk__in=category_ids).update(live_auction_count=F('live_auction_count') + delta)
+
+    def adjust_live_counts(self, category_deltas):
+        # Every ancestor on the path counts the auctions of its whole subtree.
+        ancestor_deltas = {}
+        for category_id, path in self.filter(pk__in=category_deltas.keys()).values_list('pk', 'path'):
+            for ancestor_id in get_category_path_ids(path):
+                ancestor_deltas[ancestor_id] = ancestor_deltas.get(ancestor_id, 0) + category_deltas[category_id]
+        self.apply_live_count_deltas(ancestor_deltas)
+
+    def adjust(self, auction_event_ids, delta):
+        groups = AuctionEvent.objects.filter(pk__in=auction_event_ids).values('item__category').annotate(auction_count=Count('id'))
+        self.adjust_live_counts(dict([(group['item__category'], delta * group['auction_count']) for group in groups]))
+
+    def move_subtree(self, category_id, old_path, new_path):
+        for descendant_id, path in self.filter(get_subtree_filter(old_path)).values_list('pk', 'path'):
+            self.filter(pk=descendant_id).update(path=new_path + path[len(old_path):])
+        live_auction_count = self.filter(pk=category_id).values_list('live_auction_count', flat=True)[0]
+        ancestor_deltas = {}
+        for ancestor_id in get_category_path_ids(old_path)[:-1]:
+            ancestor_deltas[ancestor_id] = -live_auction_count
+        for ancestor_id in get_category_path_ids(new_path)[:-1]:
+            ancestor_deltas[ancestor_id] = ancestor_deltas.get(ancestor_id, 0) + live_auction_count
+        self.apply_live_count_deltas(ancestor_deltas)
+
+    def rebuild_paths(self):
+        parents = dict(self.values_list('pk', 'parent'))
+        updated = 0
+        for category_id, path in self.values_list('pk', 'path'):
+            category_ids = [category_id]
+            while parents.get(category_ids[0]) and parents[category_ids[0]] not in category_ids:
+                category_ids.insert(0, parents[category_ids[0]])
+            new_path = make_category_path(category_ids)
+            if new_path != path:
+                self.filter(pk=category_id).update(path=new_path)
+                updated += 1
+        return updated
+
+    def rebuild_live_counts(self):
+        self.update(live_auction_count=0)
+        groups = AuctionEvent.objects.filter(item__status=AUCTION_ITEM_STATUS_RUNNING, closed_at__isnull=True).values('item__category').annotate(auction_count=Count('id'))
+        self.adjust_live_counts(dict([(group['item__category'], group['auction_count']) for group in groups]))
+        return len(groups)
+
 class ItemCategory(BaseModel):
     title = models.CharField(max_length=100)
     description = models.TextField(blank=True)
     parent = models.ForeignKey('self', blank=True, null=True)
-    
+    path = models.CharField(max_length=255, db_index=True, editable=False, blank=True)
+    live_auction_count = models.IntegerField(default=0, editable=False)
+
+    objects = ItemCategoryManager()
+
     def __unicode__(self):
         return u'%s' % self.title
 
+    def save(self, *args, **kwargs):
+        # Counts are maintained with F() updates, so never write back a stale copy.
+        if self.pk:
+            stored = ItemCategory.objects.filter(pk=self.pk).values_list('path', 'live_auction_count')
+            if stored:
+                self.path, self.live_auction_count = stored[0]
+        parent_path = ''
+        if self.parent_id:
+            parent_path = ItemCategory.objects.filter(pk=self.parent_id).values_list('path', flat=True)[0]
+            if self.path and parent_path.startswith(self.path):
+                raise ValueError('A category cannot be moved under one of its own subcategories.')
+        super(ItemCategory, self).save(*args, **kwargs)
+
+        old_path, self.path = self.path, parent_path + make_category_path([self.pk])
+        if self.path != old_path:
+            ItemCategory.objects.filter(pk=self.pk).update(path=self.path)
+            if old_path:
+                ItemCategory.objects.move_subtree(self.pk, old_path, self.path)
+
+    def get_depth(self):
+        return len(get_category_path_ids(self.path)) - 1
+
 class Seller(BaseModel):
     user = models.OneToOneField(User, related_name='seller')
     paypal_email = models.EmailField()
@@ -43,6 +149,8 @@ class Seller(BaseModel):
     default_shipping_detail = models.CharField(max_length=100, blank=True, null=True)
     default_payment_detail = models.CharField(max_length=200, blank=True, null=True)
 
+    objects = RoutedManager()
+
     def __unicode__(self):
         return u'Seller profile of %s' % self.user.username
 
@@ -53,6 +161,8 @@ class Item(BaseModel):
     seller = models.ForeignKey(User, related_name='auction_items')
     category = models.ForeignKey(ItemCategory, related_name='auction_items')
     status = models.IntegerField(choices=AUCTION_ITEM_STATUS_CHOICES, default=AUCTION_ITEM_STATUS_IDLE)
+
+    objects = RoutedManager()
     
     def __unicode__(self):
         return u'%s' % self.title
@@ -63,28 +173,75 @@ class Item(BaseModel):
     def get_status(self):
         return dict(AUCTION_ITEM_STATUS_CHOICES).get(self.status, 'N/A')
 
-class AuctionEventManager(models.Manager):
+class ItemSearchTerm(models.Model):
+    item = models.ForeignKey(Item, related_name='search_terms')
+    term = models.CharField(max_length=50, db_index=True)
+    weight = models.IntegerField(default=1)
+
+    objects = RoutedManager()
+
+    def __unicode__(self):
+        return u'%s (%s)' % (self.term, self.weight)
+
+class AuctionEventQuerySet(RoutedQuerySet):
+    def for_listing(self):
+        # Everything the listing templates touch per row, in the same query:
+        # the item with its seller and category, the winner and the status of
+        # the latest payment.
+        qn = connection.ops.quote_name
+        latest_payment_status = 'SELECT %s FROM %s WHERE %s = %s.%s ORDER BY %s DESC, %s DESC LIMIT 1' % (
+            qn('payment_status'), qn(Sales._meta.db_table), qn('auction_event_id'),
+            qn(AuctionEvent._meta.db_table), qn('id'), qn('time_created'), qn('id'))
+        return self.select_related('item__seller', 'item__category', 'winning_bidder').extra(select={'latest_payment_status': latest_payment_status})
+
+class AuctionEventManager(RoutedManager):
+    def get_query_set(self):
+        return AuctionEventQuerySet(self.model)
+
+    def get_listing(self):
+        return self.get_query_set().for_listing()
+
     def get_current_auctions(self):
         current_time = datetime.datetime.now()
         return self.filter(item__status=AUCTION_ITEM_STATUS_RUNNING, start_time__lt=current_time, end_time__gt=current_time)
 
+    def get_current_category_auctions(self, category):
+        return self.get_current_auctions().filter(item__category__in=ItemCategory.objects.get_subtree(category).values('pk'))
+
 class AuctionEvent(BaseModel):
     item = models.ForeignKey(Item, related_name='auction_events')
     shipping_method = models.IntegerField(choices=AUCTION_EVENT_SHIPPING_CHOICES)
     shipping_detail = models.CharField(max_length=100, blank=True)
     payment_detail = models.CharField(max_length=200, blank=True)
     start_time = models.DateTimeField(help_text=u'Format (Hour & Minute are optional): 10/25/2006 14:30')
-    end_time = models.DateTimeField(help_text=u'Format (Hour & Minute are optional): 10/25/2006 14:30')
+    end_time = models.DateTimeField(db_index=True, help_text=u'Format (Hour & Minute are optional): 10/25/2006 14:30')
     starting_price = models.DecimalField(default=Decimal('0.00'), max_digits=5, decimal_places=2)
     shipping_fee = models.DecimalField(default=Decimal('0.00'), max_digits=5, decimal_places=2)
     reserve_price = models.DecimalField(default=Decimal('0.00'), blank=True, max_digits=5, decimal_places=2)
     winning_bidder = models.ForeignKey(User, related_name='won_auctions', blank=True, null=True)
+    current_price = models.DecimalField(default=Decimal('0.00'), max_digits=5, decimal_places=2, db_index=True)
+    bid_count = models.IntegerField(default=0)
+    highest_bid = models.ForeignKey('Bid', related_name='leading_auction_events', blank=True, null=True)
+    price_bucket = models.IntegerField(choices=AUCTION_EVENT_PRICE_BUCKET_CHOICES, default=0, db_index=True)
+    closed_at = models.DateTimeField(blank=True, null=True)
+    final_price = models.DecimalField(blank=True, null=True, max_digits=5, decimal_places=2)
+    final_value_fee = models.DecimalField(blank=True, null=True, max_digits=5, decimal_places=2, editable=False)
+    proxy_maximum = models.DecimalField(blank=True, null=True, max_digits=5, decimal_places=2, editable=False)
 
     objects = AuctionEventManager()
     
     def __unicode__(self):
         return u'%s listed on %s' % (self.item.title, self.start_time)
     
+    def save(self, force_insert=False, force_update=False):
+        self.update_current_price()
+        super(AuctionEvent, self).save(force_insert=force_insert, force_update=force_update)
+
+    def update_current_price(self):
+        if not self.bid_count:
+            self.current_price = self.starting_price
+        self.price_bucket = get_price_bucket(self.current_price)
+
     def has_started(self):
         return datetime.datetime.now() >= self.start_time
 
@@ -98,13 +255,23 @@ class AuctionEvent(BaseModel):
         return dict(AUCTION_EVENT_SHIPPING_CHOICES).get(int(self.shipping_method), 'N/A')
 
     def get_current_price(self):
-        current_price = self.starting_price
-        bid_count = self.bids.count()
-        if bid_count:
-            highest_bid = self.bids.order_by('-amount')[0]
-            current_price = highest_bid.amount 
-        return current_price
+        if self.bid_count:
+            return self.current_price
+        return self.starting_price
     
+    def is_closed(self):
+        return self.closed_at is not None
+
+    def has_unmet_reserve(self):
+        # Settlement clears the winner of an auction that ended below its
+        # reserve price.
+        return self.is_closed() and bool(self.bid_count) and self.winning_bidder_id is None
+
+    def get_final_price(self):
+        if self.final_price is not None:
+            return self.final_price
+        return self.get_current_price()
+
     def get_time_until_end(self):
         delta = self.end_time - datetime.datetime.now()
         if delta.days < 0:
@@ -130,19 +297,83 @@ class AuctionEvent(BaseModel):
                 
             return time_string
     
+    def get_latest_payment_status(self):
+        if hasattr(self, 'latest_payment_status'):
+            return self.latest_payment_status
+        payment_statuses = list(self.sales.order_by('-time_created', '-id').values_list('payment_status', flat=True)[:1])
+        if payment_statuses:
+            return payment_statuses[0]
+        return None
+
     def is_paid(self):
-        return self.sales.count() > 0
+        return self.get_latest_payment_status() is not None
 
     def get_payment_status(self):
         if self.is_paid():
-            return dict(SALES_PAYMENT_STATUS_CHOICES).get(self.sales.order_by('-time_created')[0].payment_status)
+            return dict(SALES_PAYMENT_STATUS_CHOICES).get(self.get_latest_payment_status())
         else:
             return 'Unpaid'
     
+class AuctionFacetCountManager(RoutedManager):
+    def adjust(self, auction_event_ids, delta):
+        groups = AuctionEvent.objects.filter(pk__in=auction_event_ids).values('item__category', 'item__condition', 'price_bucket').annotate(auction_count=Count('id'))
+        for group in groups:
+            self.adjust_group(group['item__category'], group['item__condition'], group['price_bucket'], delta * group['auction_count'])
+
+    def adjust_group(self, category_id, condition, price_bucket, delta):
+        if not delta:
+            return
+        facet_count = self.filter(category=category_id, condition=condition, price_bucket=price_bucket)
+        if facet_count.update(count=F('count') + delta):
+            return
+        # Another bid or listing may create the group between the update and
+        # the insert; its unique constraint sends this one back to update.
+        sid = transaction.savepoint()
+        try:
+            self.create(category_id=category_id, condition=condition, price_bucket=price_bucket, count=delta)
+        except IntegrityError:
+            transaction.savepoint_rollback(sid)
+            facet_count.update(count=F('count') + delta)
+        else:
+            transaction.savepoint_commit(sid)
+
+    def reprice(self, auction_event_ids):
+        auction_events = AuctionEvent.objects.filter(pk__in=auction_event_ids, item__status=AUCTION_ITEM_STATUS_RUNNING).values('pk', 'current_price', 'starting_price', 'bid_count', 'price_bucket', 'item__category', 'item__condition')
+        for auction_event in auction_events:
+            price = auction_event['bid_count'] and auction_event['current_price'] or auction_event['starting_price']
+            price_bucket = get_price_bucket(price)
+            if price_bucket != auction_event['price_bucket']:
+                AuctionEvent.objects.filter(pk=auction_event['pk']).update(price_bucket=price_bucket)
+                self.adjust_group(auction_event['item__category'], auction_event['item__condition'], auction_event['price_bucket'], -1)
+                self.adjust_group(auction_event['item__category'], auction_event['item__condition'], price_bucket, 1)
+
+    def rebuild(self):
+        self.all().delete()
+        groups = AuctionEvent.objects.filter(item__status=AUCTION_ITEM_STATUS_RUNNING, closed_at__isnull=True).values('item__category', 'item__condition', 'price_bucket').annotate(auction_count=Count('id'))
+        for group in groups:
+            self.create(category_id=group['item__category'], condition=group['item__condition'], price_bucket=group['price_bucket'], count=group['auction_count'])
+        return len(groups)
+
+class AuctionFacetCount(models.Model):
+    category = models.ForeignKey(ItemCategory, related_name='facet_counts')
+    condition = models.IntegerField(choices=AUCTION_ITEM_CONDITION_CHOICES)
+    price_bucket = models.IntegerField(choices=AUCTION_EVENT_PRICE_BUCKET_CHOICES)
+    count = models.IntegerField(default=0)
+
+    objects = AuctionFacetCountManager()
+
+    class Meta:
+        unique_together = ('category', 'condition', 'price_bucket')
+
+    def __unicode__(self):
+        return u'%s auction(s) in %s' % (self.count, self.category_id)
+
 class Sales(BaseModel):
     auction_event = models.ForeignKey(AuctionEvent, related_name='sales')
     payment_status = models.IntegerField(choices=SALES_PAYMENT_STATUS_CHOICES, default=SALES_PAYMENT_STATUS_PROCESSING)
     invoice_number = models.CharField(max_length=200, unique=True)
+
+    objects = RoutedManager()
     
     def __unicode__(self):
         return u'Invoice for %s' % self.auction_event
@@ -152,12 +383,139 @@ class Bid(BaseModel):
     bidder = models.ForeignKey(User, related_name='bids')
     amount = models.DecimalField(default=Decimal('0.00'), max_digits=5, decimal_places=2, help_text=u'All bids are final. Price in US dollars.') 
 
+    objects = RoutedManager()
+
     def __unicode__(self):
         return u'Placed on %s by %s' % (self.auction_event.item.title, self.bidder.username)
 
+class ProxyBid(BaseModel):
+    auction_event = models.ForeignKey(AuctionEvent, related_name='proxy_bids')
+    bidder = models.ForeignKey(User, related_name='proxy_bids')
+    maximum = models.DecimalField(max_digits=5, decimal_places=2, help_text=u'The most you are willing to pay. We bid for you, one increment at a time, up to this amount.')
+
+    objects = RoutedManager()
+
+    class Meta:
+        unique_together = ('auction_event', 'bidder')
+
+    def __unicode__(self):
+        return u'Up to %s on %s by %s' % (self.maximum, self.auction_event_id, self.bidder_id)
+
+class ArchivedAuctionEvent(models.Model):
+    # Where an auction moved out of the live tables went: its rows, bids and
+    # sales live in the archive file for the month it closed in.
+    auction_event_id = models.IntegerField(primary_key=True)
+    item = models.ForeignKey(Item, related_name='archived_auction_events')
+    winning_bidder = models.ForeignKey(User, related_name='archived_won_auctions', blank=True, null=True)
+    month = models.CharField(max_length=7, db_index=True)
+    closed_at = models.DateTimeField()
+    sale_count = models.IntegerField(default=0)
+    time_archived = models.DateTimeField(default=datetime.datetime.now)
+
+    objects = RoutedManager()
+
+    def __unicode__(self):
+        return u'%s archived in %s' % (self.auction_event_id, self.month)
+
+from lebay.apps.lebay.search import update_item_search_terms
+post_save.connect(update_item_search_terms, sender=Item)
+
+def count_opened_auctions(sender, auction_event_ids, **kwargs):
+    AuctionFacetCount.objects.adjust(auction_event_ids, 1)
+    ItemCategory.objects.adjust(auction_event_ids, 1)
+
+def count_closed_auctions(sender, auction_event_ids, **kwargs):
+    AuctionFacetCount.objects.adjust(auction_event_ids, -1)
+    ItemCategory.objects.adjust(auction_event_ids, -1)
+
+def count_repriced_auctions(sender, auction_event_ids, **kwargs):
+    AuctionFacetCount.objects.reprice(auction_event_ids)
+
+auctions_opened.connect(count_opened_auctions)
+auctions_closed.connect(count_closed_auctions)
+bids_recorded.connect(count_repriced_auctions)
+
+def invalidate_dashboards(user_ids):
+    for user_id in set(user_ids):
+        if user_id:
+            cache.delete(DASHBOARD_CACHE_KEY % user_id)
+
+def get_auction_event_user_ids(auction_event_ids):
+    user_ids = []
+    for seller_id, winning_bidder_id in AuctionEvent.objects.filter(pk__in=auction_event_ids).values_list('item__seller', 'winning_bidder'):
+        user_ids.extend([seller_id, winning_bidder_id])
+    return user_ids
+
+def invalidate_item_dashboards(sender, instance, **kwargs):
+    invalidate_dashboards([instance.seller_id])
+
+def invalidate_auction_event_dashboards(sender, instance, **kwargs):
+    invalidate_dashboards(get_auction_event_user_ids([instance.auction_event_id]))
+
+def invalidate_changed_auction_event_dashboards(sender, instance, **kwargs):
+    seller_ids = list(Item.objects.filter(pk=instance.item_id).values_list('seller', flat=True))
+    invalidate_dashboards(seller_ids + [instance.winning_bidder_id])
+
+def invalidate_bid_dashboards(sender, instance, **kwargs):
+    invalidate_dashboards(get_auction_event_user_ids([instance.auction_event_id]) + [instance.bidder_id])
+
+def invalidate_auction_events_dashboards(sender, auction_event_ids, **kwargs):
+    invalidate_dashboards(get_auction_event_user_ids(auction_event_ids))
+
+def invalidate_bids_recorded_dashboards(sender, auction_event_ids, bidder_ids, **kwargs):
+    # Bids written in bulk skip post_save, so the sender names the bidders.
+    invalidate_dashboards(get_auction_event_user_ids(auction_event_ids) + list(bidder_ids))
+
+def invalidate_closed_auction_events_dashboards(sender, auction_event_ids, **kwargs):
+    # A closed auction leaves the bidding count of everyone who bid on it.
+    bidder_ids = list(Bid.objects.filter(auction_event__in=auction_event_ids).values_list('bidder', flat=True).distinct())
+    invalidate_dashboards(get_auction_event_user_ids(auction_event_ids) + bidder_ids)
+
+for signal in (post_save, post_delete):
+    signal.connect(invalidate_item_dashboards, sender=Item)
+    signal.connect(invalidate_changed_auction_event_dashboards, sender=AuctionEvent)
+    signal.connect(invalidate_auction_event_dashboards, sender=Sales)
+    signal.connect(invalidate_bid_dashboards, sender=Bid)
+auctions_opened.connect(invalidate_auction_events_dashboards)
+auctions_closed.connect(invalidate_closed_auction_events_dashboards)
+bids_recorded.connect(invalidate_bids_recorded_dashboards)
+payments_updated.connect(invalidate_auction_events_dashboards)
+auctions_archived.connect(invalidate_auction_events_dashboards)
+
+def bump_item_versions(sender, instance, **kwargs):
+    bump_auction_versions(AuctionEvent.objects.filter(item=instance.pk).values_list('pk', flat=True))
+
+def bump_auction_event_version(sender, instance, **kwargs):
+    bump_auction_versions([instance.pk])
+
+def bump_bid_version(sender, instance, **kwargs):
+    bump_auction_versions([instance.auction_event_id])
+
+def bump_auction_event_versions(sender, auction_event_ids, **kwargs):
+    bump_auction_versions(auction_event_ids)
+
+for signal in (post_save, post_delete):
+    signal.connect(bump_item_versions, sender=Item)
+    signal.connect(bump_auction_event_version, sender=AuctionEvent)
+    signal.connect(bump_bid_version, sender=Bid)
+auctions_opened.connect(bump_auction_event_versions)
+auctions_closed.connect(bump_auction_event_versions)
+bids_recorded.connect(bump_auction_event_versions)
+
+def publish_auction_event_change(sender, instance, **kwargs):
+    publish_auction_changes([instance.pk])
+
+def publish_auction_event_changes(sender, auction_event_ids, **kwargs):
+    publish_auction_changes(auction_event_ids)
+
+post_save.connect(publish_auction_event_change, sender=AuctionEvent)
+auctions_closed.connect(publish_auction_event_changes)
+bids_recorded.connect(publish_auction_event_changes)
+
 admin.site.register(AuctionEvent)
 admin.site.register(Bid)
 admin.site.register(Item)
+admin.site.register(ProxyBid)
 admin.site.register(ItemCategory)
 admin.site.register(Seller)
 admin.site.register(Sales)
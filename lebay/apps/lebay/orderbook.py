@@ -0,0 +1,300 @@
+import atexit
+import datetime
+import logging
+import os
+import threading
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from lebay.apps.lebay.bidding import BidResult, SOFT_CLOSE_SECONDS, get_soft_close_end_time, extend_end_times
+from lebay.apps.lebay.fragments import bump_auction_versions
+from lebay.apps.lebay.live import live_publisher, make_payload
+from lebay.apps.lebay.constants import AUCTION_ITEM_STATUS_RUNNING, BID_RESULT_ACCEPTED, BID_RESULT_TOO_LOW, BID_RESULT_NOT_RUNNING, BID_RESULT_OWN_ITEM
+from lebay.apps.lebay.models import AuctionEvent, Bid
+from lebay.apps.lebay.signals import bids_recorded
+from lebay.apps.lebay.utils import rebuild_bid_aggregates
+
+logger = logging.getLogger('lebay.orderbook')
+
+class AuctionBook(object):
+    __slots__ = ('auction_event_id', 'seller_id', 'starting_price', 'best_amount', 'best_bidder_id', 'bid_count', 'start_time', 'end_time')
+
+    def __init__(self, auction_event):
+        self.auction_event_id = auction_event.pk
+        self.seller_id = auction_event.item.seller_id
+        self.starting_price = auction_event.starting_price
+        self.best_amount = auction_event.current_price
+        self.best_bidder_id = auction_event.winning_bidder_id
+        self.bid_count = auction_event.bid_count
+        self.start_time = auction_event.start_time
+        self.end_time = auction_event.end_time
+
+    def get_status(self, bidder_id, amount, current_time):
+        if current_time < self.start_time or current_time >= self.end_time:
+            return BID_RESULT_NOT_RUNNING
+        if bidder_id == self.seller_id:
+            return BID_RESULT_OWN_ITEM
+        if self.bid_count:
+            if amount <= self.best_amount:
+                return BID_RESULT_TOO_LOW
+        elif amount < self.starting_price:
+            return BID_RESULT_TOO_LOW
+        return BID_RESULT_ACCEPTED
+
+    def apply_to(self, auction_event):
+        auction_event.current_price = self.best_amount
+        auction_event.bid_count = self.bid_count
+        auction_event.winning_bidder_id = self.best_bidder_id
+        auction_event.end_time = self.end_time
+
+class PendingBid(object):
+    __slots__ = ('auction_event_id', 'bidder_id', 'amount', 'time_created')
+
+    def __init__(self, auction_event_id, bidder_id, amount, time_created):
+        self.auction_event_id = auction_event_id
+        self.bidder_id = bidder_id
+        self.amount = amount
+        self.time_created = time_created
+
+    def to_line(self):
+        return '%d\t%d\t%s\t%s\t%d\n' % (self.auction_event_id, self.bidder_id, self.amount, self.time_created.strftime('%Y-%m-%d %H:%M:%S'), self.time_created.microsecond)
+
+    @classmethod
+    def from_line(cls, line):
+        if not line.endswith('\n'):
+            return None
+        try:
+            auction_event_id, bidder_id, amount, timestamp, microsecond = line.rstrip('\n').split('\t')
+            time_created = datetime.datetime(*time.strptime(timestamp, '%Y-%m-%d %H:%M:%S')[:6])
+            return cls(int(auction_event_id), int(bidder_id), Decimal(amount), time_created.replace(microsecond=int(microsecond)))
+        except (ValueError, InvalidOperation):
+            return None
+
+class BidJournal(object):
+    # Write-ahead log of accepted bids. A bid is only acknowledged once its
+    # line has been fsynced; the file is rotated to <path>.flushing while a
+    # batch is written to the database and removed once that commits.
+    def __init__(self, path):
+        self.path = path
+        self.flushing_path = '%s.flushing' % path
+        self.file = open(self.path, 'a')
+
+    def append(self, pending_bid):
+        self.file.write(pending_bid.to_line())
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def rotate(self):
+        self.file.close()
+        if os.path.exists(self.flushing_path):
+            flushing_file = open(self.flushing_path, 'a')
+            flushing_file.write(open(self.path).read())
+            flushing_file.close()
+            os.remove(self.path)
+        else:
+            os.rename(self.path, self.flushing_path)
+        self.file = open(self.path, 'a')
+
+    def checkpoint(self):
+        if os.path.exists(self.flushing_path):
+            os.remove(self.flushing_path)
+
+    def read_unflushed(self):
+        pending_bids = []
+        for path in (self.flushing_path, self.path):
+            if os.path.exists(path):
+                for line in open(path):
+                    pending_bid = PendingBid.from_line(line)
+                    if pending_bid is not None:
+                        pending_bids.append(pending_bid)
+        return pending_bids
+
+    def close(self):
+        self.file.close()
+
+@transaction.commit_on_success
+def write_bids(pending_bids):
+    if not pending_bids:
+        return
+    qn = connection.ops.quote_name
+    # A bid is only written while its auction is open. The closer waits for
+    # the book to flush before it closes an auction, so a closed row here
+    # means the flush kept failing for longer than that.
+    sql = 'INSERT INTO %s (is_active, time_created, time_modified, auction_event_id, bidder_id, amount) SELECT %%s, %%s, %%s, %%s, %%s, %%s FROM %s WHERE id = %%s AND closed_at IS NULL' % (qn(Bid._meta.db_table), qn(AuctionEvent._meta.db_table))
+    rows = []
+    for pending_bid in pending_bids:
+        time_created = connection.ops.value_to_db_datetime(pending_bid.time_created)
+        amount = connection.ops.value_to_db_decimal(pending_bid.amount, 5, 2)
+        rows.append((True, time_created, time_created, pending_bid.auction_event_id, pending_bid.bidder_id, amount, pending_bid.auction_event_id))
+    connection.cursor().executemany(sql, rows)
+    auction_event_ids = set([pending_bid.auction_event_id for pending_bid in pending_bids])
+    closed_ids = set(AuctionEvent.objects.filter(pk__in=list(auction_event_ids), closed_at__isnull=False).values_list('pk', flat=True))
+    if closed_ids:
+        rejected_bids = [pending_bid for pending_bid in pending_bids if pending_bid.auction_event_id in closed_ids]
+        logger.error('Dropped %s bid(s) on auctions closed before they were flushed: %s', len(rejected_bids), ', '.join([pending_bid.to_line().rstrip('\n') for pending_bid in rejected_bids]))
+        pending_bids = [pending_bid for pending_bid in pending_bids if pending_bid.auction_event_id not in closed_ids]
+        auction_event_ids -= closed_ids
+        if not auction_event_ids:
+            return
+    rebuild_bid_aggregates(auction_event_ids)
+    # Soft close extensions are derived from the journaled bid times, so a
+    # recovered journal extends the same auctions the book did.
+    if SOFT_CLOSE_SECONDS:
+        end_times = {}
+        for pending_bid in pending_bids:
+            end_time = pending_bid.time_created + datetime.timedelta(seconds=SOFT_CLOSE_SECONDS)
+            end_times[pending_bid.auction_event_id] = max(end_time, end_times.get(pending_bid.auction_event_id, end_time))
+        extend_end_times(end_times)
+    bids_recorded.send(sender=Bid, auction_event_ids=list(auction_event_ids), bidder_ids=list(set([pending_bid.bidder_id for pending_bid in pending_bids])))
+
+@transaction.commit_on_success
+def extend_open_auction(auction_event_id, end_time):
+    # Returns False if the auction has already closed.
+    if AuctionEvent.objects.filter(pk=auction_event_id, closed_at__isnull=True, end_time__lt=end_time).update(end_time=end_time):
+        return True
+    return AuctionEvent.objects.filter(pk=auction_event_id, closed_at__isnull=True).count() > 0
+
+class OrderBook(object):
+    def __init__(self, journal_path, batch_size=200, flush_interval=0.5):
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.books = {}
+        self.pending = []
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.journal = BidJournal(journal_path)
+        self.recover()
+
+    def get_book(self, auction_event_id):
+        return self.books.get(auction_event_id)
+
+    def submit(self, auction_event, bidder, amount):
+        current_time = datetime.datetime.now()
+        self.lock.acquire()
+        try:
+            book = self.books.get(auction_event.pk)
+            if book is None:
+                if auction_event.item.status != AUCTION_ITEM_STATUS_RUNNING:
+                    return BidResult(BID_RESULT_NOT_RUNNING, auction_event, amount)
+                book = self.books[auction_event.pk] = AuctionBook(auction_event)
+
+            status = book.get_status(bidder.pk, amount, current_time)
+            if status != BID_RESULT_ACCEPTED:
+                return BidResult(status, auction_event, amount)
+            end_time = get_soft_close_end_time(book.end_time, current_time)
+        finally:
+            self.lock.release()
+
+        # The closer only reads the row, so a soft close extension is
+        # written there before the bid is acknowledged rather than with the
+        # next flush. Other auctions' bids do not wait on this write.
+        if end_time is not None and not extend_open_auction(auction_event.pk, end_time):
+            return BidResult(BID_RESULT_NOT_RUNNING, auction_event, amount)
+
+        self.lock.acquire()
+        try:
+            # Another bid may have taken the lead while the row was written.
+            status = book.get_status(bidder.pk, amount, current_time)
+            if status != BID_RESULT_ACCEPTED:
+                return BidResult(status, auction_event, amount)
+
+            pending_bid = PendingBid(auction_event.pk, bidder.pk, amount, current_time)
+            self.journal.append(pending_bid)
+            self.pending.append(pending_bid)
+            book.best_amount = amount
+            book.best_bidder_id = bidder.pk
+            book.bid_count += 1
+            book.end_time = get_soft_close_end_time(book.end_time, current_time) or book.end_time
+            book.apply_to(auction_event)
+            payload = make_payload(book.best_amount, book.starting_price, book.bid_count, book.end_time, None)
+            flush_now = len(self.pending) >= self.batch_size
+        finally:
+            self.lock.release()
+
+        bump_auction_versions([auction_event.pk])
+        live_publisher.publish_payload(auction_event.pk, payload)
+        if flush_now:
+            self.flush()
+        return BidResult(BID_RESULT_ACCEPTED, auction_event, amount)
+
+    def flush(self):
+        self.flush_lock.acquire()
+        try:
+            self.lock.acquire()
+            try:
+                pending_bids, self.pending = self.pending, []
+                if pending_bids:
+                    self.journal.rotate()
+                current_time = datetime.datetime.now()
+                for auction_event_id, book in self.books.items():
+                    if book.end_time <= current_time:
+                        del self.books[auction_event_id]
+            finally:
+                self.lock.release()
+
+            if pending_bids:
+                try:
+                    write_bids(pending_bids)
+                except:
+                    self.lock.acquire()
+                    self.pending[:0] = pending_bids
+                    self.lock.release()
+                    raise
+                self.journal.checkpoint()
+            return len(pending_bids)
+        finally:
+            self.flush_lock.release()
+
+    def recover(self):
+        pending_bids = self.journal.read_unflushed()
+        if pending_bids:
+            # A crash between the database commit and the checkpoint leaves
+            # already written bids in the journal; skip those.
+            missing_bids = []
+            for pending_bid in pending_bids:
+                if not Bid.objects.filter(auction_event=pending_bid.auction_event_id, bidder=pending_bid.bidder_id, amount=pending_bid.amount, time_created=pending_bid.time_created).count():
+                    missing_bids.append(pending_bid)
+            self.journal.rotate()
+            write_bids(missing_bids)
+        self.journal.checkpoint()
+
+    def run_flusher(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception:
+                # flush() kept the batch, so the next tick retries it.
+                logger.exception('Flushing the order book failed')
+            finally:
+                connection.close()
+
+    def start(self):
+        flusher = threading.Thread(target=self.run_flusher)
+        flusher.setDaemon(True)
+        flusher.start()
+        atexit.register(self.flush)
+
+_order_book = None
+_order_book_lock = threading.Lock()
+
+def get_order_book():
+    global _order_book
+    journal_path = getattr(settings, 'LEBAY_ORDER_BOOK_JOURNAL', None)
+    if not journal_path:
+        return None
+    if _order_book is None:
+        _order_book_lock.acquire()
+        try:
+            if _order_book is None:
+                order_book = OrderBook(journal_path,
+                    batch_size=getattr(settings, 'LEBAY_ORDER_BOOK_BATCH_SIZE', 200),
+                    flush_interval=getattr(settings, 'LEBAY_ORDER_BOOK_FLUSH_INTERVAL', 0.5))
+                order_book.start()
+                _order_book = order_book
+        finally:
+            _order_book_lock.release()
+    return _order_book
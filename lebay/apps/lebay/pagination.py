@@ -0,0 +1,122 @@
+import base64
+
+from django.core.paginator import Paginator, EmptyPage, InvalidPage
+from django.db.models import Q
+from django.utils import simplejson
+
+class CountedPaginator(Paginator):
+    def __init__(self, object_list, per_page, count, **kwargs):
+        super(CountedPaginator, self).__init__(object_list, per_page, **kwargs)
+        self._count = count
+
+def get_requested_page(request, paginator):
+    try:
+        page = int(request.GET.get('page', '1'))
+    except ValueError:
+        page = 1
+
+    try:
+        return paginator.page(page)
+    except (EmptyPage, InvalidPage):
+        return paginator.page(paginator.num_pages)
+
+class KeysetPage(object):
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __repr__(self):
+        return '<Keyset page of %s objects>' % len(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    def next_token(self):
+        if self.has_next():
+            return self.paginator.encode_token('next', self.object_list[-1])
+        return ''
+
+    def previous_token(self):
+        if self.has_previous():
+            return self.paginator.encode_token('previous', self.object_list[0])
+        return ''
+
+class KeysetPaginator(object):
+    # Seeks past the last row shown instead of using OFFSET, so every page
+    # costs the same. Rows are ordered by one field with the primary key as
+    # a tie breaker in the same direction.
+    def __init__(self, object_list, ordering, per_page, count=None):
+        self.ordering = ordering
+        self.descending = ordering.startswith('-')
+        self.lookup = ordering.lstrip('-')
+        self.field = self.get_field(object_list.model, self.lookup)
+        if '__' in self.lookup and not object_list.query.select_related:
+            object_list = object_list.select_related(self.lookup.rsplit('__', 1)[0])
+        self.object_list = object_list
+        self.per_page = per_page
+        self.count = count
+
+    def get_field(self, model, lookup):
+        parts = lookup.split('__')
+        for part in parts[:-1]:
+            model = model._meta.get_field(part).rel.to
+        return model._meta.get_field(parts[-1])
+
+    def get_value(self, obj):
+        for part in self.lookup.split('__'):
+            obj = getattr(obj, part)
+        return obj
+
+    def encode_token(self, direction, obj):
+        token = simplejson.dumps([self.ordering, direction, unicode(self.get_value(obj)), obj.pk])
+        return base64.urlsafe_b64encode(token.encode('utf-8')).rstrip('=')
+
+    def decode_token(self, token):
+        try:
+            token = base64.urlsafe_b64decode(str(token) + '=' * (-len(token) % 4))
+            ordering, direction, value, pk = simplejson.loads(token.decode('utf-8'))
+            if ordering != self.ordering or direction not in ('next', 'previous'):
+                return None
+            return direction, self.field.to_python(value), int(pk)
+        except Exception:
+            return None
+
+    def get_seek_filter(self, value, pk, forward):
+        after = forward != self.descending
+        if after:
+            return Q(**{'%s__gt' % self.lookup: value}) | Q(**{self.lookup: value, 'pk__gt': pk})
+        return Q(**{'%s__lt' % self.lookup: value}) | Q(**{self.lookup: value, 'pk__lt': pk})
+
+    def get_order_by(self, forward):
+        if forward != self.descending:
+            return (self.lookup, 'pk')
+        return ('-%s' % self.lookup, '-pk')
+
+    def get_page_query_set(self, cursor=None):
+        if cursor is None:
+            return self.object_list.order_by(*self.get_order_by(True))[:self.per_page + 1]
+        direction, value, pk = cursor
+        forward = direction == 'next'
+        return self.object_list.filter(self.get_seek_filter(value, pk, forward)).order_by(*self.get_order_by(forward))[:self.per_page + 1]
+
+    def page(self, token=None):
+        cursor = token and self.decode_token(token) or None
+        object_list = list(self.get_page_query_set(cursor))
+        if cursor is None:
+            return KeysetPage(object_list[:self.per_page], self, len(object_list) > self.per_page, False)
+
+        forward = cursor[0] == 'next'
+        has_more = len(object_list) > self.per_page
+        object_list = object_list[:self.per_page]
+        if forward:
+            return KeysetPage(object_list, self, has_more, True)
+        object_list.reverse()
+        return KeysetPage(object_list, self, True, has_more)
@@ -0,0 +1,138 @@
+import datetime
+import time
+
+from django.db import connection, transaction, IntegrityError
+from django.db.models import Q
+
+from lebay.apps.lebay.models import AuctionEvent, Sales
+from lebay.apps.lebay.signals import payments_updated
+from lebay.apps.lebay.constants import SALES_PAYMENT_STATUS_CHOICES, PAYMENT_UPDATE_CHOICES, PAYMENT_UPDATE_UNKNOWN_INVOICE, PAYMENT_UPDATE_INVALID_STATUS, PAYMENT_UPDATE_DUPLICATE, PAYMENT_UPDATE_STALE, PAYMENT_UPDATE_CHUNK_SIZE, SALES_INVOICE_NUMBER_FORMAT, SALES_PAYMENT_STATUS_PROCESSING
+
+ONE_MICROSECOND = datetime.timedelta(microseconds=1)
+
+def format_time_modified(value):
+    return str(value)
+
+def parse_time_modified(value):
+    # strptime has no microseconds before Python 2.6.
+    value, microseconds = (value.strip().split('.', 1) + ['0'])[:2]
+    parsed = datetime.datetime(*time.strptime(value, '%Y-%m-%d %H:%M:%S')[:6])
+    return parsed.replace(microsecond=int(microseconds.ljust(6, '0')[:6]))
+
+class PaymentUpdateSummary(object):
+    def __init__(self):
+        self.applied = []
+        self.rejected = []
+        self.auction_event_ids = []
+        self.sale_ids = set()
+
+    def reject(self, invoice_number, status):
+        self.rejected.append((invoice_number, status))
+
+    def get_rejections(self):
+        messages = dict(PAYMENT_UPDATE_CHOICES)
+        return [(invoice_number, messages[status]) for invoice_number, status in self.rejected]
+
+    def as_dict(self):
+        messages = dict(PAYMENT_UPDATE_CHOICES)
+        return {
+            'applied': self.applied,
+            'rejected': [{'invoice_number': invoice_number, 'status': status, 'message': messages[status]} for invoice_number, status in self.rejected],
+        }
+
+def _apply_payment_updates(seller, changes, current_time, summary):
+    sales = {}
+    for invoice_number, pk, auction_event_id in Sales.objects.filter(auction_event__item__seller=seller, invoice_number__in=[change[0] for change in changes]).values_list('invoice_number', 'pk', 'auction_event'):
+        sales[invoice_number] = (pk, auction_event_id)
+
+    valid_statuses = dict(SALES_PAYMENT_STATUS_CHOICES)
+    conditions = {}
+    pending = {}
+    for invoice_number, payment_status, time_modified in changes:
+        if invoice_number not in sales:
+            summary.reject(invoice_number, PAYMENT_UPDATE_UNKNOWN_INVOICE)
+            continue
+        if payment_status not in valid_statuses:
+            summary.reject(invoice_number, PAYMENT_UPDATE_INVALID_STATUS)
+            continue
+        pk, auction_event_id = sales[invoice_number]
+        if pk in summary.sale_ids:
+            summary.reject(invoice_number, PAYMENT_UPDATE_DUPLICATE)
+            continue
+        summary.sale_ids.add(pk)
+        pending[pk] = (invoice_number, auction_event_id)
+
+        # The expected time_modified is part of the update itself, so a
+        # sale changed since the seller loaded it is simply not matched.
+        # Django's SQLite converter can read a time back a microsecond
+        # short, so the stored time may be up to a microsecond later.
+        condition = Q(pk=pk)
+        if time_modified is not None:
+            condition &= Q(time_modified__gte=time_modified, time_modified__lte=time_modified + ONE_MICROSECOND)
+        if payment_status in conditions:
+            conditions[payment_status] |= condition
+        else:
+            conditions[payment_status] = condition
+
+    for payment_status, condition in conditions.items():
+        Sales.objects.filter(condition).update(payment_status=payment_status, time_modified=current_time)
+
+    applied = set(Sales.objects.filter(pk__in=pending.keys(), time_modified=current_time).values_list('pk', flat=True))
+    for pk, (invoice_number, auction_event_id) in pending.items():
+        if pk in applied:
+            summary.applied.append(invoice_number)
+            summary.auction_event_ids.append(auction_event_id)
+        else:
+            summary.reject(invoice_number, PAYMENT_UPDATE_STALE)
+
+@transaction.commit_on_success
+def update_payment_statuses(seller, changes):
+    # changes is a sequence of (invoice_number, payment_status,
+    # time_modified) where time_modified may be None to skip the check.
+    summary = PaymentUpdateSummary()
+    changes = list(changes)
+    current_time = datetime.datetime.now()
+    for start in range(0, len(changes), PAYMENT_UPDATE_CHUNK_SIZE):
+        _apply_payment_updates(seller, changes[start:start + PAYMENT_UPDATE_CHUNK_SIZE], current_time, summary)
+    if summary.auction_event_ids:
+        payments_updated.send(sender=Sales, auction_event_ids=summary.auction_event_ids)
+    return summary
+
+def get_seller_sales(seller):
+    return Sales.objects.filter(auction_event__item__seller=seller).select_related('auction_event__item').order_by('-time_created')
+
+def make_invoice_number(auction_event_id):
+    # An auction event is sold at most once, so its primary key is already
+    # a unique, monotonic sequence to number invoices from.
+    return SALES_INVOICE_NUMBER_FORMAT % auction_event_id
+
+def get_record_sale_sql():
+    qn = connection.ops.quote_name
+    sales = qn(Sales._meta.db_table)
+    auction_events = qn(AuctionEvent._meta.db_table)
+    auction_event_pk = '%s.%s' % (auction_events, qn(AuctionEvent._meta.pk.column))
+    sales_auction_event = '%s.%s' % (sales, qn(Sales._meta.get_field('auction_event').column))
+    columns = [qn(Sales._meta.get_field(name).column) for name in ('auction_event', 'payment_status', 'invoice_number', 'is_active', 'time_created', 'time_modified')]
+    return 'INSERT INTO %s (%s) SELECT %s, %%s, %%s, %%s, %%s, %%s FROM %s WHERE %s = %%s AND %s.%s = %%s AND %s.%s IS NOT NULL AND NOT EXISTS (SELECT 1 FROM %s WHERE %s = %s)' % (
+        sales, ', '.join(columns), auction_event_pk, auction_events, auction_event_pk,
+        auction_events, qn(AuctionEvent._meta.get_field('winning_bidder').column),
+        auction_events, qn(AuctionEvent._meta.get_field('closed_at').column),
+        sales, sales_auction_event, auction_event_pk,
+    )
+
+def record_sale(auction_event_id, buyer):
+    # Inserts the sale only if buyer won the auction, it has closed and it
+    # has no sale yet, in a single statement. A concurrent duplicate that slips past
+    # NOT EXISTS trips the unique invoice number instead.
+    current_time = connection.ops.value_to_db_datetime(datetime.datetime.now())
+    cursor = connection.cursor()
+    try:
+        cursor.execute(get_record_sale_sql(), [SALES_PAYMENT_STATUS_PROCESSING, make_invoice_number(auction_event_id), True, current_time, current_time, auction_event_id, buyer.pk])
+    except IntegrityError:
+        transaction.rollback_unless_managed()
+        return False
+    created = cursor.rowcount == 1
+    transaction.commit_unless_managed()
+    if created:
+        payments_updated.send(sender=Sales, auction_event_ids=[auction_event_id])
+    return created
@@ -0,0 +1,238 @@
+import cProfile
+import datetime
+import pstats
+import random
+import threading
+import time
+from cStringIO import StringIO
+
+from django.conf import settings
+from django.db import connection
+from django.template import Template
+
+from lebay.apps.lebay.replication import replica_connections
+
+PROFILE_DUPLICATE_QUERIES_SHOWN = 5
+PROFILE_STATS_LINES = 40
+
+_active = threading.local()
+
+class RequestProfile(object):
+    def __init__(self, method, path):
+        self.method = method
+        self.path = path
+        self.view = None
+        self.status = None
+        self.time_started = datetime.datetime.now()
+        self.started = time.time()
+        self.duration = 0.0
+        self.sql_time = 0.0
+        self.query_count = 0
+        self.fingerprints = {}
+        self.template_time = 0.0
+        self.template_depth = 0
+        self.profile_output = None
+
+    def add_query(self, sql, elapsed):
+        self.query_count += 1
+        self.sql_time += elapsed
+        self.fingerprints[sql] = self.fingerprints.get(sql, 0) + 1
+
+    def finish(self, status):
+        self.status = status
+        self.duration = time.time() - self.started
+
+    def get_duplicates(self):
+        # Queries are recorded before parameters are bound, so the SQL text
+        # already is the fingerprint of an N+1 loop.
+        duplicates = [(count, sql) for sql, count in self.fingerprints.items() if count > 1]
+        duplicates.sort(reverse=True)
+        return [{'sql': sql, 'count': count} for count, sql in duplicates[:PROFILE_DUPLICATE_QUERIES_SHOWN]]
+
+    def as_dict(self):
+        return {
+            'time': self.time_started.strftime('%Y-%m-%d %H:%M:%S'),
+            'method': self.method,
+            'path': self.path,
+            'view': self.view,
+            'status': self.status,
+            'duration_ms': round(self.duration * 1000, 2),
+            'query_count': self.query_count,
+            'sql_ms': round(self.sql_time * 1000, 2),
+            'template_ms': round(self.template_time * 1000, 2),
+            'duplicate_queries': self.get_duplicates(),
+        }
+
+class ProfilingCursorWrapper(object):
+    def __init__(self, cursor, profile):
+        self.cursor = cursor
+        self.profile = profile
+
+    def execute(self, sql, params=()):
+        started = time.time()
+        try:
+            return self.cursor.execute(sql, params)
+        finally:
+            self.profile.add_query(sql, time.time() - started)
+
+    def executemany(self, sql, param_list):
+        started = time.time()
+        try:
+            return self.cursor.executemany(sql, param_list)
+        finally:
+            self.profile.add_query(sql, time.time() - started)
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+class RequestProfileLog(object):
+    # A fixed size list used as a ring buffer, plus the few slowest
+    # requests that were run under cProfile.
+    def __init__(self, size, sample_rate, slowest_kept):
+        self.size = size
+        self.sample_rate = sample_rate
+        self.slowest_kept = slowest_kept
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.lock.acquire()
+        try:
+            self.profiles = [None] * self.size
+            self.position = 0
+            self.total = 0
+            self.slowest = []
+        finally:
+            self.lock.release()
+
+    def should_sample(self):
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def add(self, profile):
+        self.lock.acquire()
+        try:
+            self.profiles[self.position] = profile
+            self.position = (self.position + 1) % self.size
+            self.total += 1
+            if profile.profile_output is not None:
+                self.slowest.append((profile.duration, profile))
+                self.slowest.sort(reverse=True)
+                del self.slowest[self.slowest_kept:]
+        finally:
+            self.lock.release()
+
+    def get_profiles(self):
+        self.lock.acquire()
+        try:
+            profiles = self.profiles[self.position:] + self.profiles[:self.position]
+        finally:
+            self.lock.release()
+        return [profile for profile in profiles if profile is not None]
+
+    def get_slowest(self):
+        self.lock.acquire()
+        try:
+            return [profile for duration, profile in self.slowest]
+        finally:
+            self.lock.release()
+
+    def get_view_summaries(self):
+        views = {}
+        for profile in self.get_profiles():
+            views.setdefault(profile.view or profile.path, []).append(profile)
+        summaries = []
+        for view, profiles in views.items():
+            durations = sorted([profile.duration for profile in profiles])
+            summaries.append({
+                'view': view,
+                'requests': len(profiles),
+                'p50_ms': durations[len(durations) / 2] * 1000,
+                'p95_ms': durations[min(int(len(durations) * 0.95), len(durations) - 1)] * 1000,
+                'max_queries': max([profile.query_count for profile in profiles]),
+                'average_queries': float(sum([profile.query_count for profile in profiles])) / len(profiles),
+                'average_sql_ms': sum([profile.sql_time for profile in profiles]) * 1000 / len(profiles),
+                'average_template_ms': sum([profile.template_time for profile in profiles]) * 1000 / len(profiles),
+                'duplicated_requests': len([profile for profile in profiles if profile.get_duplicates()]),
+            })
+        summaries.sort(key=lambda summary: summary['p95_ms'], reverse=True)
+        return summaries
+
+request_profiles = RequestProfileLog(
+    getattr(settings, 'LEBAY_PROFILING_BUFFER_SIZE', 1000),
+    getattr(settings, 'LEBAY_PROFILING_SAMPLE_RATE', 0),
+    getattr(settings, 'LEBAY_PROFILING_SLOWEST_KEPT', 10))
+
+def get_active_profile():
+    return getattr(_active, 'profile', None)
+
+def get_view_name(view_func):
+    view_func = getattr(view_func, 'view_func', view_func)
+    return '%s.%s' % (getattr(view_func, '__module__', ''), getattr(view_func, '__name__', view_func.__class__.__name__))
+
+_template_render = Template.render
+
+def _timed_template_render(self, context):
+    # Only the outermost render is timed, so includes are not counted twice.
+    profile = get_active_profile()
+    if profile is None or profile.template_depth:
+        return _template_render(self, context)
+    profile.template_depth += 1
+    started = time.time()
+    try:
+        return _template_render(self, context)
+    finally:
+        profile.template_depth -= 1
+        profile.template_time += time.time() - started
+
+Template.render = _timed_template_render
+
+class RequestProfilingMiddleware(object):
+    # Keep it first in MIDDLEWARE_CLASSES so the timing covers the rest.
+    def process_request(self, request):
+        profile = RequestProfile(request.method, request.path)
+        _active.profile = profile
+        # Connections are thread local, so this only wraps this thread's
+        # cursors, and it works without settings.DEBUG.
+        for profiled_connection in [connection] + replica_connections:
+            self.wrap_cursor(profiled_connection, profile)
+
+    def wrap_cursor(self, profiled_connection, profile):
+        profiled_connection.cursor = lambda: ProfilingCursorWrapper(profiled_connection.__class__.cursor(profiled_connection), profile)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        profile = get_active_profile()
+        if profile is None:
+            return None
+        profile.view = get_view_name(view_func)
+        if request_profiles.should_sample():
+            profiler = cProfile.Profile()
+            response = profiler.runcall(view_func, request, *view_args, **view_kwargs)
+            output = StringIO()
+            stats = pstats.Stats(profiler, stream=output)
+            stats.sort_stats('cumulative').print_stats(PROFILE_STATS_LINES)
+            profile.profile_output = output.getvalue()
+            return response
+        return None
+
+    def process_response(self, request, response):
+        profile = get_active_profile()
+        if profile is not None:
+            self.finish(profile, response.status_code)
+        return response
+
+    def process_exception(self, request, exception):
+        profile = get_active_profile()
+        if profile is not None:
+            self.finish(profile, 500)
+        return None
+
+    def finish(self, profile, status):
+        _active.profile = None
+        for profiled_connection in [connection] + replica_connections:
+            if 'cursor' in profiled_connection.__dict__:
+                del profiled_connection.cursor
+        profile.finish(status)
+        request_profiles.add(profile)
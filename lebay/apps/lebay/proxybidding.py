@@ -0,0 +1,158 @@
+import bisect
+import datetime
+
+from django.db import transaction
+
+from lebay.apps.lebay.bidding import BidResult, _get_rejection_status, extend_for_bid
+from lebay.apps.lebay.models import AuctionEvent, Bid, ProxyBid
+from lebay.apps.lebay.signals import bids_recorded
+from lebay.apps.lebay.constants import AUCTION_ITEM_STATUS_RUNNING, BID_RESULT_ACCEPTED, BID_RESULT_TOO_LOW, BID_RESULT_NOT_RUNNING, BID_RESULT_OWN_ITEM, BID_RESULT_OUTBID, BID_RESULT_BUSY, BID_INCREMENT_BOUNDS, BID_INCREMENTS
+
+PROXY_BID_ATTEMPTS = 5
+
+def get_bid_increment(price):
+    return BID_INCREMENTS[bisect.bisect_right(BID_INCREMENT_BOUNDS, price)]
+
+class ProxyState(object):
+    # All an auction needs to resolve a new maximum: the visible price and
+    # the leader's maximum. Every other maximum is at or below the price,
+    # so the second highest is already reflected in it.
+    __slots__ = ('starting_price', 'current_price', 'bid_count', 'leader_id', 'leader_maximum')
+
+    def __init__(self, starting_price, current_price, bid_count, leader_id, leader_maximum):
+        self.starting_price = starting_price
+        self.current_price = current_price
+        self.bid_count = bid_count
+        self.leader_id = leader_id
+        self.leader_maximum = leader_maximum
+
+    @classmethod
+    def from_row(cls, starting_price, current_price, bid_count, leader_id, proxy_maximum):
+        return cls(starting_price, current_price, bid_count, leader_id, proxy_maximum or current_price)
+
+    def get_proxy_maximum(self):
+        if self.leader_maximum > self.current_price:
+            return self.leader_maximum
+        return None
+
+def resolve_maximum(state, bidder_id, maximum, exact=False):
+    # Applies a maximum to state and returns the status and the bids to
+    # record as (bidder_id, amount), lowest first. An exact bid is a plain
+    # bid: if it takes the lead the price becomes the bid itself.
+    if not state.bid_count:
+        if maximum < state.starting_price:
+            return BID_RESULT_TOO_LOW, []
+        price = state.starting_price
+        if exact:
+            price = maximum
+        state.current_price, state.leader_id, state.leader_maximum, state.bid_count = price, bidder_id, maximum, 1
+        return BID_RESULT_ACCEPTED, [(bidder_id, price)]
+
+    if maximum <= state.current_price:
+        return BID_RESULT_TOO_LOW, []
+
+    if bidder_id == state.leader_id:
+        if exact:
+            state.current_price = maximum
+            state.leader_maximum = max(state.leader_maximum, maximum)
+            state.bid_count += 1
+            return BID_RESULT_ACCEPTED, [(bidder_id, maximum)]
+        if maximum <= state.leader_maximum:
+            return BID_RESULT_TOO_LOW, []
+        state.leader_maximum = maximum
+        return BID_RESULT_ACCEPTED, []
+
+    if maximum > state.leader_maximum:
+        bids = []
+        if state.leader_maximum > state.current_price:
+            bids.append((state.leader_id, state.leader_maximum))
+        price = maximum
+        if not exact:
+            price = min(maximum, state.leader_maximum + get_bid_increment(state.leader_maximum))
+        bids.append((bidder_id, price))
+        state.current_price, state.leader_id, state.leader_maximum = price, bidder_id, maximum
+        state.bid_count += len(bids)
+        return BID_RESULT_ACCEPTED, bids
+
+    # The leader's maximum covers it; the leader answers one increment up,
+    # or matches it exactly since the earlier maximum wins a tie.
+    price = min(state.leader_maximum, maximum + get_bid_increment(maximum))
+    state.current_price = price
+    state.bid_count += 2
+    return BID_RESULT_OUTBID, [(bidder_id, maximum), (state.leader_id, price)]
+
+def _record_maximum(auction_event, bidder, maximum, current_time):
+    if not ProxyBid.objects.filter(auction_event=auction_event, bidder=bidder).update(maximum=maximum, time_modified=current_time):
+        ProxyBid(auction_event=auction_event, bidder=bidder, maximum=maximum).save()
+
+@transaction.commit_manually
+def submit_maximum(auction_event, bidder, maximum, exact=False):
+    if auction_event.item.status != AUCTION_ITEM_STATUS_RUNNING:
+        return BidResult(BID_RESULT_NOT_RUNNING, auction_event, maximum)
+    if auction_event.item.seller_id == bidder.pk:
+        return BidResult(BID_RESULT_OWN_ITEM, auction_event, maximum)
+
+    for attempt in range(PROXY_BID_ATTEMPTS):
+        current_time = datetime.datetime.now()
+        try:
+            rows = list(AuctionEvent.objects.filter(pk=auction_event.pk, start_time__lte=current_time, end_time__gt=current_time).values_list(
+                'starting_price', 'current_price', 'bid_count', 'winning_bidder', 'proxy_maximum'))
+            if not rows:
+                transaction.rollback()
+                return BidResult(BID_RESULT_NOT_RUNNING, auction_event, maximum)
+            starting_price, current_price, bid_count, leader_id, proxy_maximum = rows[0]
+            state = ProxyState.from_row(starting_price, current_price, bid_count, leader_id, proxy_maximum)
+            status, bid_amounts = resolve_maximum(state, bidder.pk, maximum, exact)
+            if status == BID_RESULT_TOO_LOW:
+                transaction.rollback()
+                return BidResult(status, auction_event, maximum)
+
+            bids = []
+            for bidder_id, amount in bid_amounts:
+                bid = Bid(auction_event=auction_event, bidder_id=bidder_id, amount=amount)
+                bid.save()
+                bids.append(bid)
+
+            # The row is only claimed if nobody changed it since it was read;
+            # otherwise this attempt is rolled back and resolved again.
+            claim = {'pk': auction_event.pk, 'current_price': current_price, 'bid_count': bid_count, 'end_time__gt': current_time, 'closed_at__isnull': True}
+            if leader_id is None:
+                claim['winning_bidder__isnull'] = True
+            else:
+                claim['winning_bidder'] = leader_id
+            if proxy_maximum is None:
+                claim['proxy_maximum__isnull'] = True
+            else:
+                claim['proxy_maximum'] = proxy_maximum
+            values = {'current_price': state.current_price, 'bid_count': state.bid_count, 'proxy_maximum': state.get_proxy_maximum(), 'time_modified': current_time}
+            if state.leader_id == bidder.pk:
+                values['winning_bidder'] = bidder
+            if bids:
+                values['highest_bid'] = bids[-1]
+            claimed = AuctionEvent.objects.filter(**claim).update(**values)
+            if claimed:
+                if not exact:
+                    _record_maximum(auction_event, bidder, maximum, current_time)
+                if bids:
+                    extend_for_bid(auction_event, current_time)
+                    bids_recorded.send(sender=Bid, auction_event_ids=[auction_event.pk], bidder_ids=[bidder_id for bidder_id, amount in bid_amounts])
+        except:
+            transaction.rollback()
+            raise
+
+        if claimed:
+            transaction.commit()
+            auction_event.current_price = state.current_price
+            auction_event.bid_count = state.bid_count
+            auction_event.winning_bidder_id = state.leader_id
+            auction_event.proxy_maximum = state.get_proxy_maximum()
+            own_bids = [own_bid for own_bid in bids if own_bid.bidder_id == bidder.pk]
+            return BidResult(status, auction_event, maximum, bid=own_bids and own_bids[-1] or None)
+        transaction.rollback()
+
+    # Every attempt lost its claim to a concurrent bid. Unless the auction
+    # ended meanwhile, the maximum was never compared, so it is not too low.
+    status = _get_rejection_status(auction_event, maximum, datetime.datetime.now())
+    if status == BID_RESULT_TOO_LOW:
+        status = BID_RESULT_BUSY
+    return BidResult(status, auction_event, maximum)
@@ -0,0 +1,102 @@
+import datetime
+import re
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connection
+
+from lebay.apps.lebay.models import AuctionEvent, ArchivedAuctionEvent, ItemCategory, make_category_path
+from lebay.apps.lebay.constants import AUCTION_EVENT_SORTING_CHOICES
+from lebay.apps.lebay.closing import AuctionCloser
+from lebay.apps.lebay.dashboard import get_selling_auctions, get_won_auctions, get_inventory_items, get_bidding_auctions, get_owed_auctions, get_received_auctions
+from lebay.apps.lebay.facets import AuctionFacets
+from lebay.apps.lebay.forms import AuctionBrowseForm
+from lebay.apps.lebay.pagination import KeysetPaginator
+from lebay.apps.lebay.payments import get_seller_sales
+from lebay.apps.lebay.search import search_items
+
+SQLITE_SCAN_RE = re.compile(r'^SCAN (?:TABLE )?(\w+)(.*)$')
+POSTGRESQL_SCAN_RE = re.compile(r'Seq Scan on (\w+)')
+
+def get_seek_value(field, current_time):
+    internal_type = field.get_internal_type()
+    if internal_type == 'DateTimeField':
+        return current_time
+    if internal_type == 'DecimalField':
+        return Decimal('0.00')
+    if internal_type.endswith('IntegerField'):
+        return 0
+    return u''
+
+def get_keyset_querysets(name, auction_events, current_time):
+    querysets = []
+    for sort_by, ordering in AUCTION_EVENT_SORTING_CHOICES:
+        paginator = KeysetPaginator(auction_events, ordering, 10)
+        querysets.append(('%s by %s' % (name, sort_by), paginator.get_page_query_set()))
+        querysets.append(('%s by %s, next' % (name, sort_by), paginator.get_page_query_set(('next', get_seek_value(paginator.field, current_time), 1))))
+    return querysets
+
+def get_hot_querysets():
+    # The querysets come from the same code the views and the closer run.
+    # Plans do not depend on the values bound, so any ids will do.
+    user_id = 1
+    category = ItemCategory(pk=1, path=make_category_path([1]))
+    current_time = datetime.datetime.now()
+
+    querysets = []
+    querysets.extend(get_keyset_querysets('current auctions', AuctionEvent.objects.get_current_auctions().for_listing().exclude(item__seller=user_id), current_time))
+    querysets.extend(get_keyset_querysets('category auctions', AuctionEvent.objects.get_current_category_auctions(category).for_listing(), current_time))
+
+    for sort_by, ordering in AUCTION_EVENT_SORTING_CHOICES:
+        form = AuctionBrowseForm(data={'sort_by': sort_by})
+        form.is_valid()
+        facets = AuctionFacets(category=category, condition=1, price_bucket=0, ending_soon=True)
+        querysets.append(('browse by %s' % sort_by, form.browse(facets, user=user_id)[:10]))
+
+    querysets.append(('search', search_items(u'vintage lamp')))
+    querysets.append(('dashboard inventory', get_inventory_items(user_id)))
+    querysets.append(('dashboard selling', get_selling_auctions(user_id)))
+    querysets.append(('dashboard won', get_won_auctions(user_id)))
+    querysets.append(('dashboard won archived', ArchivedAuctionEvent.objects.filter(winning_bidder=user_id).order_by('-closed_at', '-pk')))
+    querysets.append(('dashboard bidding', get_bidding_auctions(user_id)))
+    querysets.append(('dashboard owed', get_owed_auctions(user_id)))
+    querysets.append(('dashboard received', get_received_auctions(user_id)))
+    querysets.append(('seller sales', get_seller_sales(user_id)))
+    querysets.append(('closer upcoming', AuctionCloser().get_upcoming_auctions(current_time)))
+    return querysets
+
+def get_sqlite_full_scans(cursor, sql, params):
+    cursor.execute('EXPLAIN QUERY PLAN %s' % sql, params)
+    full_scans = []
+    for row in cursor.fetchall():
+        match = SQLITE_SCAN_RE.match(row[-1])
+        if match and 'INDEX' not in match.group(2):
+            full_scans.append(match.group(1))
+    return full_scans
+
+def get_postgresql_full_scans(cursor, sql, params):
+    # Tiny test tables are always cheaper to scan, so force the planner
+    # to show whether an index path exists at all.
+    cursor.execute('SET enable_seqscan = off')
+    cursor.execute('EXPLAIN %s' % sql, params)
+    full_scans = []
+    for row in cursor.fetchall():
+        full_scans.extend(POSTGRESQL_SCAN_RE.findall(row[0]))
+    cursor.execute('SET enable_seqscan = on')
+    return full_scans
+
+def get_full_scan_finder():
+    if settings.DATABASE_ENGINE == 'sqlite3':
+        return get_sqlite_full_scans
+    if settings.DATABASE_ENGINE in ('postgresql', 'postgresql_psycopg2'):
+        return get_postgresql_full_scans
+    return None
+
+def find_full_scans(get_full_scans):
+    # Returns (name, full scanned tables) for every hot queryset.
+    cursor = connection.cursor()
+    results = []
+    for name, queryset in get_hot_querysets():
+        sql, params = queryset.query.as_sql()
+        results.append((name, get_full_scans(cursor, sql, params)))
+    return results
@@ -0,0 +1,122 @@
+import random
+import threading
+
+from django.conf import settings
+from django.core import signals
+from django.db import backend, connection
+from django.db.models import Manager, sql
+from django.db.models.query import QuerySet
+from django.db.models.signals import pre_save, pre_delete
+from django.utils.functional import wraps
+
+REPLICA_PIN_COOKIE = 'lebay_primary'
+REPLICA_PIN_SECONDS = getattr(settings, 'LEBAY_REPLICA_PIN_SECONDS', 10)
+REPLICATED_APP_LABELS = ('lebay', 'auth')
+
+_state = threading.local()
+
+def make_replica_connection(overrides):
+    # Django 1.1 has a single database, but a query runs on whatever
+    # connection it was built with, so a replica is one more wrapper of the
+    # same backend. Each wrapper is thread local like the primary.
+    settings_dict = {
+        'DATABASE_HOST': settings.DATABASE_HOST,
+        'DATABASE_NAME': settings.DATABASE_NAME,
+        'DATABASE_OPTIONS': settings.DATABASE_OPTIONS,
+        'DATABASE_PASSWORD': settings.DATABASE_PASSWORD,
+        'DATABASE_PORT': settings.DATABASE_PORT,
+        'DATABASE_USER': settings.DATABASE_USER,
+        'TIME_ZONE': settings.TIME_ZONE,
+    }
+    settings_dict.update(overrides)
+    return backend.DatabaseWrapper(settings_dict)
+
+replica_connections = [make_replica_connection(overrides) for overrides in getattr(settings, 'LEBAY_READ_REPLICAS', [])]
+
+def get_read_connection():
+    return getattr(_state, 'connection', None) or connection
+
+def is_reading_replica():
+    return get_read_connection() is not connection
+
+def use_replica():
+    if replica_connections and not has_written():
+        _state.connection = random.choice(replica_connections)
+
+def use_primary():
+    _state.connection = None
+
+def has_written():
+    return getattr(_state, 'written', False)
+
+def mark_written():
+    # Reads after a write in the same request see it on the primary.
+    _state.written = True
+    _state.connection = None
+
+def reset():
+    _state.written = False
+    _state.connection = None
+
+class RoutedQuerySet(QuerySet):
+    # Reads go to the connection the request was routed to; updates and
+    # deletes always run on the primary.
+    def __init__(self, model=None, query=None):
+        if query is None and model is not None:
+            query = sql.Query(model, get_read_connection())
+        super(RoutedQuerySet, self).__init__(model, query)
+
+    def using_primary(self):
+        clone = self._clone()
+        clone.query.connection = connection
+        return clone
+
+    def update(self, **kwargs):
+        mark_written()
+        return super(RoutedQuerySet, self.using_primary()).update(**kwargs)
+
+    def _update(self, values):
+        mark_written()
+        return super(RoutedQuerySet, self.using_primary())._update(values)
+
+    def delete(self):
+        mark_written()
+        return super(RoutedQuerySet, self.using_primary()).delete()
+
+class RoutedManager(Manager):
+    def get_query_set(self):
+        return RoutedQuerySet(self.model)
+
+def read_only(view_func):
+    # Routes a view's reads to a replica, unless the request writes or the
+    # client wrote recently enough to still be pinned to the primary.
+    def _read_only(request, *args, **kwargs):
+        if request.method in ('GET', 'HEAD') and REPLICA_PIN_COOKIE not in request.COOKIES:
+            use_replica()
+        try:
+            return view_func(request, *args, **kwargs)
+        finally:
+            use_primary()
+    return wraps(view_func)(_read_only)
+
+class ReplicationMiddleware(object):
+    def process_request(self, request):
+        reset()
+
+    def process_response(self, request, response):
+        if has_written() or request.method not in ('GET', 'HEAD'):
+            response.set_cookie(REPLICA_PIN_COOKIE, '1', max_age=REPLICA_PIN_SECONDS)
+        reset()
+        return response
+
+def mark_model_written(sender, **kwargs):
+    if sender._meta.app_label in REPLICATED_APP_LABELS:
+        mark_written()
+
+def close_replica_connections(**kwargs):
+    for replica_connection in replica_connections:
+        replica_connection.close()
+
+pre_save.connect(mark_model_written)
+pre_delete.connect(mark_model_written)
+signals.request_finished.connect(close_replica_connections)
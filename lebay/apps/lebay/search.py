@@ -0,0 +1,103 @@
+import datetime
+import re
+
+from django.db import connection, transaction
+from django.db.models import Q, Sum
+from django.utils.html import strip_tags
+
+from lebay.apps.lebay.constants import AUCTION_ITEM_STATUS_RUNNING
+
+SEARCH_TITLE_WEIGHT = 5
+SEARCH_DESCRIPTION_WEIGHT = 1
+SEARCH_MAX_TERM_WEIGHT = 20
+SEARCH_MAX_QUERY_TERMS = 8
+SEARCH_TERM_LENGTH = 50
+
+ENTITY_RE = re.compile(r'&#?\w+;')
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+STOP_WORDS = set([
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'in', 'is',
+    'it', 'of', 'on', 'or', 'the', 'this', 'to', 'with',
+])
+
+def tokenize(text):
+    text = ENTITY_RE.sub(' ', strip_tags(text or u''))
+    return [token[:SEARCH_TERM_LENGTH] for token in TOKEN_RE.findall(text.lower()) if token not in STOP_WORDS]
+
+def get_term_weights(item):
+    weights = {}
+    for term in tokenize(item.title):
+        weights[term] = weights.get(term, 0) + SEARCH_TITLE_WEIGHT
+    for term in tokenize(item.description):
+        weights[term] = weights.get(term, 0) + SEARCH_DESCRIPTION_WEIGHT
+    for term, weight in weights.items():
+        weights[term] = min(weight, SEARCH_MAX_TERM_WEIGHT)
+    return weights
+
+def index_items(items):
+    from lebay.apps.lebay.models import ItemSearchTerm
+
+    qn = connection.ops.quote_name
+    table = qn(ItemSearchTerm._meta.db_table)
+    item_ids = [item.pk for item in items]
+    if not item_ids:
+        return 0
+
+    rows = []
+    for item in items:
+        for term, weight in get_term_weights(item).items():
+            rows.append((item.pk, term, weight))
+
+    cursor = connection.cursor()
+    cursor.execute('DELETE FROM %s WHERE item_id IN (%s)' % (table, ', '.join(['%s'] * len(item_ids))), item_ids)
+    if rows:
+        cursor.executemany('INSERT INTO %s (item_id, term, weight) VALUES (%%s, %%s, %%s)' % table, rows)
+    transaction.commit_unless_managed()
+    return len(rows)
+
+def update_item_search_terms(sender, instance, **kwargs):
+    index_items([instance])
+
+def _term_filter(term):
+    # A range instead of LIKE keeps the prefix match on the term index.
+    return Q(term__gte=term, term__lt=term + u'\uffff')
+
+def search_items(query):
+    from lebay.apps.lebay.models import AuctionEvent, Item, ItemSearchTerm
+
+    terms = []
+    for term in tokenize(query):
+        if term not in terms:
+            terms.append(term)
+    terms = terms[:SEARCH_MAX_QUERY_TERMS]
+    if not terms:
+        return ItemSearchTerm.objects.none()
+
+    matches = Q()
+    for term in terms:
+        matches |= _term_filter(term)
+    # Only items whose auction is inside its start and end window, as in the
+    # listings, so counts and pages match what get_auction_events loads. A
+    # correlated EXISTS keeps the term range driving the plan; a join or an
+    # IN list makes the planner walk every running item instead.
+    qn = connection.ops.quote_name
+    current_time = connection.ops.value_to_db_datetime(datetime.datetime.now())
+    current_auction = 'EXISTS (SELECT 1 FROM %s ae INNER JOIN %s i ON ae.item_id = i.id WHERE ae.item_id = %s.item_id AND i.status = %%s AND ae.start_time < %%s AND ae.end_time > %%s)' % (
+        qn(AuctionEvent._meta.db_table), qn(Item._meta.db_table), qn(ItemSearchTerm._meta.db_table))
+    results = ItemSearchTerm.objects.filter(matches).extra(where=[current_auction], params=[AUCTION_ITEM_STATUS_RUNNING, current_time, current_time])
+    if len(terms) > 1:
+        for term in terms:
+            results = results.filter(item__in=ItemSearchTerm.objects.filter(_term_filter(term)).values('item'))
+    return results.values('item').annotate(score=Sum('weight')).order_by('-score', 'item')
+
+def get_auction_events(results):
+    from lebay.apps.lebay.models import AuctionEvent
+
+    item_ids = [result['item'] for result in results]
+    # The item status is checked on the joined rows: filtering on it lets
+    # the planner walk every running item instead of the page's ids.
+    current_time = datetime.datetime.now()
+    auction_events = AuctionEvent.objects.get_listing().filter(item__in=item_ids, start_time__lt=current_time, end_time__gt=current_time)
+    auction_events = dict([(auction_event.item_id, auction_event) for auction_event in auction_events if auction_event.item.status == AUCTION_ITEM_STATUS_RUNNING])
+    return [auction_events[item_id] for item_id in item_ids if item_id in auction_events]
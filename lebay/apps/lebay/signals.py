@@ -0,0 +1,7 @@
+from django.dispatch import Signal
+
+auctions_opened = Signal(providing_args=['auction_event_ids'])
+auctions_closed = Signal(providing_args=['auction_event_ids'])
+bids_recorded = Signal(providing_args=['auction_event_ids', 'bidder_ids'])
+payments_updated = Signal(providing_args=['auction_event_ids'])
+auctions_archived = Signal(providing_args=['auction_event_ids'])
@@ -0,0 +1 @@
+CREATE INDEX lebay_auctionevent_item_id_end_time ON lebay_auctionevent (item_id, end_time, start_time);
@@ -0,0 +1,2 @@
+CREATE INDEX lebay_item_status_category_id ON lebay_item (status, category_id);
+CREATE INDEX lebay_item_seller_id_status ON lebay_item (seller_id, status);
@@ -0,0 +1,32 @@
+from django import template
+
+from lebay.apps.lebay.fragments import fragment_cache
+
+register = template.Library()
+
+class AuctionFragmentNode(template.Node):
+    def __init__(self, nodelist, auction_event_id, fragment_name, vary_on):
+        self.nodelist = nodelist
+        self.auction_event_id = auction_event_id
+        self.fragment_name = fragment_name
+        self.vary_on = vary_on
+
+    def render(self, context):
+        try:
+            auction_event_id = self.auction_event_id.resolve(context)
+        except template.VariableDoesNotExist:
+            raise template.TemplateSyntaxError('"auctionfragment" tag got an unknown auction event: %r' % self.auction_event_id.var)
+        vary_on = [template.resolve_variable(var, context) for var in self.vary_on]
+        return fragment_cache.render(auction_event_id, self.fragment_name, vary_on, lambda: self.nodelist.render(context))
+
+# {% auctionfragment auction_event.pk <name> [vary_on ...] %} caches the
+# enclosed block until the auction's version is bumped.
+def do_auctionfragment(parser, token):
+    nodelist = parser.parse(('endauctionfragment',))
+    parser.delete_first_token()
+    tokens = token.contents.split()
+    if len(tokens) < 3:
+        raise template.TemplateSyntaxError(u"%r tag requires at least 2 arguments." % tokens[0])
+    return AuctionFragmentNode(nodelist, template.Variable(tokens[1]), tokens[2], tokens[3:])
+
+register.tag('auctionfragment', do_auctionfragment)
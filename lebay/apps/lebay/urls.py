@@ -4,6 +4,7 @@ from lebay.apps.lebay import views as lebay_views
 urlpatterns = patterns('',
     url(r'^$', lebay_views.index, name='lebay_index'),
     url(r'^home/$', lebay_views.view_user_home, name='lebay_user_home'),
+    url(r'^home/(?P<section>selling|won|inventory)/$', lebay_views.view_user_section, name='lebay_user_section'),
     url(r'^register/$', lebay_views.register_user, name='lebay_register_user'),
     url(r'^login/$', lebay_views.login_user, name='lebay_login'),
     url(r'^logout/$', lebay_views.logout_user, name='lebay_logout'),
@@ -13,15 +14,22 @@ urlpatterns = patterns('',
     url(r'^categories/(?P<category_id>\d+)/$', lebay_views.view_category, name='lebay_view_category'),
     
     url(r'^item/sell/$', lebay_views.list_item, name='lebay_list_item'),
+    url(r'^item/sell/bulk/$', lebay_views.bulk_list_items, name='lebay_bulk_list_items'),
     url(r'^item/buy/$', lebay_views.view_auction_events, name='lebay_view_auction_events'),
+    url(r'^item/browse/$', lebay_views.browse_auction_events, name='lebay_browse_auction_events'),
     url(r'^item/(?P<item_id>\d+)/view/$', lebay_views.view_item, name='lebay_view_item_detail'),
     url(r'^item/(?P<item_id>\d+)/edit/$', lebay_views.edit_item, name='lebay_edit_item_detail'),
     url(r'^item/(?P<item_id>\d+)/sell/$', lebay_views.list_existing_item, name='lebay_list_existing_item'),
     url(r'^item/auction/(?P<auction_event_id>\d+)/$', lebay_views.view_auction_event, name='lebay_view_auction_event'),
+    url(r'^item/auction/(?P<auction_event_id>\d+)/live/$', lebay_views.watch_auction_event, name='lebay_watch_auction_event'),
     url(r'^item/auction/(?P<auction_event_id>\d+)/ended/$', lebay_views.view_ended_auction_event, name='lebay_view_ended_auction_event'),
     url(r'^item/auction/(?P<auction_event_id>\d+)/bids/$', lebay_views.view_bid_history, name='lebay_view_bid_history'),    
     url(r'^item/auction/payments/(?P<auction_event_id>\d+)/pay/$', lebay_views.pay_for_item, name='lebay_pay_for_item'),
     url(r'^item/auction/payments/manage/$', lebay_views.manage_payments, name='lebay_manage_payments'),
+    url(r'^item/auction/payments/update/$', lebay_views.update_payments, name='lebay_update_payments'),
+    url(r'^item/auction/export/(?P<name>sales|bids|auctions)/$', lebay_views.export_seller_history, name='lebay_export_seller_history'),
+    url(r'^item/auction/cache/stats/$', lebay_views.view_fragment_cache_stats, name='lebay_view_fragment_cache_stats'),
+    url(r'^stats/requests/$', lebay_views.view_request_profiles, name='lebay_view_request_profiles'),
     
     url(r'^profile/password/change/$', lebay_views.change_password, name='lebay_change_password'),
     url(r'^profile/user/edit/$', lebay_views.edit_user_profile, name='lebay_edit_user_profile'),
@@ -1,10 +1,34 @@
-from lebay.apps.lebay.constants import AUCTION_ITEM_STATUS_SOLD, AUCTION_ITEM_STATUS_EXPIRED
+from django.db import connection, transaction
+
+from lebay.apps.lebay.models import AuctionEvent, Bid
+from lebay.apps.lebay.closing import close_auctions
 
 def process_ended_auction(auction_event):
-    bid_count = auction_event.bids.count()
-    if bid_count:
-        auction_event.item.status = AUCTION_ITEM_STATUS_SOLD
-        auction_event.item.save()
-    else:
-        auction_event.item.status = AUCTION_ITEM_STATUS_EXPIRED
-        auction_event.item.save()
+    return close_auctions([auction_event.pk])
+
+def rebuild_bid_aggregates(auction_event_ids=None):
+    qn = connection.ops.quote_name
+    auction_table = qn(AuctionEvent._meta.db_table)
+    bid_table = qn(Bid._meta.db_table)
+    top_bid = 'SELECT %%s FROM %s WHERE %s.auction_event_id = %s.id ORDER BY amount DESC, id DESC LIMIT 1' % (bid_table, bid_table, auction_table)
+
+    sql = 'UPDATE %s SET bid_count = (SELECT COUNT(*) FROM %s WHERE %s.auction_event_id = %s.id), ' % (auction_table, bid_table, bid_table, auction_table)
+    sql += 'current_price = COALESCE((%s), starting_price), ' % (top_bid % 'amount')
+    sql += 'highest_bid_id = (%s), ' % (top_bid % 'id')
+    sql += 'winning_bidder_id = COALESCE((%s), winning_bidder_id)' % (top_bid % 'bidder_id')
+    # Settlement is final: a closed auction keeps the price and winner it
+    # closed with.
+    sql += ' WHERE closed_at IS NULL'
+
+    params = []
+    if auction_event_ids is not None:
+        auction_event_ids = list(auction_event_ids)
+        if not auction_event_ids:
+            return 0
+        sql += ' AND id IN (%s)' % ', '.join(['%s'] * len(auction_event_ids))
+        params = auction_event_ids
+
+    cursor = connection.cursor()
+    cursor.execute(sql, params)
+    transaction.commit_unless_managed()
+    return cursor.rowcount
@@ -1,23 +1,38 @@
 import datetime
-import hashlib
+import urllib
 
 from decimal import Decimal
 
-from django.http import HttpResponse, HttpResponseRedirect, Http404
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseNotAllowed, HttpResponseRedirect, Http404, QueryDict
 from django.shortcuts import render_to_response
 from django.template import RequestContext
 
 from django.contrib.auth import authenticate, login, logout
-from django.contrib.auth.decorators import login_required
+from django.contrib.auth.decorators import login_required, user_passes_test
 from django.core.urlresolvers import reverse
-from django.core.paginator import Paginator
+from django.core.paginator import Paginator, EmptyPage, InvalidPage
 from django.db.models import Q
 from django.forms.models import modelformset_factory
-
-from lebay.apps.lebay.forms import UserRegistrationForm, UserLoginForm, SellerProfileForm, ItemForm, AuctionEventForm, BidForm, UserProfileEditForm, PasswordChangeForm, AuctionSearchForm, PaymentForm, SalesForm
-from lebay.apps.lebay.models import Seller, AuctionEvent, Item, User, ItemCategory, Sales
-from lebay.apps.lebay.constants import AUCTION_EVENT_SORTING_CHOICES, AUCTION_EVENT_SORTING_TITLE, AUCTION_ITEM_STATUS_RUNNING, AUCTION_ITEM_STATUS_IDLE, AUCTION_ITEM_STATUS_SOLD
-from lebay.apps.lebay.utils import process_ended_auction
+from django.utils import simplejson
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.views.decorators.cache import never_cache
+from django.views.decorators.http import condition
+
+from lebay.apps.lebay.forms import AuctionBrowseForm, UserRegistrationForm, UserLoginForm, SellerProfileForm, ItemForm, AuctionEventForm, BidForm, UserProfileEditForm, PasswordChangeForm, AuctionSearchForm, PaymentForm, SalesForm, ListingImportForm, HistoryExportForm, ProxyBidForm
+from lebay.apps.lebay.models import Seller, AuctionEvent, Item, User, ItemCategory, ProxyBid
+from lebay.apps.lebay.constants import AUCTION_EVENT_CLOSED_CACHE_SECONDS, AUCTION_EVENT_LIVE_TIMEOUT, AUCTION_EVENT_LIVE_POLL_SECONDS, AUCTION_EVENT_SORTING_CHOICES, AUCTION_EVENT_SORTING_TITLE, AUCTION_EVENT_SORTING_END_TIME_ASC, AUCTION_ITEM_STATUS_RUNNING, DASHBOARD_PAGE_SIZE, HISTORY_EXPORT_FORMAT_CSV, HISTORY_EXPORT_MIMETYPES
+from lebay.apps.lebay.orderbook import get_order_book
+from lebay.apps.lebay.search import get_auction_events
+from lebay.apps.lebay.pagination import CountedPaginator, KeysetPaginator, get_requested_page
+from lebay.apps.lebay.dashboard import DASHBOARD_SECTIONS, get_dashboard
+from lebay.apps.lebay.fragments import fragment_cache
+from lebay.apps.lebay.live import LIVE_LONG_POLL, live_publisher, get_live_data
+from lebay.apps.lebay.importing import import_listings
+from lebay.apps.lebay.exporting import export_history
+from lebay.apps.lebay.payments import parse_time_modified, update_payment_statuses, record_sale, get_seller_sales
+from lebay.apps.lebay.profiling import request_profiles
+from lebay.apps.lebay.replication import read_only
+from lebay.apps.lebay.archiving import SalesHistory, find_auction_event, find_last_modified, get_archived_auction_event, get_bid_history
 
 def index(request):
     if request.user.is_authenticated():
@@ -86,6 +101,7 @@ def edit_user_profile(request):
     }, context_instance=RequestContext(request))
 
 @login_required
+@read_only
 def view_user_profile(request, user_id):
     try:
         user = User.objects.get(pk=user_id)
@@ -98,14 +114,16 @@ def view_user_profile(request, user_id):
 
 @login_required
 def view_user_home(request):
-    current_auctions = AuctionEvent.objects.filter(item__seller=request.user.user, item__status=AUCTION_ITEM_STATUS_RUNNING)
-    won_auctions = AuctionEvent.objects.filter(winning_bidder=request.user.user, item__status=AUCTION_ITEM_STATUS_SOLD)
-    listable_items = Item.objects.filter(seller=request.user.user, status=AUCTION_ITEM_STATUS_IDLE)
-    
     return render_to_response('lebay/view_user_home.html', {
-        'current_auctions': current_auctions,
-        'won_auctions': won_auctions,
-        'listable_items': listable_items,
+        'dashboard': get_dashboard(request.user.user),
+    }, context_instance=RequestContext(request))
+
+@login_required
+def view_user_section(request, section):
+    get_objects = DASHBOARD_SECTIONS[section]
+    return render_to_response('lebay/view_user_section.html', {
+        'section': section,
+        'page': get_requested_page(request, Paginator(get_objects(request.user.user), DASHBOARD_PAGE_SIZE)),
     }, context_instance=RequestContext(request))
 
 @login_required
@@ -179,7 +197,7 @@ def list_item(request):
         auction_form = AuctionEventForm(data=request.POST)
         
         if item_form.is_valid() and auction_form.is_valid():
-            item = item_form.save()
+            item = item_form.save(commit=False)
             auction_event = auction_form.save(item=item)
             return HttpResponseRedirect(reverse('lebay_view_auction_event', args=[auction_event.id])) 
     else:
@@ -191,6 +209,25 @@ def list_item(request):
         'auction_form': auction_form
     }, context_instance=RequestContext(request))        
 
+@login_required
+def bulk_list_items(request):
+    if not Seller.objects.filter(user=request.user.user).count():
+        return HttpResponseRedirect(reverse('lebay_create_seller_profile') + '?next=%s' % reverse('lebay_bulk_list_items'))
+
+    result = None
+    if request.method == 'POST':
+        import_form = ListingImportForm(request.POST, request.FILES)
+        if import_form.is_valid():
+            result = import_listings(request.user.user, import_form.cleaned_data['file'], import_form.cleaned_data['format'])
+            import_form = ListingImportForm()
+    else:
+        import_form = ListingImportForm()
+
+    return render_to_response('lebay/bulk_list_items.html', {
+        'import_form': import_form,
+        'result': result,
+    }, context_instance=RequestContext(request))
+
 @login_required
 def list_existing_item(request, item_id=None):
     try:
@@ -215,20 +252,37 @@ def list_existing_item(request, item_id=None):
         'auction_form': auction_form
     }, context_instance=RequestContext(request))        
 
+@read_only
 def view_categories(request):
-    categories = ItemCategory.objects.all()
+    categories = ItemCategory.objects.order_by('path')
     return render_to_response('lebay/view_categories.html', {
         'categories': categories,
     }, context_instance=RequestContext(request))        
 
+@read_only
 def view_category(request, category_id):
     try:
         category = ItemCategory.objects.get(pk=category_id)
     except ItemCategory.DoesNotExist:
         raise Http404
     
-    auction_events = AuctionEvent.objects.get_current_auctions().filter(item__category=category)
-    auction_paginator = Paginator(auction_events, 10)
+    auction_events = AuctionEvent.objects.get_current_category_auctions(category).for_listing()
+    auction_paginator = KeysetPaginator(auction_events, dict(AUCTION_EVENT_SORTING_CHOICES)[AUCTION_EVENT_SORTING_END_TIME_ASC], 10, count=category.live_auction_count)
+    auction_page = auction_paginator.page(request.GET.get('cursor'))
+
+    return render_to_response('lebay/view_category.html', {
+        'category': category,
+        'subcategories': ItemCategory.objects.filter(parent=category).order_by('path'),
+        'auction_page': auction_page,
+    }, context_instance=RequestContext(request))        
+
+@read_only
+def search_auction_events(request):
+    form = AuctionSearchForm(data=request.method == 'POST' and request.POST or request.GET)
+    if not form.is_valid() or not form.cleaned_data.get('query'):
+        return HttpResponseRedirect(reverse('lebay_view_auction_events'))
+
+    search_paginator = Paginator(form.search(), 10)
 
     try:
         page = int(request.GET.get('page', '1'))
@@ -236,74 +290,137 @@ def view_category(request, category_id):
         page = 1
 
     try:
-        auction_page = auction_paginator.page(page)
+        search_page = search_paginator.page(page)
     except (EmptyPage, InvalidPage):
-        auction_page = auction_paginator.page(post_paginator.num_pages)
-    
-    return render_to_response('lebay/view_category.html', {
-        'category': category,
-        'auction_page': auction_page,
-    }, context_instance=RequestContext(request))        
+        search_page = search_paginator.page(search_paginator.num_pages)
 
-def search_auction_events(request):
-    if request.method == 'POST':
-        form = AuctionSearchForm(data=request.POST)
-        if form.is_valid():
-            matching_auctions = form.search()
-            return render_to_response('lebay/display_search_results.html', {
-                'matching_auctions': matching_auctions,
-            }, context_instance=RequestContext(request))
-        else:
-            return HttpResponseRedirect(reverse('lebay_view_auction_events'))
-    else:
-        return HttpResponseRedirect(reverse('lebay_view_auction_events'))
+    return render_to_response('lebay/display_search_results.html', {
+        'query': form.cleaned_data['query'],
+        'matching_auctions': get_auction_events(search_page.object_list),
+        'search_page': search_page,
+        'page_query': '%s&' % urllib.urlencode({'query': form.cleaned_data['query'].encode('utf-8')}),
+    }, context_instance=RequestContext(request))
 
 @login_required
 def view_auction_event(request, auction_event_id=None):
     try:
-        auction_event = AuctionEvent.objects.get(pk=auction_event_id)
+        auction_event = AuctionEvent.objects.select_related('item').get(pk=auction_event_id)
     except AuctionEvent.DoesNotExist:
         raise Http404
 
+    order_book = get_order_book()
+    if order_book and order_book.get_book(auction_event.pk):
+        order_book.get_book(auction_event.pk).apply_to(auction_event)
+
+    form = BidForm(initial={'amount': auction_event.get_current_price() + Decimal('0.01')})
+    proxy_form = ProxyBidForm()
     if request.method == 'POST':
-        form = BidForm(data=request.POST, auction_event=auction_event, bidder=request.user.user)
-        if form.is_valid():
-            bid = form.save()
-            return HttpResponseRedirect(request.get_full_path())
-    else:
-        form = BidForm(initial={'amount': auction_event.get_current_price() + Decimal('0.01')})
+        if 'maximum' in request.POST:
+            proxy_form = ProxyBidForm(data=request.POST, auction_event=auction_event, bidder=request.user.user)
+            submitted_form = proxy_form
+        else:
+            form = BidForm(data=request.POST, auction_event=auction_event, bidder=request.user.user)
+            submitted_form = form
+        if submitted_form.is_valid():
+            result = submitted_form.save()
+            if result.accepted:
+                return HttpResponseRedirect(request.get_full_path())
+
+    proxy_bids = list(ProxyBid.objects.filter(auction_event=auction_event, bidder=request.user.pk)[:1])
+    proxy_bid = proxy_bids and proxy_bids[0] or None
     
     return render_to_response('lebay/view_auction.html', {
         'form': form,
+        'proxy_form': proxy_form,
+        'proxy_bid': proxy_bid,
         'auction_event': auction_event
     }, context_instance=RequestContext(request))
 
+@never_cache
+def watch_auction_event(request, auction_event_id=None):
+    try:
+        since = int(request.GET.get('since', '0'))
+    except ValueError:
+        since = 0
+
+    if LIVE_LONG_POLL:
+        state = live_publisher.wait(int(auction_event_id), since, AUCTION_EVENT_LIVE_TIMEOUT)
+        poll_after = 0
+    else:
+        state = live_publisher.wait(int(auction_event_id), since, 0)
+        poll_after = AUCTION_EVENT_LIVE_POLL_SECONDS
+    if state is None:
+        raise Http404
+    sequence, payload = state
+    data = get_live_data(sequence, payload)
+    data['poll_after'] = poll_after
+    return HttpResponse(simplejson.dumps(data), mimetype='application/json')
+
+def get_ended_auction_event_last_modified(request, auction_event_id=None):
+    return find_last_modified(auction_event_id)
+
+# Stays on the primary: a lagging replica could render an auction older
+# than the Last-Modified read from the primary, and browsers would keep it.
 @login_required
+@condition(last_modified_func=get_ended_auction_event_last_modified)
 def view_ended_auction_event(request, auction_event_id=None):
     try:
-        auction_event = AuctionEvent.objects.get(pk=auction_event_id)
+        auction_event = find_auction_event(auction_event_id)
     except AuctionEvent.DoesNotExist:
         raise Http404
-    
-    if not auction_event.is_running():
-        process_ended_auction(auction_event)
 
-    return render_to_response('lebay/view_ended_auction.html', {
+    response = render_to_response('lebay/view_ended_auction.html', {
         'auction_event': auction_event
     }, context_instance=RequestContext(request))
+    if auction_event.is_closed():
+        patch_cache_control(response, private=True, max_age=AUCTION_EVENT_CLOSED_CACHE_SECONDS)
+        patch_vary_headers(response, ('Cookie',))
+    return response
 
+@read_only
 def view_auction_events(request):
     try:
-        auction_events = AuctionEvent.objects.get_current_auctions().filter(~Q(item__seller=request.user.user))
+        auction_events = AuctionEvent.objects.get_current_auctions().for_listing().filter(~Q(item__seller=request.user.user))
     except Exception, e:
-        auction_events = AuctionEvent.objects.get_current_auctions()
+        auction_events = AuctionEvent.objects.get_current_auctions().for_listing()
 
-    if request.GET:
-        sort_by = request.GET.get('sort_by', '')
-        if sort_by not in AUCTION_EVENT_SORTING_CHOICES:
-            sort_by = AUCTION_EVENT_SORTING_TITLE
-        auction_events = auction_events.order_by(dict(AUCTION_EVENT_SORTING_CHOICES)[sort_by])
-    auction_paginator = Paginator(auction_events, 10)
+    sort_by = request.GET.get('sort_by', '')
+    if sort_by not in dict(AUCTION_EVENT_SORTING_CHOICES):
+        sort_by = AUCTION_EVENT_SORTING_TITLE
+    # No total: the facet counts include the viewer's own auctions and
+    # ones not yet started or closed, which this page leaves out.
+    auction_paginator = KeysetPaginator(auction_events, dict(AUCTION_EVENT_SORTING_CHOICES)[sort_by], 10)
+    auction_page = auction_paginator.page(request.GET.get('cursor'))
+
+    return render_to_response('lebay/view_auctions.html', {
+        'auction_page': auction_page,
+        'page_query': 'sort_by=%s&' % sort_by,
+    }, context_instance=RequestContext(request)) 
+
+def get_facet_query(query, key, value, keep_filters=True):
+    if keep_filters:
+        query = query.copy()
+    else:
+        query = QueryDict('', mutable=True)
+    for unused_key in ('page', key):
+        if unused_key in query:
+            del query[unused_key]
+    if value is not None:
+        query[key] = value
+    return query.urlencode()
+
+@read_only
+def browse_auction_events(request):
+    form = AuctionBrowseForm(data=request.GET)
+    if not form.is_valid():
+        return HttpResponseRedirect(reverse('lebay_browse_auction_events'))
+
+    facets = form.get_facets()
+    try:
+        auction_events = form.browse(facets, user=request.user.user)
+    except Exception, e:
+        auction_events = form.browse(facets)
+    auction_paginator = CountedPaginator(auction_events, 10, facets.get_total())
 
     try:
         page = int(request.GET.get('page', '1'))
@@ -313,28 +430,36 @@ def view_auction_events(request):
     try:
         auction_page = auction_paginator.page(page)
     except (EmptyPage, InvalidPage):
-        auction_page = auction_paginator.page(post_paginator.num_pages)
-    
-    return render_to_response('lebay/view_auctions.html', {
-        'auction_page': auction_page
-    }, context_instance=RequestContext(request)) 
+        auction_page = auction_paginator.page(auction_paginator.num_pages)
 
+    return render_to_response('lebay/browse_auctions.html', {
+        'form': form,
+        'facets': facets,
+        'auction_page': auction_page,
+        'category_facets': [(category, count, get_facet_query(request.GET, 'category', category.pk)) for category, count in facets.get_category_counts()],
+        'condition_facets': [(label, count, get_facet_query(request.GET, 'condition', condition)) for condition, label, count in facets.get_condition_counts()],
+        'price_facets': [(label, count, get_facet_query(request.GET, 'price', price_bucket)) for price_bucket, label, count in facets.get_price_bucket_counts()],
+        'ending_soon_query': get_facet_query(request.GET, 'ending_soon', not facets.ending_soon and 'on' or None),
+        'clear_query': get_facet_query(request.GET, 'sort_by', request.GET.get('sort_by'), keep_filters=False),
+        'page_query': get_facet_query(request.GET, 'page', None) + '&',
+    }, context_instance=RequestContext(request))
+
+# Stays on the primary so the bid history fragment it caches is never one
+# rendered from a lagging replica.
 @login_required
 def view_bid_history(request, auction_event_id):
     try:
-        auction_event = AuctionEvent.objects.get(pk=auction_event_id)
+        auction_event = AuctionEvent.objects.select_related('item').get(pk=auction_event_id)
     except AuctionEvent.DoesNotExist:
-        raise Http404
+        try:
+            auction_event = get_archived_auction_event(auction_event_id)
+        except AuctionEvent.DoesNotExist:
+            raise Http404
     
-    bids = auction_event.bids.all()
-    if bids.count():
-        highest_bid = auction_event.bids.order_by('-amount')[0]
-    else:
-        highest_bid = None
+    bids = get_bid_history(auction_event)
 
     return render_to_response('lebay/view_bid_history.html', {
         'auction_event': auction_event,
-        'highest_bid': highest_bid,  
         'bids': bids,
     }, context_instance=RequestContext(request))
 
@@ -345,31 +470,33 @@ def pay_for_item(request, auction_event_id):
     except AuctionEvent.DoesNotExist:
         raise Http404
 
-    if auction_event.winning_bidder == request.user.user:
-        if not auction_event.is_paid():
-            if request.method == 'POST':
-                form = PaymentForm(request.POST)
-                if form.is_valid():
-                    invoice_hash = hashlib.md5()
-                    invoice_hash.update(str(auction_event.pk) + str(auction_event.winning_bidder.pk))
-                    
-                    sale_record = Sales()
-                    sale_record.auction_event = auction_event
-                    sale_record.invoice_number = invoice_hash.hexdigest()
-                    sale_record.save()
-                    return HttpResponseRedirect(reverse('lebay_user_home'))
-            else:
-                form = PaymentForm()
-
-            return render_to_response('lebay/pay_for_item.html', {
-                'form': form,
-                'auction_event': auction_event
+    if auction_event.winning_bidder_id == request.user.user.pk:
+        if auction_event.closed_at is None:
+            return render_to_response('error.html', {
+                'title': 'Payment Error',
+                'summary': "This auction has not closed yet.",
             }, context_instance=RequestContext(request))
+        if request.method == 'POST':
+            form = PaymentForm(request.POST)
+            if form.is_valid():
+                if record_sale(auction_event.pk, request.user.user):
+                    return HttpResponseRedirect(reverse('lebay_user_home'))
+                return render_to_response('error.html', {
+                    'title': 'Payment Error',
+                    'summary': "You have already paid for this item.",
+                }, context_instance=RequestContext(request))
+        elif not auction_event.is_paid():
+            form = PaymentForm()
         else:
             return render_to_response('error.html', {
                 'title': 'Payment Error',
                 'summary': "You have already paid for this item.",
             }, context_instance=RequestContext(request))
+
+        return render_to_response('lebay/pay_for_item.html', {
+            'form': form,
+            'auction_event': auction_event
+        }, context_instance=RequestContext(request))
     else:
         return render_to_response('error.html', {
             'title': 'Payment Error',
@@ -378,19 +505,78 @@ def pay_for_item(request, auction_event_id):
 
 @login_required
 def manage_payments(request):
-    sales = Sales.objects.filter(auction_event__item__seller=request.user.user)
+    sales = SalesHistory(get_seller_sales(request.user.user), request.user.user)
+    sales_page = get_requested_page(request, Paginator(sales, DASHBOARD_PAGE_SIZE))
     sales_formset = []
+    summary = None
     if request.method == "POST":
         forms_are_valid = True
-        for sale in sales:
+        for sale in sales_page.object_list:
+            if getattr(sale, 'archived', False):
+                sales_formset.append({'sale': sale, 'form': None})
+                continue
             sale_form = SalesForm(data=request.POST, instance=sale, prefix=sale.pk)
-            if sale_form.is_valid():
-                sale_form.save()
-                return HttpResponseRedirect(reverse('lebay_manage_payments'))
-    else:
-        for sale in sales:
-            sale_form = SalesForm(instance=sale, prefix=sale.pk)
+            forms_are_valid = sale_form.is_valid() and forms_are_valid
+            sales_formset.append({'sale': sale, 'form': sale_form})
+        if forms_are_valid:
+            changes = [(sales_data['sale'].invoice_number, sales_data['form'].cleaned_data['payment_status'], sales_data['form'].cleaned_data['time_modified']) for sales_data in sales_formset if sales_data['form'] and sales_data['form'].cleaned_data['payment_status'] != sales_data['sale'].payment_status]
+            summary = update_payment_statuses(request.user.user, changes)
+            if not summary.rejected:
+                return HttpResponseRedirect('%s?page=%s' % (reverse('lebay_manage_payments'), sales_page.number))
+            sales_page = get_requested_page(request, Paginator(sales, DASHBOARD_PAGE_SIZE))
+            sales_formset = []
+    if not sales_formset:
+        for sale in sales_page.object_list:
+            # Archived sales are settled and shown read only.
+            sale_form = None
+            if not getattr(sale, 'archived', False):
+                sale_form = SalesForm(instance=sale, prefix=sale.pk)
             sales_formset.append({'sale': sale, 'form': sale_form})
     return render_to_response("lebay/manage_payments.html", {
         'sales_formset': sales_formset,
+        'sales_page': sales_page,
+        'summary': summary,
+    }, context_instance=RequestContext(request))
+
+@login_required
+def update_payments(request):
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    changes = []
+    try:
+        for change in simplejson.loads(request.raw_post_data):
+            time_modified = None
+            if change.get('time_modified'):
+                time_modified = parse_time_modified(change['time_modified'])
+            changes.append((change['invoice_number'], change['payment_status'], time_modified))
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return HttpResponseBadRequest('Expected a JSON list of objects with invoice_number, payment_status and optionally time_modified.', mimetype='text/plain')
+    summary = update_payment_statuses(request.user.user, changes)
+    return HttpResponse(simplejson.dumps(summary.as_dict()), mimetype='application/json')
+
+@login_required
+def export_seller_history(request, name):
+    export_form = HistoryExportForm(data=request.GET)
+    if not export_form.is_valid():
+        return HttpResponseBadRequest(export_form.errors.as_text(), mimetype='text/plain')
+    format = export_form.cleaned_data['format'] or HISTORY_EXPORT_FORMAT_CSV
+    response = HttpResponse(export_history(name, request.user.user, format, export_form.cleaned_data['start_date'], export_form.cleaned_data['end_date']), mimetype=HISTORY_EXPORT_MIMETYPES[format])
+    response['Content-Disposition'] = 'attachment; filename=%s.%s' % (name, format)
+    return response
+
+@user_passes_test(lambda user: user.is_staff)
+def view_fragment_cache_stats(request):
+    return HttpResponse(simplejson.dumps(fragment_cache.get_stats()), mimetype='application/json')
+
+@user_passes_test(lambda user: user.is_staff)
+def view_request_profiles(request):
+    if request.GET.get('format') == 'jsonl':
+        response = HttpResponse(['%s\n' % simplejson.dumps(profile.as_dict()) for profile in request_profiles.get_profiles()], mimetype='application/x-ndjson')
+        response['Content-Disposition'] = 'attachment; filename=request_profiles.jsonl'
+        return response
+    return render_to_response('lebay/view_request_profiles.html', {
+        'total': request_profiles.total,
+        'summaries': request_profiles.get_view_summaries(),
+        'slowest': request_profiles.get_slowest(),
+        'fragment_stats': fragment_cache.get_stats(),
     }, context_instance=RequestContext(request))